@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+Measure the write throughput of rendered pages: the old codecs writes with
+a directory check per page, and the output writer with and without threads.
+
+    python benchmarks/bench_output.py [--pages N] [--threads N,...]
+"""
+import os
+import sys
+import time
+import codecs
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from woklib.output import OutputWriter
+
+
+def make_pages(count, dirs=100):
+    """Get paths and text of small pages spread over some directories."""
+    text = u'<html><body><p>Page {0} \xe4\xf6\xfc</p>' + u'x' * 1000 + \
+        u'</body></html>\n'
+    return [(os.path.join('d{0}'.format(i % dirs), 'p{0}.html'.format(i)),
+             text.format(i)) for i in range(count)]
+
+
+def write_codecs(output, pages):
+    """Write pages like earlier wok versions."""
+    for name, text in pages:
+        path = os.path.join(output, name)
+        parent = os.path.dirname(path)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        with codecs.open(path, 'w', 'utf-8') as f:
+            f.write(text)
+
+
+def write_writer(output, pages, threads):
+    """Write pages with an output writer."""
+    writer = OutputWriter(threads=threads)
+    try:
+        for name, text in pages:
+            writer.write(os.path.join(output, name), text.encode('utf-8'))
+    finally:
+        writer.close()
+
+
+def run(name, func, pages, *args):
+    """Time one way of writing into a fresh output directory."""
+    tmp_path = tempfile.mkdtemp()
+    try:
+        output = os.path.join(tmp_path, 'output')
+        start = time.time()
+        func(output, pages, *args)
+        duration = time.time() - start
+    finally:
+        shutil.rmtree(tmp_path)
+    print('{0:<20} {1:8.3f}s {2:10.0f} pages/s'.format(name, duration,
+          len(pages) / duration))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--pages', type=int, default=50000,
+            help='number of pages to write (default: 50000)')
+    parser.add_argument('--threads', default='0,1,2,4',
+            help='comma separated thread counts of the writer '
+                 '(default: 0,1,2,4)')
+    args = parser.parse_args()
+    pages = make_pages(args.pages)
+    run('codecs', write_codecs, pages)
+    for threads in args.threads.split(','):
+        run('writer threads={0}'.format(threads), write_writer, pages,
+            int(threads))
+
+
+if __name__ == '__main__':
+    main()
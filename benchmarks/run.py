@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+Benchmark the build phases of a synthetic site and compare the results
+with a baseline.
+
+Builds a generated site several times and keeps the fastest time of each
+build phase, of the paginated pages and of the content page loading and
+markup rendering. Times are wall clock seconds.
+
+    python benchmarks/run.py --save benchmarks/baseline.json
+    python benchmarks/run.py --compare benchmarks/baseline.json
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from woklib.engine import Engine
+from woklib.profiler import wall_clock
+import sitegen
+
+
+class BenchEngine(Engine):
+    """Engine keeping the profile of the build instead of reporting it."""
+
+    def report_profile(self):
+        """Keep the timings."""
+        self.build_profile, self.profiler = self.profiler, None
+        self.build_profile.stop()
+
+
+def build(site, options):
+    """Build the site. Returns the engine and the timings of the build."""
+    output = os.path.join(site, 'output')
+    if os.path.isdir(output):
+        shutil.rmtree(output)
+    engine = BenchEngine(site)
+    engine.run(options=dict(options, profile=True))
+    profile = engine.build_profile
+    results = {'build': profile.total.wall}
+    for name in profile.phases:
+        results['phase.' + name] = profile.timings['phase'][name].wall
+    # the pages of pagination sets, each with its part of the list
+    paginated = [p.meta['url'] for p in engine.all_pages
+                 if is_paginated(p)]
+    results['pages.paginated'] = sum(profile.timings['page'][url].wall
+        for url in paginated if url in profile.timings['page'])
+    return engine, results
+
+
+def is_paginated(page):
+    """Check if a page paginates a list or shows a part of one. Every
+    page has pagination metadata, with a single page by default."""
+    pagination = page.meta.get('pagination') or {}
+    return 'list' in pagination or 'page_items' in pagination
+
+
+def load_pages(engine, site):
+    """Time loading the content files, without and with their markup.
+    Returns the results by renderer name."""
+    results = {}
+    orig_dir = os.getcwd()
+    os.chdir(site)
+    try:
+        start = wall_clock()
+        pages = [engine.load_page(p.path, False)
+                 for p in engine.content_pages]
+        results['page.from_file'] = wall_clock() - start
+        for page in pages:
+            page.read_body()
+        by_renderer = {}
+        for page in pages:
+            by_renderer.setdefault(page.renderer.__name__, []).append(page)
+        for name, group in sorted(by_renderer.items()):
+            start = wall_clock()
+            for page in group:
+                page.renderer.render(page.original)
+            results['renderer.' + name] = wall_clock() - start
+    finally:
+        os.chdir(orig_dir)
+    return results
+
+
+def run(site_options, engine_options, repeat):
+    """Generate a site and benchmark it. Returns the fastest time of
+    every benchmark."""
+    tmp_path = tempfile.mkdtemp()
+    try:
+        site = os.path.join(tmp_path, 'site')
+        sitegen.generate_site(site, **site_options)
+        best = {}
+        for i in range(repeat):
+            engine, results = build(site, engine_options)
+            results.update(load_pages(engine, site))
+            for name, value in results.items():
+                best[name] = min(value, best.get(name, value))
+        return best
+    finally:
+        shutil.rmtree(tmp_path)
+
+
+def compare(results, baseline, threshold, min_time):
+    """Print a comparison with the baseline results. Returns the names
+    of the regressed benchmarks."""
+    regressions = []
+    print('{0:<30} {1:>10} {2:>10} {3:>8}'.format('benchmark', 'baseline',
+          'current', 'change'))
+    for name in sorted(set(results) | set(baseline)):
+        if name not in results or name not in baseline:
+            print('{0:<30} {1:>10} {2:>10}'.format(name,
+                  format_time(baseline.get(name)),
+                  format_time(results.get(name))))
+            continue
+        base, current = baseline[name], results[name]
+        change = (current - base) / base if base else 0.0
+        flag = ''
+        if change > threshold and current - base > min_time:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        print('{0:<30} {1:>10} {2:>10} {3:>+7.1%} {4}'.format(name,
+              format_time(base), format_time(current), change, flag))
+    return regressions
+
+
+def format_time(value):
+    """Format seconds, or a dash if missing."""
+    if value is None:
+        return '-'
+    return '{0:.4f}s'.format(value)
+
+
+def parse_args():
+    """Parse the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    group = parser.add_argument_group('Site',
+            'The options of the generated site.')
+    for name, value in sorted(sitegen.Defaults.items()):
+        group.add_argument('--' + name.replace('_', '-'), dest=name,
+                type=type(value), default=value,
+                help='(default: {0})'.format(value))
+    parser.add_argument('--jobs', type=int, default=1,
+            help='number of worker processes of the builds (default: 1)')
+    parser.add_argument('--repeat', type=int, default=3,
+            help='number of builds, the fastest times count (default: 3)')
+    parser.add_argument('--save', metavar='FILE',
+            help='save the results as new baseline')
+    parser.add_argument('--compare', metavar='FILE',
+            help='compare the results with a baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+            help='relative slowdown reported as regression (default: 0.25)')
+    parser.add_argument('--min-time', type=float, default=0.01,
+            help='smaller slowdowns in seconds are ignored (default: 0.01)')
+    return parser.parse_args()
+
+
+def main():
+    """Run the benchmarks. Exits with status 1 on regressions."""
+    args = parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    site_options = dict((name, getattr(args, name))
+                        for name in sitegen.Defaults)
+    engine_options = {'jobs': args.jobs}
+    results = run(site_options, engine_options, args.repeat)
+    data = {
+        'site': site_options,
+        'engine': engine_options,
+        'python': platform.python_version(),
+        'results': results,
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+            f.write('\n')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for key in ('site', 'engine'):
+            if baseline.get(key) != data[key]:
+                print('Warning: the baseline has other {0} options: '
+                      '{1}'.format(key, baseline.get(key)))
+        regressions = compare(results, baseline['results'], args.threshold,
+                              args.min_time)
+        if regressions:
+            print('{0} regressions'.format(len(regressions)))
+            sys.exit(1)
+    elif not args.save:
+        for name, value in sorted(results.items()):
+            print('{0:<30} {1:>10}'.format(name, format_time(value)))
+
+
+if __name__ == '__main__':
+    main()
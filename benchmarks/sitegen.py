@@ -0,0 +1,218 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Generate synthetic wok sites for benchmarks.
+
+The same options and seed always give the same site: the page tree with
+its categories, tags, dates and texts, the paginated lists and the media
+files.
+"""
+import io
+import os
+import random
+import hashlib
+from datetime import datetime, timedelta
+
+# Default options of generated sites.
+Defaults = {
+    # number of content pages, besides the category and tag index pages
+    'pages': 500,
+    # depth of the category tree, and number of sub categories per category
+    'depth': 2,
+    'fanout': 4,
+    # number of distinct tags, and tags per page
+    'tags': 20,
+    'tags_per_page': 3,
+    # markup of the content pages: mkd, rst or txt
+    'markup': 'mkd',
+    # paragraphs per page
+    'paragraphs': 6,
+    # number of paginated tag index pages, and items per pagination page
+    'pagination': 5,
+    'limit': 10,
+    # number of media files and their size in bytes
+    'media_files': 20,
+    'media_size': 64 * 1024,
+    'seed': 0,
+}
+
+Words = (u'lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         u'eiusmod tempor incididunt ut labore et dolore magna aliqua enim '
+         u'ad minim veniam quis nostrud exercitation ullamco laboris nisi '
+         u'aliquip ex ea commodo consequat duis aute irure in reprehenderit '
+         u'voluptate velit esse cillum fugiat nulla pariatur caf\xe9 '
+         u'na\xefve \xfcber').split()
+
+Code = u'''def fib(n):
+    """Fibonacci numbers."""
+    a, b = 0, 1
+    for i in range(n):
+        a, b = b, a + b
+    return a'''
+
+Templates = {
+    'base.html': u'''<!DOCTYPE html>
+<html>
+<head><title>{{ page.title }} - {{ site.title }}</title></head>
+<body>
+<nav>
+{% for name in site.categories %}<a href="/{{ name }}/">{{ name }}</a> {% endfor %}
+</nav>
+{% block body %}{% endblock %}
+</body>
+</html>
+''',
+    'default.html': u'''{% extends "base.html" %}
+{% block body %}
+<h1>{{ page.title }}</h1>
+<p>{{ page.date }} by {{ page.author.name }}</p>
+{{ page.content }}
+<ul>
+{% for tag in page.tags %}<li>{{ tag }} ({{ site.tags[tag]|length }})</li>{% endfor %}
+</ul>
+{% if pagination %}
+<p>Page {{ pagination.cur_page }} of {{ pagination.num_pages }}</p>
+{% for item in pagination.page_items %}
+<h2><a href="{{ item.url }}">{{ item.title }}</a></h2>
+{{ item.preview }}
+{% endfor %}
+{% if pagination.prev_page %}<a href="{{ pagination.prev_page.url }}">Previous</a>{% endif %}
+{% if pagination.next_page %}<a href="{{ pagination.next_page.url }}">Next</a>{% endif %}
+{% else %}
+<ul>
+{% for subpage in page.subpages %}<li><a href="{{ subpage.url }}">{{ subpage.title }}</a></li>{% endfor %}
+</ul>
+{% endif %}
+{% endblock %}
+''',
+}
+
+
+def words(rng, count):
+    """Get some random words."""
+    return u' '.join(rng.choice(Words) for _ in range(count))
+
+
+def title(rng):
+    """Get a random title."""
+    return words(rng, rng.randint(2, 6)).capitalize()
+
+
+def make_body(rng, markup, paragraphs):
+    """Get the text of a page with a preview, headings, lists and code."""
+    parts = [words(rng, rng.randint(20, 60)), u'---']
+    for i in range(paragraphs):
+        heading = title(rng)
+        if markup == 'mkd':
+            parts.append(u'## ' + heading)
+        elif markup == 'rst':
+            parts.append(heading + u'\n' + u'-' * len(heading))
+        else:
+            parts.append(heading)
+        parts.append(words(rng, rng.randint(30, 120)))
+        if i % 3 == 1:
+            parts.append(u'\n'.join(u'* ' + words(rng, rng.randint(3, 10))
+                for _ in range(rng.randint(2, 6))))
+        elif i % 3 == 2:
+            if markup == 'mkd':
+                parts.append(u'    :::python\n' + u'\n'.join(
+                    u'    ' + line for line in Code.splitlines()))
+            elif markup == 'rst':
+                parts.append(u'::\n\n' + u'\n'.join(
+                    u'    ' + line for line in Code.splitlines()))
+            else:
+                parts.append(Code)
+    return u'\n\n'.join(parts) + u'\n'
+
+
+def make_categories(depth, fanout):
+    """Get the category paths of the category tree, parents first."""
+    paths = []
+    level = [[]]
+    for i in range(depth):
+        level = [path + [u'-'.join([path[-1] if path else u'c', str(j)])]
+                 for path in level for j in range(fanout)]
+        paths.extend(level)
+    return paths
+
+
+def write(path, text):
+    """Write a text file, creating its directory."""
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def header(meta):
+    """Get the YAML header of a page from a list of key, value pairs.
+    Empty values are left out."""
+    return u''.join(u'{0}: {1}\n'.format(key, value)
+                    for key, value in meta if value)
+
+
+def generate_site(path, **options):
+    """Generate a site in the given directory. Returns the options
+    used."""
+    options = dict(Defaults, **options)
+    rng = random.Random(options['seed'])
+    content = os.path.join(path, 'content')
+    write(os.path.join(path, 'wokconfig'),
+          u'site_title: Benchmark site\nauthor: Bench Mark\n')
+    for name, text in Templates.items():
+        write(os.path.join(path, 'templates', name), text)
+
+    # category index pages paginating their sub pages
+    start = datetime(2010, 1, 1)
+    categories = make_categories(options['depth'], options['fanout'])
+    for category in categories:
+        meta = [
+            (u'title', u'Category ' + category[-1]),
+            (u'slug', category[-1]),
+            (u'category', u'/'.join(category[:-1])),
+            (u'datetime', start.strftime('%Y-%m-%d %H:%M:%S')),
+        ]
+        text = header(meta) + (u'pagination:\n    list: page.subpages\n'
+            u'    limit: {0}\n    sort_key: datetime\n    sort_reverse: True\n'
+            .format(options['limit']))
+        write(os.path.join(content, u'index-' + category[-1] + u'.mkd'),
+              text + u'---\nAll pages of ' + category[-1] + u'.\n')
+
+    # tag index pages paginating the pages of a tag
+    tags = [u'tag{0}'.format(i) for i in range(options['tags'])]
+    for tag in tags[:options['pagination']]:
+        meta = [(u'title', u'Tag ' + tag), (u'slug', u'tag-' + tag)]
+        text = header(meta) + (u'pagination:\n    list: site.tags.{0}\n'
+            u'    limit: {1}\n    sort_key: title\n'
+            .format(tag, options['limit']))
+        write(os.path.join(content, u'tag-' + tag + u'.mkd'),
+              text + u'---\nPages tagged ' + tag + u'.\n')
+
+    ext = options['markup']
+    for i in range(options['pages']):
+        category = rng.choice(categories) if categories else []
+        page_tags = rng.sample(tags, min(options['tags_per_page'], len(tags)))
+        date = start + timedelta(minutes=rng.randint(0, 5 * 365 * 24 * 60))
+        meta = [
+            (u'title', title(rng)),
+            (u'slug', u'page-{0}'.format(i)),
+            (u'category', u'/'.join(category)),
+            (u'tags', u'[' + u', '.join(page_tags) + u']'),
+            (u'datetime', date.strftime('%Y-%m-%d %H:%M:%S')),
+        ]
+        body = make_body(rng, ext, options['paragraphs'])
+        write(os.path.join(content, *category + [u'page-{0}.{1}'.format(i,
+              ext)]), header(meta) + u'---\n' + body)
+
+    media = os.path.join(path, 'media')
+    for i in range(options['media_files']):
+        digest = hashlib.sha256('{0}-{1}'.format(options['seed'], i)
+                                .encode('ascii')).digest()
+        data = (digest * (options['media_size'] // len(digest) + 1))
+        filename = os.path.join(media, 'm{0}'.format(i % 10),
+                                'file{0}.bin'.format(i))
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'wb') as f:
+            f.write(data[:options['media_size']])
+    return options
@@ -0,0 +1,46 @@
+# -*- coding: iso-8859-1 -*-
+import os
+import time
+import shutil
+import tempfile
+from unittest import TestCase
+
+from woklib.cache import FileCache, make_key
+
+
+class TestFileCache(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_key(self):
+        self.assertEqual(make_key(u'a', u'b'), make_key(u'a', u'b'))
+        self.assertNotEqual(make_key(u'ab', u''), make_key(u'a', u'b'))
+
+    def test_get_set(self):
+        cache = FileCache(self.tmp_path, 1000)
+        key = make_key(u'text')
+        self.assertEqual(cache.get(key), None)
+        cache.set(key, u'<p>\xe4</p>')
+        self.assertEqual(cache.get(key), u'<p>\xe4</p>')
+        cache.set(key, u'<p>b</p>')
+        self.assertEqual(cache.get(key), u'<p>b</p>')
+
+    def test_prune(self):
+        cache = FileCache(self.tmp_path, 25)
+        keys = [make_key(str(i)) for i in range(4)]
+        for i, key in enumerate(keys):
+            cache.set(key, u'0123456789')
+            # make older entries less recently used
+            mtime = time.time() - 100 + i
+            os.utime(cache._filename(key), (mtime, mtime))
+        # use the oldest entry
+        self.assertEqual(cache.get(keys[0]), u'0123456789')
+        cache.prune()
+        self.assertEqual(cache.get(keys[0]), u'0123456789')
+        self.assertEqual(cache.get(keys[1]), None)
+        self.assertEqual(cache.get(keys[2]), None)
+        self.assertEqual(cache.get(keys[3]), u'0123456789')
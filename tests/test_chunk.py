@@ -0,0 +1,24 @@
+# -*- coding: iso-8859-1 -*-
+from unittest import TestCase
+
+from woklib.util import chunk, SliceView
+
+
+class TestChunk(TestCase):
+
+    def test_chunk(self):
+        items = list(range(5))
+        chunks = list(chunk(items, 2))
+        self.assertEqual(chunks, [[0, 1], [2, 3], [4]])
+        self.assertEqual([len(c) for c in chunks], [2, 2, 1])
+
+    def test_view(self):
+        view = SliceView(list(range(10)), 2, 6)
+        self.assertEqual(list(view), [2, 3, 4, 5])
+        self.assertEqual(view[0], 2)
+        self.assertEqual(view[-1], 5)
+        self.assertEqual(view[1:3], [3, 4])
+        self.assertRaises(IndexError, lambda: view[4])
+        self.assertTrue(4 in view)
+        self.assertFalse(6 in view)
+        self.assertNotEqual(view, [2, 3])
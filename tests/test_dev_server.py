@@ -0,0 +1,90 @@
+# -*- coding: iso-8859-1 -*-
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+try:
+    from httplib import HTTPConnection
+except ImportError:
+    # Python 3
+    from http.client import HTTPConnection
+
+from woklib.dev_server import (DevServer, DevRequestHandler,
+    ThreadedHTTPServer, LiveReload, inject_script, ReloadScript)
+
+
+class TestInjectScript(TestCase):
+
+    def test_body(self):
+        data = inject_script(b'<html><body>x</BODY></html>')
+        self.assertEqual(data,
+            b'<html><body>x' + ReloadScript + b'</BODY></html>')
+
+    def test_no_body(self):
+        self.assertEqual(inject_script(b'x'), b'x' + ReloadScript)
+
+
+class TestLiveReload(TestCase):
+
+    def test_wait(self):
+        live_reload = LiveReload()
+        self.assertEqual(live_reload.wait(0, 0.01), 0)
+        timer = threading.Timer(0.05, live_reload.notify)
+        timer.start()
+        self.assertEqual(live_reload.wait(0, 5), 1)
+        self.assertEqual(live_reload.wait(0, 0.01), 1)
+
+
+class TestDevServer(TestCase):
+
+    def setUp(self):
+        self.tmp_path = os.path.realpath(tempfile.mkdtemp())
+        with open(os.path.join(self.tmp_path, 'style.css'), 'wb') as f:
+            f.write(b'body {}')
+        self.pages = {
+            os.path.join(self.tmp_path, 'index.html'): (b'<body></body>', 0),
+        }
+        self.dev_server = DevServer(serv_dir=self.tmp_path,
+            get_page=lambda path: self.pages.get(path))
+        self.httpd = ThreadedHTTPServer(('localhost', 0), DevRequestHandler)
+        self.httpd.dev_server = self.dev_server
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.start()
+        self.conn = HTTPConnection('localhost', self.httpd.server_address[1])
+
+    def tearDown(self):
+        self.conn.close()
+        self.httpd.shutdown()
+        self.thread.join()
+        self.httpd.server_close()
+        shutil.rmtree(self.tmp_path)
+
+    def get(self, path, headers={}):
+        self.conn.request('GET', path, headers=headers)
+        response = self.conn.getresponse()
+        return response, response.read()
+
+    def test_memory(self):
+        response, data = self.get('/')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(data, b'<body>' + ReloadScript + b'</body>')
+        etag = response.getheader('ETag')
+        # same connection
+        response, data = self.get('/', {'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+        self.pages[os.path.join(self.tmp_path, 'index.html')] = (b'new', 1)
+        response, data = self.get('/', {'If-None-Match': etag})
+        self.assertEqual(response.status, 200)
+
+    def test_file(self):
+        response, data = self.get('/style.css')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(data, b'body {}')
+
+    def test_reload(self):
+        response, data = self.get('/__wok__/reload?version=')
+        self.assertEqual(data, b'0')
+        self.dev_server.live_reload.notify()
+        response, data = self.get('/__wok__/reload?version=0')
+        self.assertEqual(data, b'1')
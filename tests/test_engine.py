@@ -1,3 +1,4 @@
+import importlib
 import os
 import shutil
 import sys
@@ -6,6 +7,7 @@ from unittest import TestCase
 
 from woklib import renderers
 from woklib.engine import Engine
+from woklib.page import Page
 
 
 DefaultRenderers = {}
@@ -85,3 +87,238 @@ class TestEngine(TestCase):
         self.assertDictContainsSubset(DefaultRenderers, e.renderers)
         self.assertIn('html', e.renderers)
         self.assertEqual(e.renderers['html'], 'class')
+
+
+def write_file(path, text):
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def read_file(path):
+    with open(path) as f:
+        return f.read()
+
+
+class TestRebuild(TestCase):
+
+    def setUp(self):
+        self.tmp_path = os.path.realpath(tempfile.mkdtemp())
+        os.chdir(self.tmp_path)
+        Page.tmpl_env = None
+        write_file(os.path.join('templates', 'default.html'),
+            '{{ page.content }}|{{ page.subpages|length }}')
+        write_file(os.path.join('templates', 'other.html'),
+            'other {{ page.content }}')
+        write_file(os.path.join('content', 'a.txt'), 'title: A\n---\na')
+        write_file(os.path.join('content', 'b.txt'),
+            'title: B\ntype: other\n---\nb')
+        write_file(os.path.join('media', 'style.css'), 'body {}')
+        self.engine = Engine(self.tmp_path)
+        self.engine.read_options()
+        self.engine.sanity_check()
+        self.engine.resident = True
+        self.engine.generate_site()
+
+    def tearDown(self):
+        os.chdir('..')
+        shutil.rmtree(self.tmp_path)
+        Page.tmpl_env = None
+
+    def path(self, *parts):
+        return os.path.join(self.tmp_path, *parts)
+
+    def output(self, slug):
+        return read_file(self.path('output', slug + '.html'))
+
+    def rebuild(self, *parts):
+        self.engine.rebuild(set(self.path(*p.split('/')) for p in parts))
+
+    def test_content(self):
+        self.assertEqual(self.output('a'), 'a|0')
+        other = [p for p in self.engine.content_pages
+            if p.meta['slug'] == 'b'][0]
+        write_file(self.path('content', 'a.txt'), 'title: A\n---\nchanged')
+        write_file(self.path('content', 'c.txt'),
+            'title: C\ncategory: a\n---\nc')
+        self.rebuild('content/a.txt', 'content/c.txt')
+        self.assertEqual(self.output('a'), 'changed|1')
+        self.assertEqual(read_file(self.path('output', 'a', 'c.html')),
+            'c|0')
+        # unchanged pages are kept
+        self.assertIn(other, self.engine.content_pages)
+
+        os.unlink(self.path('content', 'c.txt'))
+        self.rebuild('content/c.txt')
+        self.assertEqual(self.output('a'), 'changed|0')
+        self.assertFalse(os.path.exists(self.path('output', 'a')))
+
+    def test_template(self):
+        write_file(self.path('templates', 'other.html'),
+            'new {{ page.content }}')
+        mtime = os.path.getmtime(self.path('output', 'a.html'))
+        self.rebuild('templates/other.html')
+        self.assertEqual(self.output('b'), 'new b')
+        self.assertEqual(os.path.getmtime(self.path('output', 'a.html')),
+            mtime)
+
+    def test_media(self):
+        write_file(self.path('media', 'style.css'), 'p {}')
+        write_file(self.path('media', 'img', 'a.png'), 'png')
+        self.rebuild('media/style.css', 'media/img/a.png')
+        self.assertEqual(read_file(self.path('output', 'style.css')), 'p {}')
+        self.assertEqual(read_file(self.path('output', 'img', 'a.png')),
+            'png')
+
+
+class TestRenderSite(TestCase):
+
+    def setUp(self):
+        self.tmp_path = os.path.realpath(tempfile.mkdtemp())
+        os.chdir(self.tmp_path)
+        Page.tmpl_env = None
+        write_file(os.path.join('templates', 'default.html'),
+            '{{ page.content }}{% for p in pagination.page_items %}'
+            '|{{ p.content }}{% endfor %}')
+        write_file(os.path.join('content', 'index.txt'),
+            'title: Index\npagination:\n  list: page.subpages\n'
+            '  limit: 1\n  sort_key: slug\n---\nindex')
+        for name in 'abc':
+            write_file(os.path.join('content', name + '.txt'),
+                'title: {0}\ncategory: index\n---\n{0}'.format(name))
+        # not listed by any pagination
+        write_file(os.path.join('content', 'd.txt'), 'title: d\n---\nd')
+        self.load_body = Page.load_body
+        self.release = Page.release
+        self.write = Page.write
+
+    def tearDown(self):
+        Page.load_body = self.load_body
+        Page.release = self.release
+        Page.write = self.write
+        os.chdir('..')
+        shutil.rmtree(self.tmp_path)
+        Page.tmpl_env = None
+        if '__hooks__' in sys.modules:
+            del sys.modules['__hooks__']
+
+    def test_markup_loaded_once(self):
+        loaded = []
+        def load_body(page):
+            loaded.append(os.path.basename(page.path))
+            return self.load_body(page)
+        Page.load_body = load_body
+        Engine(self.tmp_path).run()
+        self.assertEqual(sorted(loaded),
+            ['a.txt', 'b.txt', 'c.txt', 'd.txt', 'index.txt'])
+        self.assertEqual([read_file(os.path.join('output', name))
+            for name in ('index.html', 'index2.html', 'index3.html')],
+            ['index|a', 'index|b', 'index|c'])
+
+    def test_markup_released(self):
+        events = []
+        def load_body(page):
+            events.append(('load', os.path.basename(page.path)))
+            return self.load_body(page)
+        def release(page):
+            if page.path is not None:
+                events.append(('release', os.path.basename(page.path)))
+            return self.release(page)
+        def write(page):
+            events.append(('write', page.meta['url']))
+            return self.write(page)
+        Page.load_body = load_body
+        Page.release = release
+        Page.write = write
+        engine = Engine(self.tmp_path)
+        engine.run()
+        # every page is released once, the pages of the pagination set
+        # after its last page
+        self.assertEqual(sorted(name for event, name in events
+            if event == 'release'),
+            ['a.txt', 'b.txt', 'c.txt', 'd.txt', 'index.txt'])
+        last_write = events.index(('write', '/index3.html'))
+        for name in ('a.txt', 'b.txt', 'c.txt', 'index.txt'):
+            self.assertGreater(events.index(('release', name)), last_write)
+        self.assertFalse(any(p.meta._has_body()
+            for p in engine.content_pages))
+        self.assertEqual(read_file(os.path.join('output', 'd.html')), 'd')
+
+    def test_header_keys(self):
+        # header values are not hidden by the attributes of the metadata
+        write_file(os.path.join('templates', 'keys.html'),
+            '{{ page.release }} {{ page.load }} {{ page.has_body }} '
+            '{{ page.content }}')
+        write_file(os.path.join('content', 'e.txt'),
+            'title: e\ntype: keys\nrelease: 1.2\nload: heavy\n'
+            'has_body: no\n---\ne')
+        Engine(self.tmp_path).run()
+        self.assertEqual(read_file(os.path.join('output', 'e.html')),
+            '1.2 heavy False e')
+
+    def test_render_pre_hook(self):
+        write_file(os.path.join('hooks', '__hooks__.py'),
+            'def shout(options, page):\n'
+            '    page.original = page.original.upper()\n'
+            'hooks = {"page.render.pre": [shout]}\n')
+        # forget the hooks directories of earlier tests
+        if hasattr(importlib, 'invalidate_caches'):
+            importlib.invalidate_caches()
+        for jobs in (1, 2):
+            write_file('wokconfig', 'jobs: {0}\n'.format(jobs))
+            Engine(self.tmp_path).run()
+            self.assertEqual(read_file(os.path.join('output', 'd.html')),
+                'D')
+            self.assertEqual(read_file(os.path.join('output',
+                'index.html')), 'INDEX|A')
+
+
+class TestIncrementalBuild(TestCase):
+
+    def setUp(self):
+        self.tmp_path = os.path.realpath(tempfile.mkdtemp())
+        os.chdir(self.tmp_path)
+        Page.tmpl_env = None
+        write_file('wokconfig', 'incremental: true\nslug_from_filename: true\n')
+        write_file(os.path.join('templates', 'default.html'),
+            '{{ page.title }} by {{ page.info.author }}')
+        write_file(os.path.join('templates', 'list.html'),
+            '{% for p in site.tags.t %}{{ p.url }} by {{ p.info.author }} '
+            '{% endfor %}')
+        write_file(os.path.join('data', 'info.yaml'), 'author: Alice\n')
+        write_file(os.path.join('content', 'a.txt'),
+            'title: a\ntags: [t]\ninfo: !include data/info.yaml\n---\na')
+        write_file(os.path.join('content', 'x.txt'),
+            'title: x\ntype: list\ninfo: {}\n---\nx')
+
+    def tearDown(self):
+        os.chdir('..')
+        shutil.rmtree(self.tmp_path)
+        Page.tmpl_env = None
+
+    def build(self):
+        Engine(self.tmp_path).run()
+
+    def test_include_changed(self):
+        self.build()
+        self.assertEqual(read_file(os.path.join('output', 'a.html')),
+            'a by Alice')
+        write_file(os.path.join('data', 'info.yaml'), 'author: Bob\n')
+        self.build()
+        self.assertEqual(read_file(os.path.join('output', 'a.html')),
+            'a by Bob')
+        self.assertEqual(read_file(os.path.join('output', 'x.html')),
+            '/a.html by Bob ')
+
+    def test_source_renamed(self):
+        self.build()
+        self.assertEqual(read_file(os.path.join('output', 'x.html')),
+            '/a.html by Alice ')
+        os.rename(os.path.join('content', 'a.txt'),
+            os.path.join('content', 'b.txt'))
+        self.build()
+        self.assertEqual(read_file(os.path.join('output', 'x.html')),
+            '/b.html by Alice ')
+        self.assertFalse(os.path.exists(os.path.join('output', 'a.html')))
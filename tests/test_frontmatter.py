@@ -0,0 +1,69 @@
+# -*- coding: iso-8859-1 -*-
+import io
+import os
+import random
+import shutil
+import tempfile
+from unittest import TestCase
+
+from woklib.frontmatter import find_delimiter, read_header, split_body
+
+
+def split_text(text):
+    """Split normalized text like earlier wok versions."""
+    splits = text.split('\n---\n')
+    if len(splits) == 1:
+        return None, None, splits[0]
+    if len(splits) == 2:
+        return splits[0], None, splits[1]
+    return splits[0], splits[1], '\n'.join(splits[1:])
+
+
+def normalize(data):
+    """Decode with universal newlines."""
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+
+class TestFrontMatter(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_path, 'page.mkd')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def split(self, data, **kwargs):
+        with open(self.filename, 'wb') as f:
+            f.write(data)
+        with io.open(self.filename, 'rb') as f:
+            header, offset = read_header(f, **kwargs)
+        body = normalize(data[offset:])
+        preview, content = split_body(body)
+        if header is None:
+            self.assertEqual(preview, None)
+        return header, preview, content
+
+    def test_find_delimiter(self):
+        self.assertEqual(find_delimiter(u'a\n---\nb'), (1, 6))
+        self.assertEqual(find_delimiter(b'a\r\n---\r\nb'), (1, 8))
+        self.assertEqual(find_delimiter(b'---\n-----\n'), None)
+        self.assertEqual(find_delimiter(b'a\n---\r', end=5), None)
+
+    def test_crlf(self):
+        data = b'title: a\r\ntags: b\r\n---\r\npreview\r\n---\r\nbody\r\n'
+        self.assertEqual(self.split(data),
+            (u'title: a\ntags: b', u'preview', u'preview\nbody\n'))
+
+    def test_same_as_split(self):
+        rng = random.Random(0)
+        parts = [b'a', b'-', b'---', b'\n', b'\r', b'\r\n', b'\n---\n',
+            b'\r\n---\r\n', u'\xe4'.encode('utf-8')]
+        for i in range(2000):
+            data = b''.join(rng.choice(parts)
+                for _ in range(rng.randrange(20)))
+            expected = split_text(normalize(data))
+            for kwargs in ({}, {'blocksize': 1}, {'blocksize': 3},
+                    {'mmap_size': 1}):
+                self.assertEqual(self.split(data, **kwargs), expected,
+                    (data, kwargs))
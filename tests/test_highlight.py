@@ -0,0 +1,96 @@
+# -*- coding: iso-8859-1 -*-
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+
+from woklib import highlight
+from woklib.cache import FileCache
+from woklib.util import has_module
+
+Code = u'def f(x):\n    return x + 1\n'
+
+
+@unittest.skipIf(not has_module('pygments'), 'needs pygments')
+class TestHighlight(TestCase):
+
+    def setUp(self):
+        import pygments
+        from pygments.lexers import PythonLexer
+        from pygments.formatters import HtmlFormatter
+        self.pygments = pygments
+        self.lexer = PythonLexer()
+        self.formatter = HtmlFormatter()
+        self.count = 0
+        self.orig_highlight = pygments.highlight
+
+        def counting_highlight(*args):
+            self.count += 1
+            return self.orig_highlight(*args)
+        pygments.highlight = counting_highlight
+        self.tmp_path = tempfile.mkdtemp()
+        highlight.clear()
+
+    def tearDown(self):
+        self.pygments.highlight = self.orig_highlight
+        highlight.set_cache(None)
+        highlight.clear()
+        shutil.rmtree(self.tmp_path)
+
+    def test_memo(self):
+        expected = self.orig_highlight(Code, self.lexer, self.formatter)
+        for i in range(3):
+            self.assertEqual(highlight.highlight(Code, self.lexer,
+                self.formatter), expected)
+        self.assertEqual(self.count, 1)
+        highlight.clear()
+        highlight.highlight(Code, self.lexer, self.formatter)
+        self.assertEqual(self.count, 2)
+
+    def test_key(self):
+        from pygments.lexers import RubyLexer
+        from pygments.formatters import HtmlFormatter
+        key = highlight.make_key(Code, self.lexer, self.formatter)
+        self.assertEqual(key, highlight.make_key(Code, self.lexer,
+            HtmlFormatter()))
+        self.assertNotEqual(key, highlight.make_key(Code + u'\n',
+            self.lexer, self.formatter))
+        self.assertNotEqual(key, highlight.make_key(Code, RubyLexer(),
+            self.formatter))
+        self.assertNotEqual(key, highlight.make_key(Code, self.lexer,
+            HtmlFormatter(linenos=True)))
+
+    def test_file_cache(self):
+        highlight.set_cache(FileCache(self.tmp_path, 1000000))
+        expected = highlight.highlight(Code, self.lexer, self.formatter)
+        # a later build
+        highlight.clear()
+        self.assertEqual(highlight.highlight(Code, self.lexer,
+            self.formatter), expected)
+        self.assertEqual(self.count, 1)
+
+    def test_encoded(self):
+        from pygments.formatters import HtmlFormatter
+        formatter = HtmlFormatter(encoding='utf-8')
+        for i in range(2):
+            self.assertEqual(highlight.highlight(Code, self.lexer, formatter),
+                self.orig_highlight(Code, self.lexer, formatter))
+        self.assertEqual(self.count, 2)
+
+    @unittest.skipIf(not has_module('docutils'), 'needs docutils')
+    def test_rst(self):
+        from woklib.renderers import ReStructuredText
+        text = u'.. sourcecode:: python\n\n    x = 1\n'
+        first = ReStructuredText.render(text)
+        self.assertIn(u'class="highlight"', first)
+        self.assertEqual(ReStructuredText.render(text), first)
+        self.assertEqual(self.count, 1)
+
+    @unittest.skipIf(not has_module('markdown'), 'needs markdown')
+    def test_markdown(self):
+        from woklib.renderers import Markdown
+        text = u'    :::python\n    x = 1\n'
+        first = Markdown.render(text)
+        self.assertIn(u'class="codehilite"', first)
+        self.assertEqual(Markdown.render(text), first)
+        self.assertEqual(self.count, 1)
@@ -0,0 +1,139 @@
+# -*- coding: iso-8859-1 -*-
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from woklib.incremental import (RecordingOverlay, Fingerprinter,
+    DependencyGraph, accessed_keys, text_digest, text_file_digest)
+
+
+class FakePage(object):
+
+    def __init__(self, text, path=None, includes=(), **meta):
+        self.digest = text_digest(text)
+        self.path = path
+        self.includes = includes
+        self.meta = meta
+
+
+class TestRecordingOverlay(TestCase):
+
+    def test_access(self):
+        d = RecordingOverlay({}, {'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(d['a'], 1)
+        self.assertEqual(d.get('b'), 2)
+        self.assertEqual(d.get('x'), None)
+        # a missing key is a dependency too
+        self.assertEqual(accessed_keys(d), set(['a', 'b', 'x']))
+
+    def test_iterate(self):
+        d = RecordingOverlay({}, {'a': 1, 'b': 2})
+        list(d.items())
+        self.assertEqual(accessed_keys(d), set(['a', 'b']))
+
+    def test_layers(self):
+        shared = {'a': 1}
+        d = RecordingOverlay({}, shared)
+        d['a'] = 2
+        d['b'] = 3
+        self.assertEqual(d['a'], 2)
+        self.assertEqual(shared, {'a': 1})
+
+    def test_template_attributes(self):
+        from jinja2 import Template
+        d = RecordingOverlay({}, {'maps': 1, 'parents': 2, 'accessed': 3})
+        self.assertEqual(Template('{{ site.maps }} {{ site.parents }} '
+            '{{ site.accessed }}').render(site=d), '1 2 3')
+
+
+class TestFingerprinter(TestCase):
+
+    def test_pages(self):
+        a = FakePage('a', slug='a')
+        b = FakePage('b', slug='b')
+        fingerprint = Fingerprinter([a, b])
+        value = fingerprint({'tag': [a.meta, b.meta]})
+        self.assertEqual(value, fingerprint({'tag': [a.meta, b.meta]}))
+        self.assertNotEqual(value, fingerprint({'tag': [b.meta, a.meta]}))
+        # a changed source file changes the fingerprint
+        c = FakePage('c', slug='a')
+        fingerprint2 = Fingerprinter([c, b])
+        self.assertNotEqual(value, fingerprint2({'tag': [c.meta, b.meta]}))
+
+    def test_source_path(self):
+        a = FakePage('a', path='content/a.mkd', slug='a', url='/a.html')
+        value = Fingerprinter([a])(a.meta)
+        # a renamed source file changes the metadata derived from its path
+        b = FakePage('a', path='content/b.mkd', slug='b', url='/b.html')
+        self.assertNotEqual(value, Fingerprinter([b])(b.meta))
+
+    def test_includes(self):
+        tmp_path = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp_path, 'info.yaml')
+            with open(filename, 'w') as f:
+                f.write('author: Alice\n')
+            a = FakePage('a', includes=[filename], slug='a')
+            value = Fingerprinter([a])(a.meta)
+            self.assertEqual(value, Fingerprinter([a])(a.meta))
+            with open(filename, 'w') as f:
+                f.write('author: Bob\n')
+            self.assertNotEqual(value, Fingerprinter([a])(a.meta))
+            os.unlink(filename)
+            fingerprint = Fingerprinter([a])
+            self.assertEqual(fingerprint.include_digests(a), {filename: None})
+        finally:
+            shutil.rmtree(tmp_path)
+
+    def test_recursion(self):
+        a = {'slug': 'a'}
+        b = {'slug': 'b', 'prev_page': a}
+        a['next_page'] = b
+        fingerprint = Fingerprinter([])
+        self.assertEqual(fingerprint([a, b]), fingerprint([a, b]))
+
+
+class TestDigest(TestCase):
+
+    def test_text_file_digest(self):
+        fd, filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(u'a\r\nb\n\xe4'.encode('utf-8'))
+        try:
+            self.assertEqual(text_file_digest(filename, blocksize=2),
+                text_digest(u'a\nb\n\xe4'))
+        finally:
+            os.unlink(filename)
+
+
+class TestDependencyGraph(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_path, 'cache', 'deps.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_load_save(self):
+        graph = DependencyGraph(self.filename, 'sig')
+        self.assertFalse(graph.load())
+        graph.record('output/a.html', {'source': 'content/a.mkd'})
+        graph.record('output/b.html', {'source': 'content/b.mkd'})
+        graph.save()
+
+        graph = DependencyGraph(self.filename, 'sig')
+        self.assertTrue(graph.load())
+        self.assertEqual(graph.get('output/a.html'),
+                {'source': 'content/a.mkd'})
+        graph.keep('output/a.html')
+        self.assertEqual(graph.stale_outputs(), ['output/b.html'])
+
+    def test_signature(self):
+        graph = DependencyGraph(self.filename, 'sig')
+        graph.record('output/a.html', {})
+        graph.save()
+        graph = DependencyGraph(self.filename, 'other')
+        self.assertFalse(graph.load())
+        self.assertEqual(graph.get('output/a.html'), None)
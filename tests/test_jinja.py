@@ -0,0 +1,62 @@
+# -*- coding: iso-8859-1 -*-
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import jinja2
+from jinja2.loaders import TemplateNotFound
+
+from woklib.jinja import GlobFileLoader, AmbiguousTemplate
+
+
+class TestGlobFileLoader(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.write('default.html', 'default')
+        self.write('page.html', 'page')
+        self.write('page.xml', 'xml')
+        self.write(os.path.join('sub', 'base.html'), 'base')
+        self.loader = GlobFileLoader(self.tmp_path)
+        self.env = jinja2.Environment(loader=self.loader)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp_path, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def source(self, name):
+        return self.loader.get_source(self.env, name)[0]
+
+    def test_lookup(self):
+        self.assertEqual(self.source('default.*'), 'default')
+        self.assertEqual(self.source('default.html'), 'default')
+        self.assertEqual(self.source('sub/base.*'), 'base')
+        self.assertEqual(self.source('sub/b*.html'), 'base')
+        self.assertRaises(AmbiguousTemplate, self.source, 'page.*')
+        self.assertRaises(TemplateNotFound, self.source, 'missing.*')
+        self.assertRaises(TemplateNotFound, self.source, 'default')
+
+    def test_new_file(self):
+        self.assertRaises(TemplateNotFound, self.source, 'new.*')
+        self.write('new.html', 'new')
+        self.assertEqual(self.source('new.*'), 'new')
+
+    def test_build(self):
+        path = self.write('other.html', 'old')
+        self.loader.start_build()
+        self.assertEqual(self.env.get_template('other.*').render(), 'old')
+        self.write('other.html', 'changed')
+        os.utime(path, (0, 0))
+        # templates do not change during a build
+        self.assertEqual(self.env.get_template('other.*').render(), 'old')
+        self.loader.end_build()
+        self.assertEqual(self.env.get_template('other.*').render(),
+            'changed')
@@ -0,0 +1,213 @@
+# -*- coding: iso-8859-1 -*-
+import os
+import time
+import shutil
+import tempfile
+from unittest import TestCase
+
+from woklib.output import (OutputSync, OutputWriter, publish_file,
+    same_file)
+
+
+def write_file(path, data):
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def set_old(path):
+    """Make path look like it was written by an earlier build."""
+    old = time.time() - 3600
+    os.utime(path, (old, old))
+
+
+class TestOutputSync(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.media = os.path.join(self.tmp_path, 'media')
+        self.output = os.path.join(self.tmp_path, 'output')
+        os.makedirs(self.output)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def make_sync(self):
+        return OutputSync(self.output, lambda name: name.startswith('.'))
+
+    def test_write(self):
+        path = os.path.join(self.output, 'a', 'index.html')
+        writer = OutputWriter(self.make_sync())
+        writer.write(path, b'abc')
+        set_old(path)
+        mtime = os.path.getmtime(path)
+        # unchanged files are not written again
+        writer.write(path, b'abc')
+        self.assertEqual(os.path.getmtime(path), mtime)
+        writer.write(path, b'abd')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'abd')
+
+    def test_copy_tree(self):
+        write_file(os.path.join(self.media, 'img', 'a.png'), b'a')
+        write_file(os.path.join(self.media, 'img', 'b.png'), b'b')
+        dest = os.path.join(self.output, 'img')
+        self.assertEqual(self.make_sync().copy_tree(
+            os.path.join(self.media, 'img'), dest), 2)
+        self.assertEqual(self.make_sync().copy_tree(
+            os.path.join(self.media, 'img'), dest), 0)
+        write_file(os.path.join(self.media, 'img', 'b.png'), b'bb')
+        self.assertEqual(self.make_sync().copy_tree(
+            os.path.join(self.media, 'img'), dest), 1)
+        with open(os.path.join(dest, 'b.png'), 'rb') as f:
+            self.assertEqual(f.read(), b'bb')
+
+    def test_remove_stale(self):
+        stale = os.path.join(self.output, 'old', 'index.html')
+        hidden = os.path.join(self.output, '.git', 'config')
+        kept = os.path.join(self.output, 'index.html')
+        for path in (stale, hidden, kept):
+            write_file(path, b'x')
+            set_old(path)
+        sync = self.make_sync()
+        new = os.path.join(self.output, 'hook.txt')
+        write_file(new, b'x')
+        OutputWriter(sync).write(kept, b'x')
+        self.assertEqual(sync.remove_stale(), 1)
+        self.assertFalse(os.path.exists(os.path.dirname(stale)))
+        self.assertTrue(os.path.exists(hidden))
+        self.assertTrue(os.path.exists(kept))
+        self.assertTrue(os.path.exists(new))
+
+
+class TestOutputWriter(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_write(self):
+        writer = OutputWriter()
+        path = os.path.join(self.tmp_path, 'a', 'b', 'index.html')
+        writer.write(path, b'abc')
+        writer.write(path, b'abd')
+        self.assertEqual(self.read(path), b'abd')
+        self.assertEqual(writer.dirs, set([os.path.dirname(path)]))
+        # no temporary files are left
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['index.html'])
+
+    def test_replace_link(self):
+        original = os.path.join(self.tmp_path, 'original')
+        with open(original, 'wb') as f:
+            f.write(b'original')
+        path = os.path.join(self.tmp_path, 'index.html')
+        os.symlink(original, path)
+        OutputWriter().write(path, b'page')
+        # links are replaced, not written through
+        self.assertFalse(os.path.islink(path))
+        self.assertEqual(self.read(original), b'original')
+
+    def test_threads(self):
+        writer = OutputWriter(threads=4)
+        writer.queue_size = 2
+        paths = [os.path.join(self.tmp_path, str(i % 7), '{0}.html'.format(i))
+            for i in range(100)]
+        for i, path in enumerate(paths):
+            writer.write(path, str(i).encode('ascii'))
+        writer.close()
+        for i, path in enumerate(paths):
+            self.assertEqual(self.read(path), str(i).encode('ascii'))
+
+    def test_threads_same_path(self):
+        writer = OutputWriter(threads=4)
+        path = os.path.join(self.tmp_path, 'index.html')
+        for i in range(50):
+            writer.write(path, str(i).encode('ascii'))
+        writer.close()
+        # the last write wins
+        self.assertEqual(self.read(path), b'49')
+
+    def test_thread_error(self):
+        writer = OutputWriter(threads=2)
+        path = os.path.join(self.tmp_path, 'file')
+        with open(path, 'wb') as f:
+            f.write(b'')
+        # the parent of the page is not a directory
+        writer.write(os.path.join(path, 'index.html'), b'abc')
+        self.assertRaises(OSError, writer.close)
+
+    def test_sync(self):
+        output = os.path.join(self.tmp_path, 'output')
+        path = os.path.join(output, 'index.html')
+        write_file(path, b'abc')
+        set_old(path)
+        mtime = os.path.getmtime(path)
+        sync = OutputSync(output, lambda name: False)
+        writer = OutputWriter(sync, threads=1)
+        writer.write(path, b'abc')
+        writer.close()
+        self.assertEqual(os.path.getmtime(path), mtime)
+        self.assertEqual(sync.remove_stale(), 0)
+        self.assertTrue(os.path.exists(path))
+
+
+class TestMediaStrategies(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp_path, 'media', 'a.png')
+        write_file(self.src, b'image')
+        self.dest = os.path.join(self.tmp_path, 'output', 'a.png')
+        os.makedirs(os.path.dirname(self.dest))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def assertPublished(self):
+        with open(self.dest, 'rb') as f:
+            self.assertEqual(f.read(), b'image')
+
+    def test_copy(self):
+        publish_file(self.src, self.dest, 'copy')
+        self.assertPublished()
+        self.assertFalse(os.path.samefile(self.src, self.dest))
+        self.assertTrue(same_file(self.src, self.dest, 'copy'))
+
+    def test_hardlink(self):
+        publish_file(self.src, self.dest, 'hardlink')
+        self.assertPublished()
+        self.assertTrue(os.path.samefile(self.src, self.dest))
+        self.assertTrue(same_file(self.src, self.dest, 'hardlink'))
+        # switching back to copies replaces the link
+        self.assertFalse(same_file(self.src, self.dest, 'copy'))
+
+    def test_symlink(self):
+        publish_file(self.src, self.dest, 'symlink')
+        self.assertPublished()
+        self.assertTrue(os.path.islink(self.dest))
+        self.assertTrue(same_file(self.src, self.dest, 'symlink'))
+        self.assertFalse(same_file(self.src, self.dest, 'copy'))
+
+    def test_reflink(self):
+        # falls back to copying if the file system has no reflinks
+        publish_file(self.src, self.dest, 'reflink')
+        self.assertPublished()
+        self.assertFalse(os.path.islink(self.dest))
+        self.assertTrue(same_file(self.src, self.dest, 'reflink'))
+
+    def test_sync(self):
+        output = os.path.dirname(self.dest)
+        sync = OutputSync(output, lambda name: False, 'hardlink')
+        self.assertTrue(sync.copy_file(self.src, self.dest))
+        self.assertFalse(sync.copy_file(self.src, self.dest))
+        sync = OutputSync(output, lambda name: False, 'copy')
+        self.assertTrue(sync.copy_file(self.src, self.dest))
+        self.assertFalse(os.path.samefile(self.src, self.dest))
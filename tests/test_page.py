@@ -1,7 +1,14 @@
 # -*- coding: iso-8859-1 -*-
+import os
+import copy
+import shutil
+import tempfile
 from unittest import TestCase
 
-from woklib.page import Author
+from woklib.engine import Engine
+from woklib.page import Author, Page, PageMeta
+from woklib import renderers, util
+from woklib.incremental import text_digest
 
 class TestAuthor(TestCase):
 
@@ -18,3 +25,180 @@ class TestAuthor(TestCase):
         a = Author.parse('<bob@here.com>')
         self.assertEqual(a.raw, '<bob@here.com>')
         self.assertEqual(a.email, 'bob@here.com')
+
+
+class TestTemplateEnvironment(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.template_dir = os.path.join(self.tmp_path, 'templates')
+        self.cache_dir = os.path.join(self.tmp_path, 'cache')
+        os.makedirs(self.template_dir)
+        with open(os.path.join(self.template_dir, 'default.html'), 'w') as f:
+            f.write('{{ 1 + 1 }}')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+        Page.tmpl_env = None
+
+    def create(self, **options):
+        options.update(template_dir=self.template_dir,
+            cache_dir=self.cache_dir)
+        Page.create_tmpl_env(options)
+        return Page.tmpl_env
+
+    def test_bytecode_cache(self):
+        env = self.create(jinja2_bytecode_cache=True, jinja2_cache_size=10)
+        self.assertEqual(env.cache.capacity, 10)
+        self.assertEqual(env.get_template('default.*').render(), '2')
+        cached = os.listdir(os.path.join(self.cache_dir, 'templates'))
+        self.assertEqual(len(cached), 1)
+        # a new environment loads the compiled template
+        env = self.create(jinja2_bytecode_cache=True)
+        self.assertEqual(env.get_template('default.*').render(), '2')
+
+    def test_no_bytecode_cache(self):
+        env = self.create()
+        self.assertEqual(env.bytecode_cache, None)
+        self.assertEqual(env.get_template('default.*').render(), '2')
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+
+class CountingRenderer(renderers.Renderer):
+    """Renderer counting the rendered texts."""
+    count = 0
+
+    @classmethod
+    def render(cls, plain):
+        cls.count += 1
+        return plain.upper()
+
+
+class TestFromFile(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        template_dir = os.path.join(self.tmp_path, 'templates')
+        os.makedirs(template_dir)
+        with open(os.path.join(template_dir, 'default.html'), 'w') as f:
+            f.write('{{ page.content }}')
+        self.engine = Engine.__new__(Engine)
+        self.engine.options = dict(Engine.default_options,
+            template_dir=template_dir)
+        self.engine.markup_cache = None
+        CountingRenderer.count = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+        Page.tmpl_env = None
+
+    def load(self, data, render_markup=False):
+        path = os.path.join(self.tmp_path, 'page.txt')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return Page.from_file(path, self.engine.options, self.engine,
+            CountingRenderer, render_markup=render_markup)
+
+    def test_lazy(self):
+        page = self.load(b'title: T\r\npreview: p\r\n---\r\nbody\r\n')
+        self.assertEqual(page.meta['title'], 'T')
+        self.assertIsInstance(page.meta, PageMeta)
+        self.assertEqual(page.original, None)
+        self.assertEqual(CountingRenderer.count, 0)
+        self.assertEqual(page.meta['content'], 'BODY\n')
+        self.assertEqual(page.meta['preview'], 'P')
+        self.assertEqual(page.original, 'body\n')
+        self.assertEqual(CountingRenderer.count, 2)
+
+    def test_sections(self):
+        page = self.load(b'title: T\n---\npre\n---\nrest\n---\nmore',
+            render_markup=True)
+        self.assertEqual(page.original, 'pre\nrest\nmore')
+        self.assertEqual(page.original_preview, 'pre')
+        self.assertEqual(page.meta['preview'], 'PRE')
+
+    def test_no_header(self):
+        page = self.load(b'---\ntitle: T\n')
+        self.assertEqual(page.meta['title'], 'page')
+        self.assertEqual(page.meta['content'], '---\nTITLE: T\n')
+        self.assertEqual(page.meta['preview'], '')
+
+    def test_release(self):
+        page = self.load(b'title: T\n---\nbody')
+        copied = copy.deepcopy(page.meta)
+        page.render()
+        self.assertEqual(page.rendered, 'BODY')
+        page.release()
+        self.assertEqual(page.rendered, None)
+        self.assertEqual(page.original, None)
+        self.assertEqual(CountingRenderer.count, 2)
+        # the body is loaded again when needed
+        self.assertEqual(copied['content'], 'BODY')
+        self.assertEqual(page.meta.get('content'), 'BODY')
+        self.assertEqual(CountingRenderer.count, 4)
+        self.assertEqual(page.digest, text_digest(u'title: T\n---\nbody'))
+
+    def test_pagination(self):
+        page = self.load(b'title: T\npagination:\n  list: page.items\n'
+            b'  limit: 2\nitems: [1, 2, 3, 4, 5]\n---\nbody')
+        extra = page.paginate({})
+        self.assertEqual([p.meta['pagination']['page_items'] for p in extra],
+            [[3, 4], [5]])
+        self.assertEqual(page.meta['pagination']['page_items'], [1, 2])
+        self.assertEqual([p.meta['url'] for p in extra],
+            ['/t2.html', '/t3.html'])
+        self.assertEqual(page.meta['url'], '/t.html')
+        # the other metadata is shared
+        self.assertEqual(extra[0].meta['title'], 'T')
+        self.assertIs(extra[0].meta['items'], page.meta['items'])
+        self.assertEqual(extra[1].meta['pagination']['prev_page'],
+            extra[0].meta)
+
+    def test_pagination_header_keys(self):
+        from jinja2 import Template
+        page = self.load(b'title: T\npagination:\n  list: page.items\n'
+            b'  limit: 2\nitems: [1, 2, 3]\nmaps: m\nparents: p\n'
+            b'new_child: n\n---\nbody')
+        extra = page.paginate({})
+        template = Template('{{ page.maps }} {{ page.parents }} '
+            '{{ page.new_child }} {{ page.pagination.page_items }}')
+        self.assertEqual(template.render(page=extra[0].meta), 'm p n [3]')
+
+    def test_sorted_pagination(self):
+        page = self.load(b'title: T\npagination:\n  list: page.items\n'
+            b'  limit: 2\n  sort_key: n\n'
+            b'items: [{n: 3}, {n: 1}, {n: 2}]\n---\nbody')
+        items = list(page.meta['items'])
+        extra = page.paginate({})
+        self.assertEqual(page.meta['pagination']['page_items'],
+            [{'n': 1}, {'n': 2}])
+        self.assertEqual(extra[0].meta['pagination']['page_items'],
+            [{'n': 3}])
+        # the paginated list is not changed, and sorted once
+        self.assertEqual(page.meta['items'], items)
+        self.assertIs(self.engine.sorted_view(page.meta['items'], 'n', False),
+            self.engine.sorted_view(page.meta['items'], 'n', False))
+
+    def test_sorted_site_pages(self):
+        pages = [self.load('title: {0}\n---\nbody'.format(title)
+            .encode('ascii')) for title in 'cab']
+        site = {'pages': pages}
+        sorts = []
+        sort_items = util.sort_items
+        def counting_sort_items(*args):
+            sorts.append(args)
+            return sort_items(*args)
+        util.sort_items = counting_sort_items
+        try:
+            for i in range(3):
+                page = self.load(b'title: T\npagination:\n  list: site.pages\n'
+                    b'  limit: 2\n  sort_key: title\n---\nbody')
+                extra = page.paginate({'site': site})
+                self.assertEqual(page.meta['pagination']['page_items'],
+                    [pages[1].meta, pages[2].meta])
+                self.assertEqual(extra[0].meta['pagination']['page_items'],
+                    [pages[0].meta])
+        finally:
+            util.sort_items = sort_items
+        # the pages are sorted once for all listings
+        self.assertEqual(len(sorts), 1)
@@ -0,0 +1,47 @@
+# -*- coding: iso-8859-1 -*-
+import os
+import errno
+from unittest import TestCase
+
+from woklib import parallel
+from woklib.parallel import run_tasks
+
+
+class TestRunTasks(TestCase):
+
+    def test_order(self):
+        tasks = [(pow, (i, 2)) for i in range(50)]
+        self.assertEqual(run_tasks(tasks, 4), [i * i for i in range(50)])
+
+    def test_closure(self):
+        # functions are inherited by the workers and not pickled
+        offset = 10
+        def add(x):
+            return x + offset
+        tasks = [(add, (i,)) for i in range(10)]
+        self.assertEqual(run_tasks(tasks, 2), list(range(10, 20)))
+
+    def test_serial(self):
+        tasks = [(os.getpid, ())] * 3
+        self.assertEqual(run_tasks(tasks, 1), [os.getpid()] * 3)
+
+    def test_task_error(self):
+        calls = []
+        def fail(i):
+            calls.append(i)
+            raise ValueError('broken page {0}'.format(i))
+        tasks = [(fail, (i,)) for i in range(4)]
+        self.assertRaises(ValueError, run_tasks, tasks, 2)
+        # the tasks ran in the workers only, not again in this process
+        self.assertEqual(calls, [])
+
+    def test_no_pool(self):
+        def get_pool(jobs):
+            raise OSError(errno.EAGAIN, 'cannot fork')
+        orig_get_pool = parallel.get_pool
+        parallel.get_pool = get_pool
+        try:
+            tasks = [(os.getpid, ())] * 3
+            self.assertEqual(run_tasks(tasks, 2), [os.getpid()] * 3)
+        finally:
+            parallel.get_pool = orig_get_pool
@@ -0,0 +1,83 @@
+# -*- coding: iso-8859-1 -*-
+import io
+import os
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+
+from woklib.engine import Engine
+from woklib.profiler import Profiler, describe
+
+
+def hook(options, value):
+    return value * 2
+
+
+class TestProfiler(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def make_profiler(self):
+        profiler = Profiler()
+        for name in ('load_pages', 'render_site', 'load_pages'):
+            with profiler.measure('phase', name):
+                pass
+        for i in range(3):
+            with profiler.measure('page', '/page{0}/'.format(i)):
+                sum(range(10000 * i))
+        profiler.stop()
+        return profiler
+
+    def test_measure(self):
+        profiler = self.make_profiler()
+        self.assertEqual(profiler.phases, ['load_pages', 'render_site'])
+        self.assertEqual(profiler.timings['phase']['load_pages'].calls, 2)
+        self.assertEqual(profiler.total.calls, 1)
+        self.assertEqual([name for name, timing in
+            profiler.slowest('page', 2)], ['/page2/', '/page1/'])
+
+    def test_error(self):
+        profiler = Profiler()
+        try:
+            with profiler.measure('hook', 'failing'):
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(profiler.timings['hook']['failing'].calls, 1)
+
+    def test_report(self):
+        lines = self.make_profiler().report(top=1).splitlines()
+        self.assertIn('Phases', lines)
+        self.assertIn('Slowest pages', lines)
+        self.assertNotIn('Slowest hooks', lines)
+        self.assertEqual([line.split()[0] for line in lines
+            if line.startswith('/')], ['/page2/'])
+
+    def test_json(self):
+        filename = os.path.join(self.tmp_path, 'profile.json')
+        self.make_profiler().write_json(filename)
+        with io.open(filename, encoding='utf-8') as f:
+            data = json.load(f)
+        self.assertEqual([phase['name'] for phase in data['phases']],
+            ['load_pages', 'render_site'])
+        self.assertEqual(sorted(data['pages']),
+            ['/page0/', '/page1/', '/page2/'])
+        self.assertEqual(data['hooks'], {})
+        self.assertEqual(data['total']['calls'], 1)
+
+    def test_hooks(self):
+        engine = Engine.__new__(Engine)
+        engine.options = {}
+        engine.hooks = {'page.meta.pre': [hook, hook]}
+        self.assertEqual(engine.run_hook('page.meta.pre', 1), [2, 2])
+        engine.profiler = Profiler()
+        self.assertEqual(engine.run_hook('page.meta.pre', 1), [2, 2])
+        name = 'page.meta.pre tests.test_profiler.hook'
+        self.assertEqual(describe(hook), 'tests.test_profiler.hook')
+        self.assertEqual(list(engine.profiler.timings['hook']), [name])
+        self.assertEqual(engine.profiler.timings['hook'][name].calls, 2)
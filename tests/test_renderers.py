@@ -0,0 +1,88 @@
+# -*- coding: iso-8859-1 -*-
+import threading
+import unittest
+from unittest import TestCase
+
+from woklib import renderers
+from woklib.util import has_module
+
+
+class CountingRenderer(renderers.Renderer):
+    """Renderer counting the rendered texts."""
+    count = 0
+
+    @classmethod
+    def render(cls, plain):
+        cls.count += 1
+        return plain.upper()
+
+
+class TestRenderMany(TestCase):
+
+    def test_renderer(self):
+        CountingRenderer.count = 0
+        self.assertEqual(renderers.render_many(CountingRenderer, ['a', '']),
+            ['A', ''])
+        self.assertEqual(CountingRenderer.count, 2)
+
+    def test_object(self):
+        # custom renderers only need a render function
+        renderer = type('', (object,),
+            {'render': staticmethod(lambda plain: plain + '!')})
+        self.assertEqual(renderers.render_many(renderer, ['a', 'b']),
+            ['a!', 'b!'])
+
+
+@unittest.skipIf(not hasattr(renderers, 'Markdown'), 'needs markdown')
+class TestMarkdown(TestCase):
+
+    Texts = [
+        u'a[^1]\n\n[^1]: note',
+        u'b [link]\n\n[link]: http://example.com',
+        u'c [link] [^1]',
+        u'',
+    ]
+
+    def test_reuse(self):
+        from markdown import markdown
+        md = renderers.Markdown.markdown()
+        for text in self.Texts:
+            # notes and links of earlier texts are forgotten
+            self.assertEqual(renderers.Markdown.render(text),
+                markdown(text, extensions=renderers.Markdown.plugins))
+        self.assertIs(renderers.Markdown.markdown(), md)
+
+    def test_threads(self):
+        instances = []
+        thread = threading.Thread(target=lambda:
+            instances.append(renderers.Markdown.markdown()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(instances[0], renderers.Markdown.markdown())
+
+    def test_plugins(self):
+        md = renderers.Markdown.markdown()
+        plugins = renderers.Markdown.plugins
+        renderers.Markdown.plugins = plugins + ['abbr']
+        try:
+            self.assertIsNot(renderers.Markdown.markdown(), md)
+            self.assertEqual(renderers.Markdown.render(
+                u'HTML\n\n*[HTML]: Hyper Text'),
+                u'<p><abbr title="Hyper Text">HTML</abbr></p>')
+        finally:
+            renderers.Markdown.plugins = plugins
+
+
+@unittest.skipIf(not has_module('docutils'), 'needs docutils')
+class TestReStructuredText(TestCase):
+
+    def test_reuse(self):
+        import docutils.core
+        from docutils.writers.html4css1 import Writer
+        texts = [u'Title\n=====\n\nText [#]_\n\n.. [#] note\n',
+                 u'* a\n* b\n', u'']
+        for text in texts:
+            self.assertEqual(renderers.ReStructuredText.render(text),
+                docutils.core.publish_parts(text, writer=Writer())['body'])
+        self.assertEqual(renderers.ReStructuredText.render_many(texts[:2]),
+            [renderers.ReStructuredText.render(text) for text in texts[:2]])
@@ -0,0 +1,160 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Check that site processing scales linearly with the number of pages. The
+metadata lookups and comparisons are counted instead of timed, so the
+checks are exact.
+"""
+import random
+from datetime import date
+from unittest import TestCase
+
+from woklib.engine import Engine
+from woklib.page import Author
+
+
+class CountingMeta(dict):
+    """Page metadata counting the lookups and comparisons of all pages."""
+    operations = 0
+
+    def __getitem__(self, key):
+        CountingMeta.operations += 1
+        return super(CountingMeta, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        CountingMeta.operations += 1
+        return super(CountingMeta, self).get(key, default)
+
+    def __eq__(self, other):
+        CountingMeta.operations += 1
+        return super(CountingMeta, self).__eq__(other)
+
+    def __ne__(self, other):
+        CountingMeta.operations += 1
+        return super(CountingMeta, self).__ne__(other)
+
+    __hash__ = None
+
+
+class SyntheticPage(object):
+    """A page with generated metadata."""
+
+    def __init__(self, i):
+        self.path = 'content/page%d.mkd' % i
+        self.meta = CountingMeta({
+            'slug': 'page%d' % i,
+            # every tag is used by about five pages
+            'tags': ['tag%d' % (i // 5), 'tag%d' % (i % 7)],
+            'authors': [Author.parse('Author %d <a%d@example.com>' %
+                (i % 13, i % 13))],
+            'date': date(2000 + i % 10, 1 + i % 12, 1),
+            'category': [],
+            'subpages': [],
+        })
+
+
+def make_engine(num_pages):
+    """Get an engine with synthetic pages."""
+    e = Engine.__new__(Engine)
+    e.all_pages = [SyntheticPage(i) for i in range(num_pages)]
+    return e
+
+
+def make_tree_engine(num_pages, seed=0):
+    """
+    Get an engine with synthetic pages in a deep category hierarchy: one
+    in fifty pages is at the top level, every other page is a sub page of
+    a random previous page.
+    """
+    rng = random.Random(seed)
+    pages = []
+    roots = max(num_pages // 50, 1)
+    for i in range(num_pages):
+        page = SyntheticPage(i)
+        if i >= roots:
+            parent = pages[rng.randrange(i)].meta
+            page.meta['category'] = parent['category'] + [parent['slug']]
+        pages.append(page)
+    rng.shuffle(pages)
+    e = Engine.__new__(Engine)
+    e.all_pages = pages
+    return e
+
+
+def count_tree(metas):
+    """Count the pages in a page tree."""
+    return sum(1 + count_tree(meta['subpages']) for meta in metas)
+
+
+def count_operations(func):
+    """Count the metadata operations of func."""
+    CountingMeta.operations = 0
+    func()
+    return CountingMeta.operations
+
+
+class TestScaling(TestCase):
+
+    def assertLinear(self, func, small, large):
+        """Check that func does the same number of metadata operations per
+        page for a small and a large number of pages."""
+        per_page_small = count_operations(lambda: func(small)) / float(small)
+        per_page_large = count_operations(lambda: func(large)) / float(large)
+        # quadratic scaling would multiply the operations per page by
+        # large / small
+        self.assertLess(per_page_large, per_page_small * 1.1)
+
+    def test_index_site(self):
+        engines = dict((num_pages, make_engine(num_pages))
+                       for num_pages in (500, 4000))
+        def index(num_pages):
+            engines[num_pages].index_site()
+        self.assertLinear(index, 500, 4000)
+
+    def test_index_site_content(self):
+        e = make_engine(50)
+        e.index_site()
+        self.assertEqual(len(e.slugs), 50)
+        self.assertEqual([m['slug'] for m in e.tags['tag3']],
+            ['page3', 'page10', 'page15', 'page16', 'page17', 'page18',
+             'page19', 'page24', 'page31', 'page38', 'page45'])
+        self.assertEqual(len(e.author_pages['Author 1']), 4)
+        self.assertEqual([m['slug'] for m in e.archive[2001][2]],
+            ['page1'])
+
+    def test_index_site_tag_order(self):
+        e = make_engine(2)
+        e.all_pages[0].meta['tags'] = ['z', 'y', 'x', 'z', 'w']
+        e.all_pages[1].meta['tags'] = ['v', 'y']
+        e.index_site()
+        self.assertEqual(list(e.tags), ['z', 'y', 'x', 'w', 'v'])
+        self.assertEqual(len(e.tags['z']), 1)
+
+    def test_make_tree(self):
+        num_pages = 5000
+        e = make_tree_engine(num_pages)
+        e.make_tree()
+        roots = [p.meta for p in e.all_pages if not p.meta['category']]
+        self.assertEqual(len(roots), num_pages // 50)
+        self.assertEqual(count_tree(roots), num_pages)
+        depth = max(len(p.meta['category']) for p in e.all_pages)
+        self.assertGreater(depth, 5)
+
+    def test_make_tree_scaling(self):
+        engines = dict((num_pages, make_tree_engine(num_pages))
+                       for num_pages in (500, 4000))
+        def make_tree(num_pages):
+            engines[num_pages].make_tree()
+        self.assertLinear(make_tree, 500, 4000)
+
+    def test_make_tree_orphans(self):
+        e = make_tree_engine(100)
+        orphan = SyntheticPage(100)
+        orphan.meta['category'] = ['page0', 'missing']
+        child = SyntheticPage(101)
+        child.meta['category'] = ['page0', 'missing', 'page100']
+        e.all_pages.extend([child, orphan])
+        e.make_tree()
+        roots = [p.meta for p in e.all_pages if not p.meta['category']]
+        self.assertEqual(count_tree(roots), 100)
+        first = [p.meta for p in e.all_pages if p.meta['slug'] == 'page0'][0]
+        self.assertNotIn(orphan.meta, first['subpages'])
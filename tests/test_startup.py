@@ -0,0 +1,59 @@
+# -*- coding: iso-8859-1 -*-
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+from unittest import TestCase
+
+from woklib.util import has_module
+
+# Prints the imported modules after building the site in the current
+# directory.
+BuildScript = '''
+import sys, json
+from woklib.engine import Engine
+Engine().run()
+print(json.dumps(sorted(sys.modules)))
+'''
+
+# Modules which a Markdown site does not need.
+Unused = ('docutils', 'textile', 'markdown2', 'lxml', 'multiprocessing',
+    'woklib.dev_server', 'woklib.watcher', 'woklib.rst_pygments',
+    'woklib.contrib')
+
+
+class TestStartup(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        for name in ('content', 'templates'):
+            os.mkdir(os.path.join(self.tmp_path, name))
+        with open(os.path.join(self.tmp_path, 'templates', 'default.html'),
+                'w') as f:
+            f.write('{{ page.content }}')
+        with open(os.path.join(self.tmp_path, 'content', 'a.mkd'), 'w') as f:
+            f.write('title: A\n---\n# Hello\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def build(self):
+        """Build the site in a new interpreter and get its modules."""
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([root] +
+            [path for path in [env.get('PYTHONPATH')] if path])
+        output = subprocess.check_output([sys.executable, '-c',
+            BuildScript], cwd=self.tmp_path, env=env)
+        return set(json.loads(output.decode('utf-8').splitlines()[-1]))
+
+    @unittest.skipIf(not has_module('markdown'), 'needs markdown')
+    def test_markdown_site(self):
+        modules = self.build()
+        self.assertIn('markdown', modules)
+        self.assertEqual([name for name in Unused if name in modules], [])
+        with open(os.path.join(self.tmp_path, 'output', 'a.html')) as f:
+            self.assertEqual(f.read(), '<h1>Hello</h1>')
@@ -0,0 +1,113 @@
+# -*- coding: iso-8859-1 -*-
+import os
+import errno
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+
+from woklib.watcher import PollingWatcher, InotifyWatcher, get_watcher
+
+
+def wait_for_changes(watcher, expected, timeout=5):
+    """Collect changes until the expected paths were reported."""
+    changes = set()
+    end = time.time() + timeout
+    while time.time() < end and not expected <= changes:
+        time.sleep(0.05)
+        changes.update(watcher.get_changes())
+    return changes
+
+
+class WatcherTests(object):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.content = os.path.join(self.tmp_path, 'content')
+        os.makedirs(os.path.join(self.content, 'sub'))
+        self.old = os.path.join(self.content, 'sub', 'old.mkd')
+        with open(self.old, 'w') as f:
+            f.write('old')
+        self.watcher = self.make_watcher([self.content])
+        self.watcher.start()
+
+    def tearDown(self):
+        self.watcher.stop()
+        shutil.rmtree(self.tmp_path)
+
+    def test_changes(self):
+        self.assertEqual(self.watcher.get_changes(), set())
+        new = os.path.join(self.content, 'new.mkd')
+        with open(new, 'w') as f:
+            f.write('new')
+        os.unlink(self.old)
+        expected = set([new, self.old])
+        self.assertTrue(expected <= wait_for_changes(self.watcher, expected))
+        self.assertEqual(self.watcher.get_changes(), set())
+
+    def test_new_directory(self):
+        new = os.path.join(self.content, 'dir', 'new.mkd')
+        os.makedirs(os.path.dirname(new))
+        with open(new, 'w') as f:
+            f.write('new')
+        expected = set([new])
+        self.assertTrue(expected <= wait_for_changes(self.watcher, expected))
+
+
+class TestPollingWatcher(WatcherTests, TestCase):
+
+    def make_watcher(self, dirs):
+        return PollingWatcher(dirs, interval=0.1)
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'needs Linux')
+class TestInotifyWatcher(WatcherTests, TestCase):
+
+    def make_watcher(self, dirs):
+        return InotifyWatcher(dirs)
+
+    def test_watch_error(self):
+        def add_tree(top):
+            raise OSError(errno.ENOSPC, 'no space left for watches')
+        self.watcher.add_tree = add_tree
+        new = os.path.join(self.content, 'dir', 'new.mkd')
+        os.makedirs(os.path.dirname(new))
+        with open(new, 'w') as f:
+            f.write('new')
+        # the new directory is reported, and the watcher keeps going
+        expected = set([os.path.dirname(new)])
+        self.assertTrue(expected <= wait_for_changes(self.watcher, expected))
+        changed = os.path.join(self.content, 'changed.mkd')
+        with open(changed, 'w') as f:
+            f.write('changed')
+        expected = set([changed])
+        self.assertTrue(expected <= wait_for_changes(self.watcher, expected))
+        self.assertTrue(self.watcher.thread.is_alive())
+
+    def test_moved_directory(self):
+        sub = os.path.join(self.content, 'sub')
+        moved = os.path.join(self.content, 'moved')
+        os.rename(sub, moved)
+        expected = set([sub, moved])
+        self.assertTrue(expected <= wait_for_changes(self.watcher, expected))
+        self.assertEqual(sorted(self.watcher.watches.values()),
+            [self.content, moved])
+        new = os.path.join(moved, 'new.mkd')
+        with open(new, 'w') as f:
+            f.write('new')
+        expected = set([new])
+        self.assertTrue(expected <= wait_for_changes(self.watcher, expected))
+        # moved out of the watched trees
+        outside = os.path.join(self.tmp_path, 'outside')
+        os.rename(moved, outside)
+        expected = set([moved])
+        self.assertTrue(expected <= wait_for_changes(self.watcher, expected))
+        self.assertEqual(list(self.watcher.watches.values()), [self.content])
+
+    def test_get_watcher(self):
+        watcher = get_watcher([self.content])
+        self.assertIsInstance(watcher, InotifyWatcher)
+        watcher.start()
+        watcher.stop()
@@ -0,0 +1,126 @@
+# -*- coding: iso-8859-1 -*-
+import os
+import copy
+import pickle
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+
+from woklib import yamlutil
+from woklib.yamlutil import PyLoader, CLoader, load_simple, load_stream
+
+
+Headers = [
+    u'title: Hello World\nslug: hello-world\ntype: post',
+    u'title: 404\npublished: false\ndate: 2012-03-04\n',
+    u'datetime: 2012-03-04 10:30:00\ntime: 10:30\nrating: 4.5',
+    u'title: ~\nempty: null\nflag: yes\nother: Off',
+    u'title: It\'s a "test", really\ncategory: a/b/c',
+    u'title: Caf\xe9 \u2603\n\nauthor: Bob Smith <bob@example.com>',
+    u'title: .inf\nx_y-z: 0x1F\nw: 0o17\nv: 1_000',
+    u'title: x   \ntags: a, b',
+    # need YAML
+    u'title: a # comment',
+    u'title: a\n  continued',
+    u'tags: [a, b]\ncategory:\n  - x',
+    u'title: "quoted"\nslug: \'single\'',
+    u'title: a:b\nslug: http://x',
+    u'yes: no\nnull: 1',
+    u'title: &a x\nslug: *a',
+    u'title: !!str 1',
+    u'---\ntitle: a',
+    u'title: -1\nslug: -x',
+    u'<<: {a: 1}',
+    u'just a string',
+    u'',
+]
+
+
+class TestLoad(TestCase):
+
+    def test_simple(self):
+        self.assertEqual(load_simple(u'title: A\nslug: a'),
+            {'title': 'A', 'slug': 'a'})
+        self.assertEqual(load_simple(u'tags: [a]'), None)
+        self.assertEqual(load_simple(u''), None)
+
+    def test_same_result(self):
+        for header in Headers:
+            expected = load_stream(header, PyLoader)
+            self.assertEqual(load_stream(header), expected, header)
+            meta = load_simple(header)
+            if meta is not None:
+                self.assertEqual(meta, expected, header)
+                self.assertEqual([type(v) for v in meta.values()],
+                    [type(expected[k]) for k in meta], header)
+
+    @unittest.skipIf(CLoader is None, 'needs libyaml')
+    def test_c_loader(self):
+        self.assertIs(yamlutil.Loader, CLoader)
+        for header in Headers:
+            self.assertEqual(load_stream(header, CLoader),
+                load_stream(header, PyLoader), header)
+
+
+class TestInclude(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.write('config', u'a: !include b.yaml\n')
+        self.write('b.yaml', u'c: !include c.yaml\n')
+        self.write('c.yaml', u'[1, 2]\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+        yamlutil.clear_includes()
+
+    def write(self, name, text):
+        with open(os.path.join(self.tmp_path, name), 'w') as f:
+            f.write(text)
+
+    def test_include(self):
+        filename = os.path.join(self.tmp_path, 'config')
+        self.assertEqual(yamlutil.load_file(filename), {'a': {'c': [1, 2]}})
+
+    def test_cached(self):
+        filename = os.path.join(self.tmp_path, 'config')
+        first = yamlutil.load_file(filename)
+        # the shared data cannot be changed by one of its users
+        self.assertRaises(TypeError, first['a']['c'].append, 3)
+        self.assertRaises(TypeError, first['a'].update, c=3)
+        path = os.path.join(self.tmp_path, 'b.yaml')
+        mtime = os.path.getmtime(path)
+        self.write('b.yaml', u'c: changed\n')
+        os.utime(path, (mtime, mtime))
+        second = yamlutil.load_file(filename)
+        self.assertEqual(second, {'a': {'c': [1, 2]}})
+        self.assertIs(second['a'], first['a'])
+        os.utime(path, (mtime + 10, mtime + 10))
+        self.assertEqual(yamlutil.load_file(filename), {'a': {'c': 'changed'}})
+
+    def test_freeze(self):
+        data = yamlutil.freeze({'a': [1, {'b': 2}], 'c': (3, [4]),
+            'd': set([5])})
+        self.assertEqual(data, {'a': [1, {'b': 2}], 'c': (3, [4]),
+            'd': set([5])})
+        self.assertIsInstance(data['a'], list)
+        self.assertRaises(TypeError, data['a'][1].__setitem__, 'b', 3)
+        self.assertRaises(TypeError, data['c'][1].extend, [5])
+        self.assertRaises(TypeError, data.pop, 'a')
+        # copies are read-only too, and equal
+        copied = copy.deepcopy(data)
+        self.assertEqual(copied, data)
+        self.assertRaises(TypeError, copied['a'].append, 6)
+        self.assertEqual(pickle.loads(pickle.dumps(data)), data)
+
+    def test_included(self):
+        filename = os.path.join(self.tmp_path, 'config')
+        expected = [os.path.join(self.tmp_path, name)
+                    for name in ('b.yaml', 'c.yaml')]
+        for i in range(2):
+            # the nested includes of cached files are recorded too
+            included = []
+            with open(filename) as f:
+                load_stream(f, included=included)
+            self.assertEqual(included, expected)
@@ -0,0 +1,100 @@
+# -*- coding: iso-8859-1 -*-
+"""
+A persistent, size bounded cache storing text values in files.
+"""
+import os
+import errno
+import hashlib
+import logging
+import tempfile
+
+
+def make_key(*parts):
+    """Get a cache key from the given unicode strings."""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class FileCache(object):
+    """
+    Cache of text values, one file per entry. Using an entry updates its
+    modification time, and when the cache grows larger than its maximum
+    size the least recently used entries are removed by `prune`.
+
+    Several processes can use the same cache directory at the same time.
+    """
+
+    def __init__(self, directory, max_size):
+        """Initialize cache in given directory with given maximum size
+        in bytes."""
+        self.directory = directory
+        self.max_size = max_size
+
+    def _filename(self, key):
+        """Get file name of cache entry."""
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key):
+        """Get cached value or None if not found."""
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+            # mark as recently used
+            os.utime(filename, None)
+        except (IOError, OSError):
+            return None
+        return data.decode('utf-8')
+
+    def set(self, key, value):
+        """Store a text value in the cache."""
+        filename = self._filename(key)
+        dirname = os.path.dirname(filename)
+        try:
+            os.makedirs(dirname)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # write to a temporary file first, so that other processes
+        # never see partially written entries
+        fd, tmpname = tempfile.mkstemp(dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value.encode('utf-8'))
+            os.rename(tmpname, filename)
+        except OSError:
+            # entry has been written concurrently (Windows)
+            os.unlink(tmpname)
+
+    def prune(self):
+        """Remove least recently used entries until the cache is smaller
+        than its maximum size."""
+        entries = []
+        size = 0
+        for root, dirs, files in os.walk(self.directory):
+            for f in files:
+                filename = os.path.join(root, f)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, filename))
+                size += stat.st_size
+        if size <= self.max_size:
+            return
+        entries.sort()
+        removed = 0
+        for mtime, entry_size, filename in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.unlink(filename)
+            except OSError:
+                continue
+            size -= entry_size
+            removed += 1
+        logging.info('Removed {0} entries from cache {1}.'
+                .format(removed, self.directory))
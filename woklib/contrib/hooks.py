@@ -10,12 +10,7 @@ except ImportError:
     from io import StringIO
 import logging
 
-from woklib.util import slugify
-
-try:
-    from lxml import etree
-except ImportError:
-    etree = None
+from woklib.util import slugify, has_module
 
 
 class HeadingAnchors(object):
@@ -27,7 +22,9 @@ class HeadingAnchors(object):
 
     def __init__(self, max_heading=3):
         """Initialize heading anchor hook."""
-        if not etree:
+        # lxml is imported when the hook is called
+        self.enabled = has_module('lxml')
+        if not self.enabled:
             logging.warning('To use the HeadingAnchors hook, you must install '
                 'the library lxml.')
             return
@@ -36,8 +33,9 @@ class HeadingAnchors(object):
 
     def __call__(self, config, page):
         """Add heading anchor."""
-        if not etree:
+        if not self.enabled:
             return
+        from lxml import etree
         logging.debug('Called hook HeadingAnchors on {0}'.format(page))
         parser = etree.HTMLParser()
         sio_source = StringIO(page.rendered)
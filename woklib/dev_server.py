@@ -14,50 +14,138 @@ be accessable to any page that uses `base.html`, even if it's a categorized
 page, and thus, goes into a subdirectory. This way, your CSS include tag could
 read `<link type='text/css' href='/base.css' />` (note the '/' in the `href`
 property) and `base.css` can be accessed from anywhere.
+
+Requests are handled in threads. The site is rebuilt in a background thread
+after changes, and open pages reload themselves when the rebuild is done.
 '''
 from __future__ import print_function
 import os
+import re
+import time
+import hashlib
+import logging
+import posixpath
+import threading
+from io import BytesIO
+from email.utils import parsedate_tz, mktime_tz
 try:
     from BaseHTTPServer import HTTPServer
     from SimpleHTTPServer import SimpleHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import urlparse, parse_qs
 except ImportError:
     # Python 3
     from http.server import HTTPServer, SimpleHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote, urlparse, parse_qs
+
+from .watcher import get_watcher
+
+# URL of the live reload long poll requests.
+ReloadPath = '/__wok__/reload'
+
+# Injected into HTML pages: wait for a rebuild, then reload the page.
+ReloadScript = b'''<script>
+(function () {
+    var version = '';
+    function poll() {
+        var req = new XMLHttpRequest();
+        req.open('GET', '/__wok__/reload?version=' + version);
+        req.onload = function () {
+            if (version !== '' && req.responseText !== version) {
+                window.location.reload();
+                return;
+            }
+            version = req.responseText;
+            poll();
+        };
+        req.onerror = function () { setTimeout(poll, 1000); };
+        req.send();
+    }
+    poll();
+})();
+</script>
+'''
+
+
+def inject_script(data):
+    """Add the live reload script to an HTML page."""
+    match = None
+    for match in re.finditer(br'</body\s*>', data, re.IGNORECASE):
+        pass
+    if match is None:
+        return data + ReloadScript
+    return data[:match.start()] + ReloadScript + data[match.start():]
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server handling every request in a thread."""
+    daemon_threads = True
+
+
+class LiveReload(object):
+    """Notify waiting clients after the site has been rebuilt."""
+
+    def __init__(self):
+        """The version increases with every rebuild."""
+        self.version = 0
+        self.condition = threading.Condition()
+
+    def notify(self):
+        """Tell the clients that the site has been rebuilt."""
+        with self.condition:
+            self.version += 1
+            self.condition.notify_all()
+
+    def wait(self, version, timeout):
+        """Wait until the site version differs from the given one or the
+        timeout has passed. Returns the current version."""
+        end = time.time() + timeout
+        with self.condition:
+            while self.version == version:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return self.version
 
 
 class DevServer(object):
     """Simple development HTTP server."""
 
+    # seconds a live reload request waits for a rebuild
+    reload_timeout = 30
+
     def __init__(self, serv_dir=None, host='', port=8000, dir_mon=False,
-            watch_dirs=[], change_handler=None):
+            watch_dirs=[], change_handler=None, get_page=None):
         '''
         Initialize a new development server on `host`:`port`, and serve the
         files in `serv_dir`. If `serv_dir` is not provided, it will use the
         current working directory.
 
-        If `dir_mon` is set, the server will check for changes before handling
-        every request. If a change is detected, then wok will regenerate the
-        site.
+        If `dir_mon` is set, the watch directories are monitored for changes
+        in the background. The `change_handler` is called with the set of
+        changed paths in a background thread to rebuild the site, and
+        afterwards the open pages reload themselves.
+
+        If given, `get_page` is called with the file name of a requested
+        file and returns its contents and modification time if the file is
+        held in memory, or None.
         '''
-        self.serv_dir = os.path.abspath(serv_dir)
+        self.serv_dir = os.path.abspath(serv_dir or os.getcwd())
         self.host = host
         self.port = port
         self.dir_mon = dir_mon
         self.watch_dirs = [os.path.abspath(d) for d in watch_dirs]
         self.change_handler = change_handler
+        self.get_page = get_page
+        self.live_reload = LiveReload()
 
     def run(self):
         """Run the server."""
-        if self.serv_dir:
-            os.chdir(self.serv_dir)
-
-        if self.dir_mon:
-            wrap = RebuildHandlerWrapper(self.change_handler, self.watch_dirs)
-            req_handler = wrap.request_handler
-        else:
-            req_handler = SimpleHTTPRequestHandler
-
-        httpd = HTTPServer((self.host, self.port), req_handler)
+        httpd = ThreadedHTTPServer((self.host, self.port), DevRequestHandler)
+        httpd.dev_server = self
         socket_info = httpd.socket.getsockname()
 
         print("Starting dev server on http://%s:%s... (Ctrl-C to stop)"
@@ -68,6 +156,13 @@ class DevServer(object):
             print("Monitoring the following directories for changes: ")
             for d in self.watch_dirs:
                 print("\t", d)
+            self.watcher = get_watcher(
+                [d for d in self.watch_dirs if os.path.isdir(d)])
+            self.watcher.start()
+            thread = threading.Thread(target=self.rebuild_changes,
+                name='wok rebuild')
+            thread.daemon = True
+            thread.start()
         else:
             print("Directory monitoring is OFF")
 
@@ -76,54 +171,116 @@ class DevServer(object):
         except KeyboardInterrupt:
             print("\nStopping development server...")
 
+    def rebuild_changes(self):
+        """Rebuild the site whenever files change."""
+        while True:
+            changes = self.watcher.wait_for_changes()
+            if not changes:
+                continue
+            try:
+                self.change_handler(changes)
+            except (Exception, SystemExit):
+                logging.exception('Rebuilding the site failed.')
+                continue
+            self.live_reload.notify()
+
 
-class RebuildHandlerWrapper(object):
-    """Rebuild handler."""
-
-    def __init__(wrap_self, rebuild, watch_dirs):
-        """
-        We can't pass arguments to HTTPRequestHandlers, because HTTPServer
-        calls __init__. So make a closure.
-        """
-        wrap_self.rebuild = rebuild
-        wrap_self.watch_dirs = watch_dirs
-
-        wrap_self._modtime_sum = None
-        wrap_self.changed()
-
-        class RebuildHandler(SimpleHTTPRequestHandler):
-            """Rebuild if something has changed."""
-
-            def handle(self):
-                """
-                Handle a request and, if anything has changed, rebuild the
-                site before responding.
-                """
-                if wrap_self.changed():
-                    wrap_self.rebuild()
-
-                SimpleHTTPRequestHandler.handle(self)
-
-        wrap_self.request_handler = RebuildHandler
-
-    def changed(self):
-        """
-        Returns if the contents of the monitored directories have changed since
-        the last call. It will return always return false on first run.
-        """
-        last_modtime_sum = self._modtime_sum
-
-        # calculate simple sum of file modification times
-        self._modtime_sum = 0
-        for d in self.watch_dirs:
-            for root, dirs, files in os.walk(d):
-                for f in files:
-                    abspath = os.path.join(root, f)
-                    self._modtime_sum += os.stat(abspath).st_mtime
-
-        if last_modtime_sum is None:
-            # always return false on first run
-            return False
+class DevRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serve pages from memory if possible, and files of the served directory
+    otherwise. Connections are kept alive.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def translate_path(self, path):
+        """Get the file name in the served directory for an URL path. Does
+        not depend on the current directory, which changes while the site
+        is rebuilt."""
+        path = path.split('?', 1)[0].split('#', 1)[0]
+        trailing_slash = path.rstrip().endswith('/')
+        path = posixpath.normpath(unquote(path))
+        result = self.server.dev_server.serv_dir
+        for word in path.split('/'):
+            if not word or os.path.dirname(word) or word in (os.curdir,
+                    os.pardir):
+                continue
+            result = os.path.join(result, word)
+        if trailing_slash:
+            result += '/'
+        return result
+
+    def send_head(self):
+        """Send the response headers and get the response body."""
+        url = urlparse(self.path)
+        if url.path == ReloadPath:
+            return self.send_reload(parse_qs(url.query))
+        page = self.find_page(self.translate_path(self.path))
+        if page is None:
+            return SimpleHTTPRequestHandler.send_head(self)
+        filename, (data, mtime) = page
+        ctype = self.guess_type(filename)
+        if ctype == 'text/html':
+            data = inject_script(data)
+        etag = '"{0}"'.format(hashlib.md5(data).hexdigest())
+        if self.not_modified(etag, mtime):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return None
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', self.date_time_string(mtime))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        return BytesIO(data)
+
+    def find_page(self, path):
+        """Get file name, contents and modification time of a page held
+        in memory, or None."""
+        get_page = self.server.dev_server.get_page
+        if get_page is None:
+            return None
+        if path.endswith('/'):
+            candidates = [path + 'index.html', path + 'index.htm']
+        else:
+            candidates = [path]
+        for filename in candidates:
+            page = get_page(filename)
+            if page is not None:
+                return filename, page
+        return None
+
+    def not_modified(self, etag, mtime):
+        """Check the conditional request headers."""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return etag in tags or '*' in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            date = parsedate_tz(if_modified_since)
+            if date is not None:
+                return int(mtime) <= mktime_tz(date)
+        return False
+
+    def send_reload(self, query):
+        """Answer a live reload request with the site version, once it
+        differs from the version known by the client."""
+        live_reload = self.server.dev_server.live_reload
+        try:
+            version = int(query.get('version', [''])[0])
+        except ValueError:
+            # the client does not know the version yet
+            version = live_reload.version
         else:
-            # otherwise return if file modification sums changed since last run
-            return (last_modtime_sum != self._modtime_sum)
+            version = live_reload.wait(version,
+                self.server.dev_server.reload_timeout)
+        data = str(version).encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        return BytesIO(data)
@@ -1,15 +1,22 @@
 # -*- coding: iso-8859-1 -*-
+from __future__ import print_function
 import os
 import sys
 import shutil
 import fnmatch
+import time
+import hashlib
 from datetime import datetime
 import logging
 
-from . import renderers, util
-from .page import Page, Author
-from .dev_server import DevServer
-from .yamlutil import load_file, write_file
+from . import (renderers, util, incremental, parallel, cache, highlight,
+    __version__)
+from .output import (OutputSync, OutputWriter, MediaStrategies, publish_file,
+    publish_tree)
+from .page import Page, Author, ReleaseTracker
+from .jinja import template_dependencies
+from .profiler import Profiler, no_measure, describe
+from .yamlutil import load_file, write_file, clear_includes
 
 
 class Engine(object):
@@ -29,8 +36,55 @@ class Engine(object):
         'slug_from_filename': False,
         'relative_urls': False,
         'markdown_extra_plugins': [],
+        'incremental': False,
+        'cache_dir': '.wokcache',
+        'jobs': 1,
+        'markup_cache': False,
+        'markup_cache_size': 100,
+        'highlight_cache': False,
+        'highlight_cache_size': 20,
+        'output_sync': False,
+        'media_strategy': 'copy',
+        'write_threads': 2,
+        'profile': False,
+        'profile_top': 10,
+        'jinja2_bytecode_cache': False,
+        'jinja2_cache_size': 400,
     }
 
+    # Site variables which are not tracked as dependencies of a page.
+    untracked_site_vars = ('datetime', 'date', 'time')
+
+    # Cache of rendered markup, if enabled.
+    markup_cache = None
+
+    # Cache of highlighted code, if enabled.
+    highlight_cache = None
+
+    # Releases the markup of written pages, if it is rendered on demand.
+    release_tracker = None
+
+    # Synchronization of the output directory, if enabled.
+    output_sync = None
+
+    # Writer of the rendered pages during render_site.
+    output_writer = None
+
+    # If the engine stays in memory between builds (dev server), the
+    # dependencies of the last build are kept for targeted rebuilds.
+    resident = False
+    deps = None
+
+    # Timings of the current build, if profiling.
+    profiler = None
+
+    # Sorted pagination lists of the current build.
+    sorted_views = None
+
+    # The rendered pages by output file name, kept in memory for the
+    # dev server.
+    output_pages = None
+
     def __init__(self, site_root=None, config='wokconfig'):
         """Setup the site root and config filename."""
         if site_root is None:
@@ -39,14 +93,17 @@ class Engine(object):
             self.site_root = site_root
         self.config = config
 
-    def run(self, server=None, init_site_title=None):
-        """Generate site or run dev server."""
+    def run(self, server=None, init_site_title=None, options=None):
+        """Generate site or run dev server. The given options override
+        the ones from the config file."""
         orig_dir = os.getcwd()
         try:
             os.chdir(self.site_root)
             if init_site_title:
                 self.init_site(init_site_title)
             self.read_options()
+            if options:
+                self.options.update(options)
             self.sanity_check()
             if server:
                self.start_server(server)
@@ -74,10 +131,12 @@ class Engine(object):
                 os.mkdir(required_dir)
 
     def start_server(self, hostport):
-        ''' Run the dev server if the user said to, and watch the specified
-        directories for changes. The server will regenerate the entire wok
-        site if changes are found after every request.
+        ''' Generate the site and run the dev server if the user said to,
+        and watch the specified directories for changes. After changes,
+        the server rebuilds the affected parts of the wok site in the
+        background and serves the rendered pages from memory.
         '''
+        from .dev_server import DevServer
         if ':' in hostport:
             host, port = hostport.split(':', 1)
             port = int(port)
@@ -91,22 +150,234 @@ class Engine(object):
                 self.options['template_dir'],
                 self.options['content_dir']
             ],
-            change_handler=self.generate_site)
+            change_handler=self.rebuild,
+            get_page=self.get_output_page)
+        # keep the pages of this build for rebuilds after changes
+        self.site_root = os.path.abspath(self.site_root)
+        self.resident = True
+        self.generate_site()
         server.run()
 
     def generate_site(self):
         """Generate the wok site"""
         self.all_pages = []
-        self.load_hooks()
-        self.load_renderers()
-        self.renderer_options()
+        if self.resident:
+            self.output_pages = {}
+        if self.options['profile']:
+            self.profiler = Profiler()
+        self.run_phase('load_hooks')
+        self.run_phase('load_renderers')
+        self.run_phase('renderer_options')
+        self.run_phase('load_dependencies')
+        self.run_phase('open_caches')
+        self.run_phase('start_templates')
 
         self.run_hook('site.start')
-        self.prepare_output()
-        self.load_pages()
-        self.make_tree()
-        self.render_site()
+        self.run_phase('prepare_output')
+        self.run_phase('load_pages')
+        self.run_phase('make_tree')
+        self.run_phase('index_site')
+        self.run_phase('render_site')
+        self.run_phase('save_dependencies')
+        self.run_phase('prune_caches')
         self.run_hook('site.done')
+        self.run_phase('remove_stale_output')
+        self.run_phase('end_templates')
+        clear_includes()
+        highlight.clear()
+        if self.profiler is not None:
+            self.report_profile()
+
+    def run_phase(self, name):
+        """Run a build phase, the engine method of the given name."""
+        with self.profile('phase', name):
+            getattr(self, name)()
+
+    def profile(self, kind, name):
+        """Get a context manager measuring the time of a phase, hook,
+        renderer or page if profiling."""
+        if self.profiler is None:
+            return no_measure
+        return self.profiler.measure(kind, name)
+
+    def report_profile(self):
+        """Write the timings of the build to the profile file and print
+        the slowest phases, hooks, renderers and pages."""
+        profiler, self.profiler = self.profiler, None
+        profiler.stop()
+        filename = self.options['profile']
+        if filename is True:
+            filename = 'wok-profile.json'
+        profiler.write_json(filename)
+        print(profiler.report(self.options['profile_top']))
+        print('Wrote profile to {0}'.format(filename))
+
+    def rebuild(self, changes):
+        """
+        Rebuild the site after the given files changed, reusing the pages
+        and the dependencies of the last build in memory. Only changed
+        content files are loaded again, only changed media files are
+        copied, and only pages whose dependencies changed are rendered.
+        """
+        orig_dir = os.getcwd()
+        try:
+            os.chdir(self.site_root)
+            kind = self.classify_changes(changes)
+            if kind is None or self.deps is None:
+                # no resident build, or unknown changes
+                self.generate_site()
+                return
+            content, templates, media = kind
+            logging.info('Rebuilding after {0} changes.'.format(len(changes)))
+            self.start_templates()
+            self.run_hook('site.start')
+            if media:
+                output = self.options['output_dir']
+                self.run_hook('site.output.pre', output)
+                self.update_media(media)
+                self.run_hook('site.output.post', output)
+            if content or templates:
+                self.rebuild_all = False
+                self.deps.next_build()
+                self.update_templates(templates)
+                self.all_pages = []
+                for pages in self.run_hook('site.content.gather.pre'):
+                    if pages:
+                        self.all_pages.extend(pages)
+                self.update_pages(content)
+                self.gather_pages()
+                self.make_tree()
+                self.index_site()
+                self.render_site()
+                self.save_dependencies()
+            self.run_hook('site.done')
+        except Exception:
+            # the resident build is incomplete, start from scratch
+            self.deps = None
+            raise
+        finally:
+            self.end_templates()
+            clear_includes()
+            highlight.clear()
+            os.chdir(orig_dir)
+
+    def start_templates(self):
+        """Set up the template environment for a build. Template files
+        must not change during the build."""
+        if Page.tmpl_env is None:
+            Page.create_tmpl_env(self.options)
+        Page.tmpl_env.loader.start_build()
+
+    def end_templates(self):
+        """Check templates for changes again after a build."""
+        if Page.tmpl_env is not None:
+            Page.tmpl_env.loader.end_build()
+
+    def classify_changes(self, changes):
+        """
+        Sort the changed paths into content, template and media files.
+        Returns None if something else changed, eg. a whole watched
+        directory.
+        """
+        dirs = {}
+        for name in ('content_dir', 'template_dir', 'media_dir'):
+            dirs[name] = os.path.abspath(self.options[name])
+        kinds = dict((name, set()) for name in dirs)
+        for path in changes:
+            for name, directory in dirs.items():
+                if path.startswith(directory + os.sep):
+                    kinds[name].add(path)
+                    break
+            else:
+                return None
+        return kinds['content_dir'], kinds['template_dir'], kinds['media_dir']
+
+    def update_media(self, paths):
+        """Copy changed media files to the output folder, and remove the
+        ones deleted from the media folder."""
+        media_dir = os.path.abspath(self.options['media_dir'])
+        output = self.options['output_dir']
+        strategy = self.options['media_strategy']
+        for path in sorted(paths):
+            dest = os.path.join(output, os.path.relpath(path, media_dir))
+            if os.path.isdir(dest) and not os.path.islink(dest):
+                shutil.rmtree(dest)
+            elif os.path.lexists(dest):
+                os.unlink(dest)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), dest)
+            elif os.path.isdir(path):
+                publish_tree(path, dest, strategy)
+            elif os.path.isfile(path):
+                parent = os.path.dirname(dest)
+                if not os.path.isdir(parent):
+                    os.makedirs(parent)
+                publish_file(path, dest, strategy)
+
+    def update_templates(self, paths):
+        """Forget everything known about changed templates."""
+        if not paths:
+            return
+        # extends, includes and imports may have changed
+        self.template_files = {}
+        for filename in list(self.template_digests):
+            if os.path.abspath(filename) in paths:
+                del self.template_digests[filename]
+        # get the new versions of the templates
+        templates = {}
+        for p in self.content_pages:
+            name = p.template.name
+            if name not in templates:
+                templates[name] = Page.tmpl_env.get_template(name)
+            p.template = templates[name]
+
+    def update_pages(self, paths):
+        """Load the changed content files again, remove deleted ones and
+        reset the other content pages for a new build."""
+        def changed(path):
+            """Check if path or one of its directories changed."""
+            while path not in paths:
+                parent = os.path.dirname(path)
+                if parent == path:
+                    return False
+                path = parent
+            return True
+
+        # all changed content files which still exist
+        files = set()
+        for root in paths:
+            if os.path.isdir(root):
+                files.update(os.path.join(d, f) for d, dirs, names in
+                    os.walk(root) for f in names)
+            elif os.path.isfile(root):
+                files.add(root)
+        files = set(f for f in files
+            if not os.path.basename(f).startswith('.'))
+
+        content_pages = []
+        for p in self.content_pages:
+            path = os.path.abspath(p.path)
+            if not changed(path):
+                p.reset()
+                content_pages.append(p)
+            elif path in files:
+                # keep the position of changed pages
+                files.remove(path)
+                p = self.load_page(p.path)
+                if p:
+                    content_pages.append(p)
+        if files:
+            # new files, keep the order of a full build
+            for path in files:
+                p = self.load_page(os.path.relpath(path))
+                if p:
+                    content_pages.append(p)
+            order = {}
+            for root, dirs, names in os.walk(self.options['content_dir']):
+                for f in names:
+                    order[os.path.abspath(os.path.join(root, f))] = len(order)
+            content_pages.sort(key=lambda p: order[os.path.abspath(p.path)])
+        self.content_pages = content_pages
 
     def read_options(self):
         """Load options from the config file."""
@@ -146,7 +417,16 @@ class Engine(object):
                 logging.critical("%s %r not found at %s, aborting" % (name, self.options[name], self.site_root))
                 sys.exit(1)
         # always exclude dotfiles
-        self.options['output_exclude'].append(".*")
+        self.options['output_exclude'] = (
+                list(self.options['output_exclude']) + [".*"])
+        if self.options['media_strategy'] not in MediaStrategies:
+            logging.critical("Unknown media_strategy %r, must be one of %s, aborting"
+                % (self.options['media_strategy'],
+                   ", ".join(sorted(MediaStrategies))))
+            sys.exit(1)
+        # zero or less jobs means one job per CPU
+        if self.options['jobs'] < 1:
+            self.options['jobs'] = parallel.cpu_count()
         logging.debug("Using options %s" % self.options)
 
     def load_hooks(self):
@@ -184,9 +464,110 @@ class Engine(object):
 
     def run_hook(self, hook_name, *args):
         """ Run specified hook functions if they exist """
-        funcs = self.hooks.get(hook_name, [])
+        funcs = getattr(self, 'hooks', {}).get(hook_name, [])
         logging.debug('Running hook {0} with {1} functions'.format(hook_name, len(funcs)))
-        return [hook(self.options, *args) for hook in funcs]
+        if self.profiler is None:
+            return [hook(self.options, *args) for hook in funcs]
+        results = []
+        for hook in funcs:
+            name = '{0} {1}'.format(hook_name, describe(hook))
+            with self.profiler.measure('hook', name):
+                results.append(hook(self.options, *args))
+        return results
+
+    def build_signature(self):
+        """
+        Get a digest of everything all pages depend upon: the wok version,
+        the config file, and the hooks and renderers modules.
+        """
+        digest = hashlib.md5(__version__.encode('utf-8'))
+        for filename in (self.config, os.path.join('hooks', '__hooks__.py'),
+                os.path.join('renderers', '__renderers__.py')):
+            if os.path.isfile(filename):
+                digest.update(incremental.file_digest(filename).encode('ascii'))
+        return digest.hexdigest()
+
+    def load_dependencies(self):
+        """Load the dependency graph of the last build for incremental
+        builds."""
+        self.deps = None
+        self.rebuild_all = True
+        self.template_files = {}
+        self.template_digests = {}
+        if not (self.options['incremental'] or self.resident):
+            return
+        filename = os.path.join(self.options['cache_dir'], 'deps.json')
+        self.deps = incremental.DependencyGraph(filename,
+                self.build_signature())
+        if (self.options['incremental'] and self.deps.load() and
+            os.path.isdir(self.options['output_dir'])):
+            self.rebuild_all = False
+
+    def save_dependencies(self):
+        """Remove stale output files and store the dependency graph for
+        the next incremental build."""
+        if self.deps is None:
+            return
+        for path in self.deps.stale_outputs():
+            self.remove_output(path)
+        if self.options['incremental']:
+            self.deps.save()
+
+    def open_caches(self):
+        """Set up the enabled caches in the cache directory."""
+        self.markup_cache = None
+        if self.options['markup_cache']:
+            self.markup_cache = cache.FileCache(
+                    os.path.join(self.options['cache_dir'], 'markup'),
+                    self.options['markup_cache_size'] * 1024 * 1024)
+        self.highlight_cache = None
+        if self.options['highlight_cache']:
+            self.highlight_cache = cache.FileCache(
+                    os.path.join(self.options['cache_dir'], 'highlight'),
+                    self.options['highlight_cache_size'] * 1024 * 1024)
+        highlight.set_cache(self.highlight_cache)
+
+    def prune_caches(self):
+        """Remove least recently used entries from oversized caches."""
+        if self.markup_cache is not None:
+            self.markup_cache.prune()
+        if self.highlight_cache is not None:
+            self.highlight_cache.prune()
+
+    def render_text(self, renderer, text):
+        """Render markup text with the given renderer."""
+        return self.render_texts(renderer, [text])[0]
+
+    def render_texts(self, renderer, texts):
+        """Render a list of markup texts with the given renderer. Unless
+        a text is empty, the rendered text is looked up in and stored in
+        the markup cache if it is enabled."""
+        with self.profile('renderer', describe(renderer)):
+            return self.render_cached(renderer, texts)
+
+    def render_cached(self, renderer, texts):
+        """Render markup texts in one batch, using the markup cache if
+        enabled."""
+        cache_key = getattr(renderer, 'cache_key', None)
+        config = None
+        if self.markup_cache is not None and cache_key is not None:
+            config = cache_key()
+        if config is None:
+            return renderers.render_many(renderer, texts)
+        results = [None] * len(texts)
+        keys = {}
+        for i, text in enumerate(texts):
+            if text:
+                keys[i] = cache.make_key(__version__, config, text)
+                results[i] = self.markup_cache.get(keys[i])
+        missing = [i for i, rendered in enumerate(results) if rendered is None]
+        rendered = renderers.render_many(renderer,
+                [texts[i] for i in missing])
+        for i, text in zip(missing, rendered):
+            results[i] = text
+            if i in keys:
+                self.markup_cache.set(keys[i], text)
+        return results
 
     def exclude_output(self, filename):
         """Determine if output filename should be excluded."""
@@ -199,10 +580,20 @@ class Engine(object):
     def prepare_output(self):
         """
         Prepare the output directory. Remove any contents there already, and
-        then copy over the media files, if they exist.
+        then copy over the media files, if they exist. If the output is
+        synchronized, nothing is removed now and only changed media files
+        are copied.
         """
         output = self.options['output_dir']
-        self.clean_output(output)
+        if self.options['output_sync']:
+            self.output_sync = OutputSync(output, self.exclude_output,
+                    self.options['media_strategy'])
+            if not os.path.isdir(output):
+                os.makedirs(output)
+        else:
+            self.output_sync = None
+            if self.rebuild_all:
+                self.clean_output(output)
         self.run_hook('site.output.pre', output)
         self.copy_media(output)
         self.run_hook('site.output.post', output)
@@ -227,18 +618,78 @@ class Engine(object):
         if not os.path.isdir(media_dir):
             # no media directory found
             return
-        logging.info("Copying media files.")
+        if self.output_sync is not None:
+            self.sync_media(media_dir, output)
+            return
+        strategy = self.options['media_strategy']
+        logging.info("Copying media files ({0}).".format(strategy))
         for name in os.listdir(media_dir):
             path = os.path.join(media_dir, name)
-            if os.path.isdir(path):
+            dest = os.path.join(output, name)
+            if not self.rebuild_all:
+                # the output directory has not been cleaned
+                if os.path.isdir(dest) and not os.path.islink(dest):
+                    shutil.rmtree(dest)
+                elif os.path.lexists(dest):
+                    # never write through links of an earlier build
+                    os.unlink(dest)
+            if strategy != 'copy':
+                if os.path.isdir(path):
+                    publish_tree(path, dest, strategy)
+                else:
+                    publish_file(path, dest, strategy)
+            elif os.path.isdir(path):
                 shutil.copytree(
                         path,
-                        os.path.join(output, name),
+                        dest,
                         symlinks=True
                 )
             else:
                 shutil.copy(path, output)
 
+    def sync_media(self, media_dir, output):
+        """Copy the changed media files to the output folder."""
+        logging.info("Synchronizing media files.")
+        copied = 0
+        for name in os.listdir(media_dir):
+            path = os.path.join(media_dir, name)
+            dest = os.path.join(output, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                copied += self.output_sync.copy_tree(path, dest)
+            elif self.output_sync.copy_file(path, dest):
+                copied += 1
+        logging.info("Copied {0} changed media files.".format(copied))
+
+    def remove_stale_output(self):
+        """Remove output files which were not generated by this build."""
+        if self.output_sync is not None:
+            removed = self.output_sync.remove_stale()
+            logging.info("Removed {0} stale output files.".format(removed))
+
+    def get_output_page(self, path):
+        """Get the contents and modification time of a rendered page by
+        its output file name, or None if it is not in memory."""
+        if self.output_pages is None:
+            return None
+        return self.output_pages.get(os.path.normpath(path))
+
+    def remove_output(self, path):
+        """Remove a stale output file and its empty parent directories."""
+        if self.output_pages is not None:
+            self.output_pages.pop(os.path.abspath(path), None)
+        if os.path.isfile(path):
+            logging.info('Removing stale output file {0}'.format(path))
+            os.unlink(path)
+        output = os.path.abspath(self.options['output_dir'])
+        parent = os.path.abspath(os.path.dirname(path))
+        while parent != output and parent.startswith(output):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                # not empty
+                break
+            parent = os.path.dirname(parent)
+
     def load_pages(self):
         """Load all the content files."""
         # Load pages from hooks (pre)
@@ -247,6 +698,10 @@ class Engine(object):
                 self.all_pages.extend(pages)
 
         # Load files
+        loaded_pages = []
+        # Render the markup later in parallel if requested, or on demand.
+        render_markup = (self.options['jobs'] <= 1 and
+                not self.markup_on_demand())
         for root, dirs, files in os.walk(self.options['content_dir']):
             # Grab all the parsable files
             for f in files:
@@ -254,23 +709,80 @@ class Engine(object):
                 if f.startswith('.'):
                     continue
 
-                ext = f.split('.')[-1]
-                renderer = self.renderers.get(ext)
+                p = self.load_page(os.path.join(root, f), render_markup)
+                if p:
+                    loaded_pages.append(p)
+
+        if self.options['jobs'] > 1:
+            self.render_markup(loaded_pages)
+        self.content_pages = loaded_pages
+        self.gather_pages()
+
+    def markup_on_demand(self):
+        """
+        Check if the markup of content pages is rendered when it is used
+        first, and released after the pages have been written. This needs
+        a single process, and no hooks which might expect the markup of all
+        pages to be rendered.
+        """
+        if self.options['jobs'] > 1:
+            return False
+        hooks = getattr(self, 'hooks', {})
+        return not any(hooks.get(name) for name in
+                ('page.render.pre', 'page.render.post', 'site.done'))
+
+    def load_page(self, path, render_markup=None):
+        """Load a content file with the renderer of its extension. Unless
+        given, the markup is rendered now if it is not rendered on
+        demand."""
+        if render_markup is None:
+            render_markup = not self.markup_on_demand()
+        ext = path.split('.')[-1]
+        renderer = self.renderers.get(ext)
+
+        if renderer is None:
+            logging.warning('No parser found '
+                    'for {0}. Using default renderer.'.format(
+                        os.path.basename(path)))
+            renderer = renderers.Renderer
 
-                if renderer is None:
-                    logging.warning('No parser found '
-                            'for {0}. Using default renderer.'.format(f))
-                    renderer = renderers.Renderer
+        return Page.from_file(path, self.options, self, renderer,
+                render_markup=render_markup)
 
-                p = Page.from_file(os.path.join(root, f), self.options, self, renderer)
-                if p and p.meta['published']:
-                    self.all_pages.append(p)
+    def gather_pages(self):
+        """Add the published content pages and the pages of the
+        `site.content.gather.post` hooks to the site."""
+        self.all_pages.extend(p for p in self.content_pages
+                if p.meta['published'])
 
         # Load pages from hooks (post)
         for pages in self.run_hook('site.content.gather.post', self.all_pages):
             if pages:
                 self.all_pages.extend(pages)
 
+    def render_markup(self, pages):
+        """
+        Render the markup of the given pages with worker processes. The
+        bodies are read and the `page.render.pre` hooks run for all pages
+        before, and the `page.render.post` hooks after the rendering.
+        """
+        for p in pages:
+            p.read_body()
+            self.run_hook('page.render.pre', p)
+        # import the libraries once instead of in every worker process
+        for renderer in set(p.renderer for p in pages):
+            if hasattr(renderer, 'load'):
+                renderer.load()
+        tasks = []
+        for p in pages:
+            tasks.append((self.render_texts,
+                (p.renderer, [p.original, p.original_preview])))
+        results = parallel.run_tasks(tasks, self.options['jobs'])
+        for p, (content, preview) in zip(pages, results):
+            p.meta['content'] = content
+            p.meta['preview'] = preview
+            self.run_hook('page.render.post', p)
+
     def make_tree(self):
         """
         Make the category pseudo-tree.
@@ -281,82 +793,281 @@ class Engine(object):
         """
         self.categories = {}
         site_tree = []
+        # The pages placed in the tree, by category path and slug. The
+        # parent of a page is the first page placed with the slug of the
+        # last category, in the category path of the remaining categories.
+        nodes = {}
         # We want to parse these in a approximately breadth first order
         self.all_pages.sort(key=lambda p: len(p.meta['category']))
 
         # For every page
         for p in self.all_pages:
+            category = p.meta['category']
             # If it has a category (ie: is not at top level)
-            if len(p.meta['category']) > 0:
-                top_cat = p.meta['category'][0]
+            if len(category) > 0:
+                top_cat = category[0]
                 if not top_cat in self.categories:
                     self.categories[top_cat] = []
 
                 self.categories[top_cat].append(p.meta)
 
-            try:
                 # Put this page's meta in the right place in site_tree.
+                parent = nodes.get(tuple(category[:-1]), {}).get(category[-1])
+                if parent is None:
+                    logging.error('It looks like the page "{0}" is an orphan! '
+                            'This will probably cause problems.'.format(p.path))
+                    continue
+                siblings = parent['subpages']
+            else:
                 siblings = site_tree
-                for cat in p.meta['category']:
-                    # This line will fail if the page is an orphan
-                    parent = [subpage for subpage in siblings
-                                 if subpage['slug'] == cat][0]
-                    siblings = parent['subpages']
-                siblings.append(p.meta)
-            except IndexError:
-                logging.error('It looks like the page "{0}" is an orphan! '
-                        'This will probably cause problems.'.format(p.path))
+            siblings.append(p.meta)
+            nodes.setdefault(tuple(category), {}).setdefault(
+                    p.meta['slug'], p.meta)
+
+    def index_site(self):
+        """
+        Index the pages by tag, slug, author and date in one pass.
+
+        `self.tags` - Maps tags to lists of pages.
+        `self.slugs` - Maps slugs to pages.
+        `self.author_pages` - Maps author names (or emails) to lists of pages.
+        `self.archive` - Maps years to dictionaries mapping months to lists
+            of pages.
+        """
+        self.tags = {}
+        self.slugs = {}
+        self.author_pages = {}
+        self.archive = {}
+        for p in self.all_pages:
+            meta = p.meta
+            # without duplicates, in order
+            for tag in dict.fromkeys(meta['tags']):
+                self.tags.setdefault(tag, []).append(meta)
+            self.slugs[meta['slug']] = meta
+            names = set()
+            for author in meta['authors']:
+                name = author.name or author.email
+                if name and name not in names:
+                    names.add(name)
+                    self.author_pages.setdefault(name, []).append(meta)
+            date = meta['date']
+            if date is not None:
+                months = self.archive.setdefault(date.year, {})
+                months.setdefault(date.month, []).append(meta)
+
+    def make_site_context(self):
+        """
+        Get the site template variables shared by all pages. All pages
+        see the same build time, and `pages` holds the pages as loaded,
+        without pagination pages.
+        """
+        now = datetime.now()
+        site = {
+            'title': self.options.get('site_title', 'Untitled'),
+            'datetime': now,
+            'date': now.date(),
+            'time': now.time(),
+            'tags': self.tags,
+            'pages': self.all_pages[:],
+            'categories': self.categories,
+            'slugs': self.slugs,
+            'author_pages': self.author_pages,
+            'archive': self.archive,
+        }
+
+        for k, v in self.options.items():
+            if k not in ('site_title', 'output_dir', 'content_dir',
+                    'templates_dir', 'media_dir', 'url_pattern'):
+
+                site[k] = v
+
+        if 'author' in self.options:
+            site['author'] = self.options['author']
+        return util.MappingProxyType(site)
 
     def render_site(self):
         """Render every page and write the output files."""
-        # Gather tags
-        tag_set = set()
-        for p in self.all_pages:
-            tag_set = tag_set.union(p.meta['tags'])
-        tag_dict = dict()
-        for tag in tag_set:
-            # Add all pages with the current tag to the tag dict
-            tag_dict[tag] = [p.meta for p in self.all_pages
-                                if tag in p.meta['tags']]
+        self.site_context = self.make_site_context()
+        self.sorted_views = {}
 
-        # Gather slugs
-        slug_dict = dict((p.meta['slug'], p.meta) for p in self.all_pages)
+        if self.deps is not None:
+            self.fingerprint = incremental.Fingerprinter(self.all_pages)
+            self.fingerprints = {}
 
-        for p in self.all_pages:
-            # Construct this every time, to avoid sharing one instance
-            # between page objects.
-            templ_vars = {
-                'site': {
-                    'title': self.options.get('site_title', 'Untitled'),
-                    'datetime': datetime.now(),
-                    'date': datetime.now().date(),
-                    'time': datetime.now().time(),
-                    'tags': tag_dict,
-                    'pages': self.all_pages[:],
-                    'categories': self.categories,
-                    'slugs': slug_dict,
-                },
-            }
+        self.release_tracker = None
+        if self.markup_on_demand():
+            self.release_tracker = ReleaseTracker(self.all_pages,
+                    self.site_context)
 
-            for k, v in self.options.items():
-                if k not in ('site_title', 'output_dir', 'content_dir',
-                        'templates_dir', 'media_dir', 'url_pattern'):
+        self.output_writer = OutputWriter(self.output_sync,
+                self.options['write_threads'])
+        try:
+            self.render_pages()
+        finally:
+            writer, self.output_writer = self.output_writer, None
+            writer.close()
 
-                    templ_vars['site'][k] = v
+    def render_pages(self):
+        """Render the pages, including the pages added while rendering."""
+        # pages to render with worker processes
+        jobs = []
+        index = 0
+        while index < len(self.all_pages):
+            p = self.all_pages[index]
+            index += 1
+            # Every page gets its own layer over the shared site variables,
+            # so pages cannot change each other's data.
+            templ_vars = {
+                'site': incremental.RecordingOverlay({}, self.site_context),
+            }
 
-            if 'author' in self.options:
-                templ_vars['site']['author'] = self.options['author']
+            if self.is_uptodate(p):
+                logging.info('Skipping unchanged page {0}'.format(p.meta['slug']))
+                self.deps.keep(p.output_path())
+                if self.output_sync is not None:
+                    self.output_sync.add(p.output_path())
+                if self.release_tracker is not None:
+                    self.release_tracker.done(p)
+                continue
 
             # Rendering the page might give us back more pages to render.
-            new_pages = p.render(templ_vars)
-
-            if p.meta['make_file']:
-                p.write()
+            with self.profile('page', p.meta['url']):
+                if self.options['jobs'] > 1:
+                    new_pages = p.prepare_render(templ_vars)
+                    jobs.append((p, templ_vars))
+                else:
+                    new_pages = p.render(templ_vars)
+                    if self.release_tracker is not None:
+                        self.release_tracker.add_pages(p, new_pages)
+                    self.write_page(p, templ_vars)
 
             if new_pages:
                 logging.debug('found new_pages')
-                # XXX find a better way to do this
-                self.all_pages += new_pages
+                # Render the further pages of a pagination set next, while
+                # the markup of their items is still loaded.
+                self.all_pages[index:index] = new_pages
+
+        if jobs:
+            self.render_templates(jobs)
+
+    def sorted_view(self, source, sort_key, reverse):
+        """
+        Get a sorted copy of a list for pagination, with the metadata of
+        pages in place of pages. The list is sorted once per build for all
+        pages paginating it with the same order.
+        """
+        if self.sorted_views is None:
+            self.sorted_views = {}
+        key = (id(source), sort_key, reverse)
+        view = self.sorted_views.get(key)
+        if view is None:
+            items = source
+            if items and isinstance(items[0], Page):
+                items = [p.meta for p in items]
+            # keep the source, its id must not be reused
+            view = (source, util.sort_items(items, sort_key, reverse))
+            self.sorted_views[key] = view
+        return view[1]
+
+    def render_templates(self, jobs):
+        """
+        Render the templates of the given prepared pages with worker
+        processes. The `page.template.post` hooks run after all
+        templates have been rendered, in page order.
+        """
+        def render_template(page, templ_vars):
+            """Render the page template in a worker process."""
+            rendered = page.template.render(templ_vars)
+            return rendered, incremental.accessed_keys(templ_vars['site'])
+
+        tasks = [(render_template, job) for job in jobs]
+        results = parallel.run_tasks(tasks, self.options['jobs'])
+        for (p, templ_vars), (rendered, accessed) in zip(jobs, results):
+            p.rendered = rendered
+            # site variables used in the worker process
+            incremental.accessed_keys(templ_vars['site']).update(accessed)
+            with self.profile('page', p.meta['url']):
+                self.run_hook('page.template.post', p)
+                self.write_page(p, templ_vars)
+
+    def write_page(self, page, templ_vars):
+        """Write a rendered page and record its dependencies."""
+        if page.meta['make_file']:
+            data = page.write()
+            if self.output_pages is not None:
+                path = os.path.abspath(page.output_path())
+                self.output_pages[path] = (data, time.time())
+            if self.deps is not None:
+                self.record_dependencies(page, templ_vars['site'])
+        if self.release_tracker is not None:
+            self.release_tracker.done(page)
+
+    def page_dependencies(self, page, site_vars):
+        """Get the current dependencies of a page on its source file, its
+        templates and the given site variables."""
+        return {
+            'source': page.path,
+            'source_hash': page.digest,
+            'includes': self.fingerprint.include_digests(page),
+            'templates': dict((filename, self.template_digest(filename))
+                for filename in self.get_template_files(page.template)),
+            'site': dict((name, self.site_fingerprint(name))
+                for name in site_vars if name not in self.untracked_site_vars),
+            'subpages': self.fingerprint(page.meta['subpages']),
+        }
+
+    def is_uptodate(self, page):
+        """Check if the output file of a page is unchanged since the last
+        build."""
+        if self.rebuild_all or page.digest is None:
+            return False
+        if not page.meta['make_file'] or 'list' in page.meta['pagination']:
+            # Pagination pages depend on the paginated list.
+            return False
+        path = page.output_path()
+        if not os.path.isfile(path):
+            return False
+        old = self.deps.get(path)
+        if old is None:
+            return False
+        new = self.page_dependencies(page, old['site'])
+        return new == old
+
+    def record_dependencies(self, page, site):
+        """Record the dependencies of a rendered page."""
+        path = page.output_path()
+        self.deps.record(path,
+                self.page_dependencies(page, incremental.accessed_keys(site)))
+
+    def site_fingerprint(self, name):
+        """Get fingerprint of a site variable."""
+        if name not in self.fingerprints:
+            self.fingerprints[name] = self.fingerprint(
+                    self.site_context.get(name))
+        return self.fingerprints[name]
+
+    def get_template_files(self, template):
+        """Get the file names of all templates used by the given template."""
+        if template.name not in self.template_files:
+            filenames = template_dependencies(template.environment,
+                    template.name)
+            if filenames is None:
+                # depend on all templates
+                filenames = set()
+                for root, dirs, files in os.walk(self.options['template_dir']):
+                    filenames.update(os.path.join(root, f) for f in files)
+            self.template_files[template.name] = filenames
+        return self.template_files[template.name]
+
+    def template_digest(self, filename):
+        """Get digest of a template file."""
+        if filename not in self.template_digests:
+            if os.path.isfile(filename):
+                digest = incremental.file_digest(filename)
+            else:
+                digest = None
+            self.template_digests[filename] = digest
+        return self.template_digests[filename]
 
 if __name__ == '__main__':
     Engine()
@@ -0,0 +1,107 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Split content files into the metadata header, the preview and the body.
+
+The sections are separated by `---` lines. The scanner finds the section
+boundaries by offset and slices the data, so large documents are not split
+into pieces and joined again. It works on text as well as on bytes, eg. a
+memory mapped file, with lines ending in `\\n`, `\\r\\n` or `\\r`.
+"""
+import os
+import mmap
+import logging
+
+# Files at least this large are searched for the header in a memory map.
+MmapSize = 1024 * 1024
+
+# The delimiter in decoded text with universal newlines.
+Delimiter = u'\n---\n'
+
+
+def _tokens(data):
+    """Get dashes, line feed and carriage return of the type of data."""
+    if isinstance(data, type(u'')):
+        return u'---', u'\n', u'\r'
+    return b'---', b'\n', b'\r'
+
+
+def find_delimiter(data, start=0, end=None):
+    """
+    Find the first `---` line after a line break in data between the
+    offsets `start` and `end`. Returns the offset of the line break before
+    the delimiter and the offset of the line after it, or None.
+    """
+    if end is None:
+        end = len(data)
+    dashes, lf, cr = _tokens(data)
+    pos = data.find(dashes, start + 1, end)
+    while pos != -1:
+        stop = pos + 4
+        before = data[pos - 1:pos]
+        after = data[pos + 3:stop]
+        if stop <= end and before in (lf, cr) and after in (lf, cr):
+            begin = pos - 1
+            if before == lf and begin > start and data[begin - 1:begin] == cr:
+                begin -= 1
+            if after == cr and stop < end and data[stop:stop + 1] == lf:
+                stop += 1
+            return begin, stop
+        pos = data.find(dashes, pos + 1, end)
+    return None
+
+
+def decode(data):
+    """Decode UTF-8 data with universal newlines."""
+    text = data.decode('utf-8')
+    if u'\r' in text:
+        text = text.replace(u'\r\n', u'\n').replace(u'\r', u'\n')
+    return text
+
+
+def read_header(f, blocksize=8192, mmap_size=MmapSize):
+    """
+    Read the header of an open binary file up to the first delimiter.
+    Large files are searched in a memory map. Returns the decoded header,
+    or None if there is no delimiter, and the offset of the body.
+    """
+    size = os.fstat(f.fileno()).st_size
+    if size and size >= mmap_size:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            found = find_delimiter(data)
+            if found is None:
+                return None, 0
+            return decode(data[:found[0]]), found[1]
+        finally:
+            data.close()
+
+    data = b''
+    while True:
+        block = f.read(blocksize)
+        # a delimiter might continue in the next block
+        start = max(len(data) - 8, 0)
+        data += block
+        found = find_delimiter(data, start)
+        # a final \r might be followed by \n in the next block
+        if found is not None and (found[1] < len(data) or not block):
+            return decode(data[:found[0]]), found[1]
+        if not block:
+            return None, 0
+
+
+def split_body(text, name=None):
+    """
+    Split the decoded body of a file into the preview and the content.
+    The preview is the text before the first delimiter, or None if there
+    is none. The content is the whole text with the delimiter lines
+    removed.
+    """
+    pos = text.find(Delimiter)
+    if pos == -1:
+        return None, text
+    if text.find(Delimiter, pos + len(Delimiter)) != -1:
+        logging.warning('Found more --- delimited sections in {0} '
+                        'than expected. Squashing the extra together.'
+                        .format(name))
+        return text[:pos], text.replace(Delimiter, u'\n')
+    return text[:pos], text[:pos] + u'\n' + text[pos + len(Delimiter):]
@@ -0,0 +1,79 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Syntax highlighting with Pygments, memoized by the lexer, the formatter
+options and the code.
+
+Code blocks highlighted by the Markdown codehilite extension and by the
+reStructuredText Pygments directive go through `highlight`. Blocks seen
+before in the build are looked up in memory, and with the
+`highlight_cache` option in a persistent cache of earlier builds.
+"""
+from . import cache
+
+# The persistent cache of highlighted code, if enabled.
+_cache = None
+
+# Highlighted code of the current build: key -> text
+_memo = {}
+
+
+def set_cache(file_cache):
+    """Use the given FileCache for highlighted code, or None."""
+    global _cache
+    _cache = file_cache
+
+
+def clear():
+    """Forget the highlighted code at the end of a build."""
+    _memo.clear()
+
+
+def _options(obj):
+    """Get the options of a lexer or formatter as a string."""
+    options = getattr(obj, 'options', {})
+    return repr(sorted(options.items(), key=lambda item: item[0]))
+
+
+def make_key(code, lexer, formatter):
+    """Get the cache key of code highlighted with a lexer and formatter."""
+    import pygments
+    lexer_type = type(lexer)
+    formatter_type = type(formatter)
+    return cache.make_key(u'Pygments', pygments.__version__,
+        u'{0}.{1}'.format(lexer_type.__module__, lexer_type.__name__),
+        _options(lexer),
+        u'{0}.{1}'.format(formatter_type.__module__, formatter_type.__name__),
+        _options(formatter), code)
+
+
+def highlight(code, lexer, formatter, outfile=None):
+    """Highlight code like `pygments.highlight`, if possible from the
+    cache."""
+    import pygments
+    if outfile is not None or lexer.filters:
+        return pygments.highlight(code, lexer, formatter, outfile)
+    key = make_key(code, lexer, formatter)
+    result = _memo.get(key)
+    if result is None and _cache is not None:
+        result = _cache.get(key)
+    if result is None:
+        result = pygments.highlight(code, lexer, formatter)
+        if not isinstance(result, type(u'')):
+            # encoded output
+            return result
+        if _cache is not None:
+            _cache.set(key, result)
+    _memo[key] = result
+    return result
+
+
+def install_markdown():
+    """Highlight the code blocks of the Markdown codehilite and
+    fenced_code extensions with `highlight`."""
+    try:
+        from markdown.extensions import codehilite
+    except ImportError:
+        return
+    # only set if codehilite found Pygments
+    if getattr(codehilite, 'highlight', None) is not None:
+        codehilite.highlight = highlight
@@ -0,0 +1,232 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Dependency tracking for incremental builds.
+
+For every output file the source file hash, the files included by its
+metadata, the template files used to render it and fingerprints of the
+site data it consumed are recorded and persisted between builds. A page
+only needs to be rebuilt if one of these changed.
+"""
+import io
+import os
+import json
+import codecs
+import hashlib
+import logging
+try:
+    from collections.abc import Mapping
+except ImportError:
+    # Python 2
+    from collections import Mapping
+
+from .util import Overlay, SliceView
+
+# Increase when the format of the stored dependency graph changes.
+GraphVersion = 2
+
+
+def text_digest(text):
+    """Get hex digest of given (unicode) text."""
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def file_digest(filename, blocksize=65536):
+    """Get hex digest of the given file contents."""
+    digest = hashlib.md5()
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(blocksize)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def text_file_digest(filename, blocksize=65536):
+    """Get hex digest of the text of an UTF-8 encoded file read with
+    universal newlines, without holding the whole text in memory. This
+    is the `text_digest` of the text."""
+    digest = hashlib.md5()
+    with io.open(filename, 'r', encoding='utf-8') as f:
+        while True:
+            text = f.read(blocksize)
+            if not text:
+                break
+            digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class RecordingOverlay(Overlay):
+    """Overlay remembering which keys have been looked up, see
+    `accessed_keys`."""
+
+    def __init__(self, own, shared):
+        """Initialize the set of accessed keys."""
+        super(RecordingOverlay, self).__init__(own, shared)
+        self._accessed = set()
+
+    def __getitem__(self, key):
+        """Record key access."""
+        self._accessed.add(key)
+        return super(RecordingOverlay, self).__getitem__(key)
+
+    def __iter__(self):
+        """Iterating means that all keys are used."""
+        keys = list(super(RecordingOverlay, self).__iter__())
+        self._accessed.update(keys)
+        return iter(keys)
+
+
+def accessed_keys(mapping):
+    """Get the set of keys looked up in a RecordingOverlay."""
+    return mapping._accessed
+
+
+class Fingerprinter(object):
+    """
+    Compute stable fingerprints of site data. Page metadata found in the
+    data is represented by the digest of its source instead of being
+    traversed: the source file, its path, the URL and slug derived from
+    it, and the files included by its metadata.
+    """
+
+    def __init__(self, pages):
+        """Remember the source digests of the given pages."""
+        # included file -> digest
+        self.file_digests = {}
+        self.digests = {}
+        for p in pages:
+            if p.digest is not None:
+                self.digests[id(p.meta)] = self.page_digest(p)
+
+    def page_digest(self, page):
+        """Get hex digest of the source of a page."""
+        digest = hashlib.md5()
+        self._update(digest, [page.digest, page.path, page.meta.get('url'),
+                page.meta.get('slug'), self.include_digests(page)], set())
+        return digest.hexdigest()
+
+    def include_digests(self, page):
+        """Get the digests of the files included by the metadata of a page
+        by file name."""
+        return dict((filename, self.file_digest(filename))
+                for filename in page.includes)
+
+    def file_digest(self, filename):
+        """Get hex digest of an included file, or None if it is gone."""
+        if filename not in self.file_digests:
+            if os.path.isfile(filename):
+                digest = file_digest(filename)
+            else:
+                digest = None
+            self.file_digests[filename] = digest
+        return self.file_digests[filename]
+
+    def __call__(self, value):
+        """Get hex digest of given value."""
+        digest = hashlib.md5()
+        self._update(digest, value, set())
+        return digest.hexdigest()
+
+    def _update(self, digest, value, seen):
+        """Feed value into the digest."""
+        meta = getattr(value, 'meta', None)
+        if isinstance(meta, Mapping):
+            # a page object
+            value = meta
+        if id(value) in self.digests:
+            digest.update(self.digests[id(value)].encode('ascii'))
+        elif isinstance(value, (Mapping, list, tuple, SliceView)):
+            if id(value) in seen:
+                # circular reference, eg. pagination links
+                digest.update(b'<recursion>')
+                return
+            seen.add(id(value))
+            if isinstance(value, Mapping):
+                for key in sorted(value, key=repr):
+                    self._update(digest, key, seen)
+                    self._update(digest, value[key], seen)
+            else:
+                for item in value:
+                    self._update(digest, item, seen)
+            seen.discard(id(value))
+        else:
+            digest.update(repr(value).encode('utf-8', 'replace'))
+
+
+class DependencyGraph(object):
+    """
+    The dependencies of every output file of a build. The graph of the
+    last build is loaded from and the new graph saved to a JSON file.
+    """
+
+    def __init__(self, filename, signature):
+        """
+        Initialize an empty graph. The signature identifies everything
+        that all pages depend upon (configuration, hooks, ...); a stored
+        graph with a different signature is discarded.
+        """
+        self.filename = filename
+        self.signature = signature
+        # dependencies of the last build
+        self.old = {}
+        # dependencies of the current build
+        self.new = {}
+
+    def load(self):
+        """Load the graph of the last build. Returns True if found."""
+        if not os.path.isfile(self.filename):
+            logging.info('No dependency graph found, rebuilding everything.')
+            return False
+        try:
+            with codecs.open(self.filename, 'r', 'utf-8') as f:
+                data = json.load(f)
+        except ValueError as e:
+            logging.warning('Ignoring broken dependency graph {0}: {1}'
+                    .format(self.filename, e))
+            return False
+        if (data.get('version') != GraphVersion or
+            data.get('signature') != self.signature):
+            logging.info('Site configuration changed, rebuilding everything.')
+            return False
+        self.old = data['outputs']
+        logging.debug('Loaded dependencies of {0} output files.'
+                .format(len(self.old)))
+        return True
+
+    def save(self):
+        """Store the graph of the current build."""
+        data = {
+            'version': GraphVersion,
+            'signature': self.signature,
+            'outputs': self.new,
+        }
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with codecs.open(self.filename, 'w', 'utf-8') as f:
+            json.dump(data, f, sort_keys=True)
+
+    def get(self, output):
+        """Get the recorded dependencies of an output file of the last
+        build or None."""
+        return self.old.get(output)
+
+    def record(self, output, dependencies):
+        """Record the dependencies of an output file."""
+        self.new[output] = dependencies
+
+    def keep(self, output):
+        """Keep the dependencies of an unchanged output file."""
+        self.new[output] = self.old[output]
+
+    def next_build(self):
+        """Start a new build based on the current graph, eg. for a
+        rebuild in memory."""
+        self.old = self.new
+        self.new = {}
+
+    def stale_outputs(self):
+        """Get output files of the last build that were not generated
+        again."""
+        return sorted(set(self.old) - set(self.new))
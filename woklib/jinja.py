@@ -1,8 +1,10 @@
 # -*- coding: iso-8859-1 -*-
 import glob
 import os
+import re
 import codecs
 
+from jinja2 import meta
 from jinja2.loaders import FileSystemLoader, TemplateNotFound
 from jinja2.loaders import split_template_path
 
@@ -24,14 +26,94 @@ class GlobFileLoader(FileSystemLoader):
 
     Per default the template encoding is ``'utf-8'`` which can be changed
     by setting the `encoding` parameter to something else.
+
+    The template files are indexed, so that exact names and names like
+    ``default.*`` are found without globbing. Other patterns are globbed.
+    During a build (see `start_build`), templates are assumed not to
+    change.
     """
 
+    def __init__(self, *args, **kwargs):
+        """Initialize the index."""
+        super(GlobFileLoader, self).__init__(*args, **kwargs)
+        # per search path: file names by template name and by name
+        # prefixes ending with a dot
+        self.index = None
+        # modification times of the indexed directories
+        self.index_mtimes = None
+        self.frozen = False
+        self.build = 0
+
+    def start_build(self):
+        """
+        Start a build. Template files do not change until `end_build` is
+        called: the index is not checked, and templates loaded during the
+        build are not checked for modification.
+        """
+        self.index = None
+        self.build += 1
+        self.frozen = True
+
+    def end_build(self):
+        """End a build; check for changed templates again."""
+        self.frozen = False
+
+    def get_index(self):
+        """Get the index of the template files, up to date unless
+        during a build."""
+        if self.index is not None and not self.frozen:
+            if self.dir_mtimes() != self.index_mtimes:
+                self.index = None
+        if self.index is None:
+            self.index_mtimes = self.dir_mtimes()
+            self.index = [self.make_index(searchpath)
+                for searchpath in self.searchpath]
+        return self.index
+
+    def dir_mtimes(self):
+        """Get the modification times of all template directories."""
+        mtimes = {}
+        for searchpath in self.searchpath:
+            for root, dirs, files in os.walk(searchpath, followlinks=True):
+                mtimes[root] = os.path.getmtime(root)
+        return mtimes
+
+    def make_index(self, searchpath):
+        """Index the template files of a search path."""
+        names = {}
+        prefixes = {}
+        for root, dirs, files in os.walk(searchpath, followlinks=True):
+            rel = os.path.relpath(root, searchpath)
+            if rel == os.curdir:
+                parts = []
+            else:
+                parts = rel.split(os.sep)
+            for f in files:
+                filename = os.path.join(root, f)
+                names['/'.join(parts + [f])] = filename
+                # name.* matches every file name starting with "name."
+                dot = f.find('.')
+                while dot >= 0:
+                    prefix = '/'.join(parts + [f[:dot + 1]])
+                    prefixes.setdefault(prefix, []).append(filename)
+                    dot = f.find('.', dot + 1)
+        return names, prefixes
+
+    def find_files(self, pieces, index, searchpath):
+        """Get the files matching the template name in a search path."""
+        name = '/'.join(pieces)
+        if not has_magic(name):
+            filename = index[0].get(name)
+            return [filename] if filename else []
+        if name.endswith('.*') and not has_magic(name[:-1]):
+            return index[1].get(name[:-1], [])
+        return glob.glob(os.path.join(searchpath, *pieces))
+
     def get_source(self, environment, template):
         """Get template source."""
         pieces = split_template_path(template)
-        for searchpath in self.searchpath:
-            globbed_filename = os.path.join(searchpath, *pieces)
-            filenames = glob.glob(globbed_filename)
+        for searchpath, index in zip(self.searchpath, self.get_index()):
+            filenames = self.find_files(pieces, index, searchpath)
             if len(filenames) > 1:
                 raise AmbiguousTemplate(template)
             elif len(filenames) < 1:
@@ -42,8 +124,12 @@ class GlobFileLoader(FileSystemLoader):
                 contents = f.read()
 
             mtime = os.path.getmtime(filename)
+            build = self.build
             def uptodate():
                 """Check if file is uptodate."""
+                if self.frozen and self.build == build:
+                    # loaded during the current build
+                    return True
                 try:
                     return os.path.getmtime(filename) == mtime
                 except OSError:
@@ -51,3 +137,39 @@ class GlobFileLoader(FileSystemLoader):
             return contents, filename, uptodate
         else:
             raise TemplateNotFound(template)
+
+
+MagicCheck = re.compile('[*?[]')
+
+def has_magic(name):
+    """Check if a template name is a glob pattern."""
+    return MagicCheck.search(name) is not None
+
+
+def template_dependencies(environment, name):
+    """
+    Get the file names of the given template and of all templates it
+    extends, includes or imports. Returns None if the dependencies can
+    not be determined, eg. because a template name is computed at
+    runtime.
+    """
+    filenames = set()
+    todo = [name]
+    seen = set()
+    while todo:
+        name = todo.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        try:
+            source, filename, uptodate = environment.loader.get_source(
+                    environment, name)
+        except (TemplateNotFound, AmbiguousTemplate):
+            return None
+        filenames.add(filename)
+        ast = environment.parse(source, name, filename)
+        for referenced in meta.find_referenced_templates(ast):
+            if referenced is None:
+                return None
+            todo.append(referenced)
+    return filenames
@@ -0,0 +1,359 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Synchronize the output directory with the generated site.
+
+Instead of removing the output directory and writing everything again,
+only changed files are copied or written. Unchanged files keep their
+modification time, so tools like rsync only see the files that really
+changed. Files not generated by the build are removed at the end.
+
+Media files can be published by copying them, or by hard links, reflinks
+(copy-on-write clones) or symbolic links to the media directory.
+
+Rendered pages are written by an output writer, optionally in background
+threads while the build goes on.
+"""
+import os
+import math
+import stat
+import time
+import errno
+import shutil
+import logging
+import itertools
+import threading
+try:
+    from Queue import Queue
+except ImportError:
+    # Python 3
+    from queue import Queue
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+# Linux ioctl to clone a file on copy-on-write file systems (btrfs, xfs)
+FICLONE = 0x40049409
+
+try:
+    from os import replace as replace_file
+except ImportError:
+    # Python 2, rename replaces files atomically on POSIX systems
+    replace_file = os.rename
+
+# unique suffixes of temporary files
+_temp_counter = itertools.count()
+
+
+def copy_file(src, dest):
+    """Copy a file with its modification time."""
+    shutil.copy2(src, dest)
+
+
+def hardlink_file(src, dest):
+    """Create a hard link to a file."""
+    os.link(src, dest)
+
+
+def symlink_file(src, dest):
+    """Create a symbolic link to a file."""
+    os.symlink(os.path.abspath(src), dest)
+
+
+def reflink_file(src, dest):
+    """Clone a file sharing its data blocks with the original."""
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this platform')
+    with open(src, 'rb') as fsrc:
+        with open(dest, 'wb') as fdest:
+            fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dest)
+
+
+# How media files can be published in the output directory.
+MediaStrategies = {
+    'copy': copy_file,
+    'hardlink': hardlink_file,
+    'reflink': reflink_file,
+    'symlink': symlink_file,
+}
+
+
+def publish_file(src, dest, strategy):
+    """
+    Publish the file src at dest with the given media strategy. If that
+    fails, eg. because hard links or reflinks across devices are not
+    possible, the file is copied.
+    """
+    if strategy != 'copy':
+        try:
+            MediaStrategies[strategy](src, dest)
+            return
+        except (IOError, OSError) as e:
+            logging.debug('Could not {0} {1}, copying instead: {2}'
+                    .format(strategy, src, e))
+            if os.path.lexists(dest):
+                os.unlink(dest)
+    copy_file(src, dest)
+
+
+def publish_tree(src, dest, strategy):
+    """Publish all files of the src directory tree at dest."""
+    make_dirs(dest)
+    for name in os.listdir(src):
+        src_path = os.path.join(src, name)
+        dest_path = os.path.join(dest, name)
+        if os.path.islink(src_path):
+            os.symlink(os.readlink(src_path), dest_path)
+        elif os.path.isdir(src_path):
+            publish_tree(src_path, dest_path, strategy)
+        else:
+            publish_file(src_path, dest_path, strategy)
+
+
+def same_file(src, dest, strategy='copy'):
+    """Check if dest is the up to date published version of src."""
+    try:
+        src_stat = os.stat(src)
+        dest_stat = os.lstat(dest)
+    except OSError:
+        return False
+    if stat.S_ISLNK(dest_stat.st_mode):
+        return (strategy == 'symlink' and
+                os.readlink(dest) == os.path.abspath(src))
+    if (strategy == 'copy' and src_stat.st_ino == dest_stat.st_ino and
+        src_stat.st_dev == dest_stat.st_dev):
+        # a hard link of an earlier build
+        return False
+    # some file systems only store mtimes with a resolution of seconds
+    return (src_stat.st_size == dest_stat.st_size and
+            int(src_stat.st_mtime) == int(dest_stat.st_mtime))
+
+
+def same_content(path, data):
+    """Check if the file at path contains exactly the given bytes."""
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        with open(path, 'rb') as f:
+            return f.read() == data
+    except (IOError, OSError):
+        return False
+
+
+def make_dirs(path):
+    """Create a directory and its parents if they do not exist."""
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+
+def write_file(path, data):
+    """
+    Write bytes to a temporary file in the directory of path, which then
+    replaces path. Readers never see a partially written file, and links
+    at path are replaced instead of written through.
+    """
+    dirname, name = os.path.split(path)
+    temp = os.path.join(dirname, '.{0}.{1}.{2}.tmp'.format(name,
+            os.getpid(), next(_temp_counter)))
+    fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+            getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        replace_file(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.unlink(temp)
+        raise
+
+
+class OutputWriter(object):
+    """
+    Writes rendered pages to the output directory. Files are replaced
+    atomically, and the directories known to exist are remembered. With
+    threads, files are written in the background while the build goes on,
+    and `close` waits until all files have been written. All writes to
+    the same path go to the same thread, so the last write wins like
+    without threads.
+    """
+
+    # pending writes per thread, limits the memory of queued files
+    queue_size = 64
+
+    def __init__(self, sync=None, threads=0):
+        """
+        Initialize with an optional OutputSync, which skips files that
+        already have the same content, and a number of writer threads.
+        Without threads, files are written right away.
+        """
+        self.sync = sync
+        self.dirs = set()
+        self.errors = []
+        self.threads = []
+        self.queues = []
+        for i in range(threads):
+            queue = Queue(self.queue_size)
+            thread = threading.Thread(target=self.run, args=(queue,),
+                    name='OutputWriter-{0}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+            self.queues.append(queue)
+
+    def write(self, path, data):
+        """Write bytes to the file at path."""
+        if self.sync is not None:
+            self.sync.add(path)
+        if self.threads:
+            queue = self.queues[hash(path) % len(self.queues)]
+            queue.put((path, data))
+        else:
+            self.write_file(path, data)
+
+    def run(self, queue):
+        """Write queued files in a writer thread until None is queued."""
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            try:
+                self.write_file(*item)
+            except Exception as e:
+                self.errors.append(e)
+
+    def write_file(self, path, data):
+        """Write bytes to the file at path, unless it is synchronized and
+        has the same content already."""
+        if self.sync is not None and same_content(path, data):
+            logging.info('Unchanged {0}'.format(path))
+            return
+        logging.info('Writing to {0}'.format(path))
+        self.make_dirs(os.path.dirname(path))
+        write_file(path, data)
+
+    def make_dirs(self, path):
+        """Create a directory and its parents unless they are known to
+        exist."""
+        if not path or path in self.dirs:
+            return
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            # maybe created by another thread
+            if e.errno != errno.EEXIST or not os.path.isdir(path):
+                raise
+        self.dirs.add(path)
+
+    def close(self):
+        """Wait until all files have been written. The first error of the
+        writer threads is raised here."""
+        threads, self.threads = self.threads, []
+        for queue in self.queues:
+            queue.put(None)
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+
+class OutputSync(object):
+    """
+    Keeps track of the files generated by a build in the output directory
+    and removes all others at the end of the build.
+    """
+
+    def __init__(self, output_dir, exclude, media_strategy='copy'):
+        """
+        Initialize for given output directory. Files and directories
+        whose name matches the exclude function are never removed.
+        Media files are published with the given media strategy.
+        """
+        self.output_dir = output_dir
+        self.exclude = exclude
+        self.media_strategy = media_strategy
+        # Files changed after the start of the build (eg. by hooks) are
+        # never removed.
+        self.start = math.floor(time.time())
+        # files and directories generated by this build
+        self.generated = set()
+
+    def add(self, path):
+        """Mark path as generated by this build."""
+        self.generated.add(os.path.normpath(path))
+
+    def copy_file(self, src, dest):
+        """
+        Publish a file unless dest is already up to date. Returns True
+        if the file was published.
+        """
+        self.add(dest)
+        if os.path.islink(src):
+            target = os.readlink(src)
+            if os.path.islink(dest) and os.readlink(dest) == target:
+                return False
+            self.remove(dest)
+            os.symlink(target, dest)
+            return True
+        if same_file(src, dest, self.media_strategy):
+            return False
+        self.remove(dest)
+        publish_file(src, dest, self.media_strategy)
+        return True
+
+    def copy_tree(self, src, dest):
+        """Copy changed files of the src directory tree to dest. Returns
+        the number of copied files."""
+        copied = 0
+        self.add(dest)
+        make_dirs(dest)
+        for name in os.listdir(src):
+            src_path = os.path.join(src, name)
+            dest_path = os.path.join(dest, name)
+            if os.path.isdir(src_path) and not os.path.islink(src_path):
+                if os.path.islink(dest_path) or os.path.isfile(dest_path):
+                    self.remove(dest_path)
+                copied += self.copy_tree(src_path, dest_path)
+            elif self.copy_file(src_path, dest_path):
+                copied += 1
+        return copied
+
+    def remove(self, path):
+        """Remove a file, link or directory tree."""
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.unlink(path)
+
+    def remove_stale(self):
+        """Remove all files of the output directory which were not
+        generated by this build. Returns the number of removed files."""
+        removed = 0
+        for root, dirs, files in os.walk(self.output_dir, topdown=False):
+            for name in files + dirs:
+                path = os.path.normpath(os.path.join(root, name))
+                if path in self.generated or self.is_excluded(path):
+                    continue
+                try:
+                    if name in dirs and not os.path.islink(path):
+                        # remove directories once they are empty
+                        if not os.listdir(path):
+                            os.rmdir(path)
+                        continue
+                    if os.lstat(path).st_mtime >= self.start:
+                        continue
+                    logging.info('Removing stale output file {0}'
+                            .format(path))
+                    os.unlink(path)
+                    removed += 1
+                except OSError as e:
+                    logging.warning('Could not remove {0}: {1}'
+                            .format(path, e))
+        return removed
+
+    def is_excluded(self, path):
+        """Check if path or one of its parent directories in the output
+        directory is excluded."""
+        rel = os.path.relpath(path, self.output_dir)
+        return any(self.exclude(name) for name in rel.split(os.sep))
@@ -1,19 +1,21 @@
 # -*- coding: iso-8859-1 -*-
 # System
+import io
 import os
 import sys
 import logging
 import copy
-import codecs
 
 # Libraries
 import jinja2
 import re
 
 # Wok
-from . import util, renderers
+from . import util, renderers, frontmatter
 from .jinja import GlobFileLoader, AmbiguousTemplate
 from .yamlutil import load_stream
+from .incremental import text_file_digest
+from .output import OutputWriter
 
 class Page(object):
     """
@@ -26,18 +28,47 @@ class Page(object):
     @classmethod
     def create_tmpl_env(cls, options):
         """Construct Jinja template environment."""
+        bytecode_cache = None
+        if options.get('jinja2_bytecode_cache', False):
+            # compiled templates are reused by later builds
+            directory = os.path.abspath(os.path.join(
+                    options.get('cache_dir', '.wokcache'), 'templates'))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            bytecode_cache = jinja2.FileSystemBytecodeCache(directory)
         cls.tmpl_env = jinja2.Environment(
                 loader=GlobFileLoader(
                         options.get('template_dir', 'templates')),
-                extensions=options.get('jinja2_extensions', []))
+                extensions=options.get('jinja2_extensions', []),
+                bytecode_cache=bytecode_cache,
+                cache_size=options.get('jinja2_cache_size', 400))
 
     def __init__(self, options, engine):
         """Initialize a page."""
         self.options = options
         self.filename = None
+        self.path = None
+        # where the body starts in the source file, if there is one
+        self.body_offset = None
+        self.digest = None
+        # paths of the files included by the metadata
+        self.includes = []
         self.meta = {}
         self.engine = engine
 
+    @property
+    def digest(self):
+        """Digest of the source file, if there is one. It is computed on
+        first use, so that loading a page only reads the header."""
+        if self._digest is None and self.body_offset is not None:
+            self._digest = text_file_digest(self.path)
+        return self._digest
+
+    @digest.setter
+    def digest(self, value):
+        """Set the digest of the source file."""
+        self._digest = value
+
     @classmethod
     def from_meta(cls, meta, options, engine, renderer=renderers.Plain):
         """
@@ -64,15 +95,19 @@ class Page(object):
         return page
 
     @classmethod
-    def from_file(cls, path, options, engine, renderer=renderers.Plain):
+    def from_file(cls, path, options, engine, renderer=renderers.Plain,
+            render_markup=True):
         """
-        Load a file from disk, and parse the metadata from it.
+        Load a file from disk, and parse the metadata from it. If
+        `render_markup` is False, the body is read and rendered when the
+        content or preview is used first, or when `render_markup` is called.
 
         Note that you still need to call `render` and `write` to do anything
         interesting.
         """
         page = cls(options, engine)
         page.original = None
+        page.original_preview = None
         page.options = options
         page.renderer = renderer
 
@@ -84,44 +119,74 @@ class Page(object):
         page.path = path
         page.filename = os.path.basename(path)
 
-        with codecs.open(path, 'rU', 'utf-8') as f:
-            page.original = f.read()
-            splits = page.original.split('\n---\n')
-
-            if len(splits) > 3:
-                logging.warning('Found more --- delimited sections in {0} '
-                                'than expected. Squashing the extra together.'
-                                .format(page.path))
-
+        header = page.read_header()
+        if header is None:
             # Handle the case where no metadata was provided.
-            if len(splits) == 1:
-                page.original = splits[0]
-                page.meta = {}
-                page.original_preview = ''
-
-            elif len(splits) == 2:
-                header = splits[0]
-                page.meta = load_stream(header)
-                page.original = splits[1]
-                page.original_preview = page.meta.get('preview', '')
-
-            elif len(splits) >= 3:
-                header = splits[0]
-                page.meta = {}
-                page.original = '\n'.join(splits[1:])
-                page.original_preview = splits[1]
-                page.meta.update(load_stream(header))
-                logging.debug('Got preview')
+            page.meta = {}
+        else:
+            page.meta = load_stream(header, included=page.includes)
+        # used unless the body has a preview section
+        page.header_preview = page.meta.get('preview', '')
 
         page.build_meta()
-
-        page.engine.run_hook('page.render.pre', page)
-        page.meta['content'] = page.renderer.render(page.original)
-        page.meta['preview'] = page.renderer.render(page.original_preview)
-        page.engine.run_hook('page.render.post', page)
-
+        page.meta = PageMeta(page.meta, page.load_body)
+        # the preview is rendered with the body
+        page.meta.pop('preview', None)
+        if render_markup:
+            page.render_markup()
         return page
 
+    def read_header(self):
+        """
+        Read the source file up to the first `---` line. Returns the
+        metadata header, or None if there is none. The body is not read.
+        """
+        with io.open(self.path, 'rb') as f:
+            header, self.body_offset = frontmatter.read_header(f)
+        return header
+
+    def read_body(self):
+        """Read the text after the header into `original`, and the preview
+        into `original_preview`, unless they have been read already."""
+        if self.original is not None:
+            return
+        with io.open(self.path, 'rb') as f:
+            f.seek(self.body_offset)
+            text = frontmatter.decode(f.read())
+        preview, self.original = frontmatter.split_body(text, self.path)
+        if preview is None:
+            self.original_preview = self.header_preview
+        else:
+            self.original_preview = preview
+            logging.debug('Got preview')
+
+    def load_body(self):
+        """Render the body unless it has been rendered already. Returns the
+        rendered content and preview."""
+        if not self.meta._has_body():
+            self.render_markup()
+        return dict((key, dict.__getitem__(self.meta, key))
+                for key in PageMeta._body_keys)
+
+    def release(self):
+        """Forget the rendered page and, if it can be loaded again, the
+        body after the page has been written."""
+        self.rendered = None
+        if self.body_offset is not None:
+            self.original = None
+            self.original_preview = None
+            self.meta._release()
+
+    def render_markup(self):
+        """Render the original text and preview with the page renderer."""
+        self.read_body()
+        self.engine.run_hook('page.render.pre', self)
+        content, preview = self.engine.render_texts(self.renderer,
+                [self.original, self.original_preview])
+        self.meta['content'] = content
+        self.meta['preview'] = preview
+        self.engine.run_hook('page.render.post', self)
+
     def build_meta(self):
         """
         Ensures the guarantees about metadata for documents are valid.
@@ -260,14 +325,14 @@ class Page(object):
         logging.debug('Tags for {0}: {1}'.
                 format(self.meta['slug'], self.meta['tags']))
 
-        # pagination
-        if 'pagination' not in self.meta:
-            self.meta['pagination'] = {}
-
+        # pagination, a copy of included data
+        self.meta['pagination'] = dict(self.meta.get('pagination') or {})
         if 'cur_page' not in self.meta['pagination']:
             self.meta['pagination']['cur_page'] = 1
         if 'num_pages' not in self.meta['pagination']:
             self.meta['pagination']['num_pages'] = 1
+        # rendering adds the pages of the pagination list
+        self.original_pagination = dict(self.meta['pagination'])
 
         # template
         try:
@@ -282,7 +347,33 @@ class Page(object):
                           'match "{0}.*". Aborting.').format(template_type))
             sys.exit()
 
+        # Pull extensions from the template's real file name.
+        ext = os.path.splitext(self.template.filename)[1]
+        if ext:
+            ext = ext[1:] # remove leading dot
+        self.meta['ext'] = ext
+
         # url
+        if 'url' in self.meta:
+            logging.debug('Using page url pattern')
+            self.url_pattern = self.meta['url']
+        else:
+            logging.debug('Using global url pattern')
+            self.url_pattern = self.options['url_pattern']
+        self.build_url()
+
+        # subpages
+        self.meta['subpages'] = []
+
+        # encoding
+        if 'encoding' not in self.meta:
+            self.meta['encoding'] = 'utf-8'
+
+        self.engine.run_hook('page.meta.post', self)
+
+    def build_url(self):
+        """Fill in the `url`, `rooturl` and `path` of the page from its URL
+        pattern."""
         parts = {
             'slug': self.meta['slug'],
             'category': '/'.join(self.meta['category']),
@@ -290,27 +381,15 @@ class Page(object):
             'date': self.meta['date'],
             'datetime': self.meta['datetime'],
             'time': self.meta['time'],
+            'ext': self.meta['ext'],
         }
         logging.debug('current page: ' + repr(parts['page']))
-
-        # Pull extensions from the template's real file name.
-        parts['ext'] = os.path.splitext(self.template.filename)[1]
-        if parts['ext']:
-            parts['ext'] = parts['ext'][1:] # remove leading dot
         # Deprecated
         parts['type'] = parts['ext']
-        self.meta['ext'] = parts['ext']
 
         if parts['page'] == 1:
             parts['page'] = ''
 
-        if 'url' in self.meta:
-            logging.debug('Using page url pattern')
-            self.url_pattern = self.meta['url']
-        else:
-            logging.debug('Using global url pattern')
-            self.url_pattern = self.options['url_pattern']
-
         self.meta['url'] = self.url_pattern.format(**parts)
 
         logging.debug('URL pattern is: {0}'.format(self.url_pattern))
@@ -341,22 +420,36 @@ class Page(object):
 
         logging.debug('url is: ' + self.meta['url'])
 
-        # subpages
+    def reset(self):
+        """Forget the sub pages and pagination of the last build, before
+        the page is built again."""
         self.meta['subpages'] = []
-
-        # encoding
-        if 'encoding' not in self.meta:
-            self.meta['encoding'] = 'utf-8'
-
-        self.engine.run_hook('page.meta.post', self)
+        self.meta['pagination'] = dict(self.original_pagination)
 
     def render(self, templ_vars=None):
         """
         Renders the page with the template engine.
         """
-        logging.info('Rendering ' + self.meta['slug'])
         if not templ_vars:
             templ_vars = {}
+        extra_pages = self.prepare_render(templ_vars)
+        self.rendered = self.template.render(templ_vars)
+        logging.debug('extra pages is: ' + repr(extra_pages))
+        self.engine.run_hook('page.template.post', self)
+
+        return extra_pages
+
+    def prepare_render(self, templ_vars):
+        """
+        Fill in the template variables of the page and run the
+        `page.template.pre` hooks. Returns the extra pages of a
+        paginated page.
+        """
+        logging.info('Rendering ' + self.meta['slug'])
+
+        if isinstance(self.meta, PageMeta):
+            # the template of the page will most likely show the content
+            self.meta._load()
 
         # Handle pagination if we needed.
         if 'pagination' in self.meta and 'list' in self.meta['pagination']:
@@ -380,10 +473,6 @@ class Page(object):
         # ... and actions! (and logging, and hooking)
         self.engine.run_hook('page.template.pre', self, templ_vars)
         logging.debug('templ_vars.keys(): ' + repr(list(templ_vars.keys())))
-        self.rendered = self.template.render(templ_vars)
-        logging.debug('extra pages is: ' + repr(extra_pages))
-        self.engine.run_hook('page.template.post', self)
-
         return extra_pages
 
     def paginate(self, templ_vars):
@@ -395,22 +484,11 @@ class Page(object):
             # This is the first page of a set of pages. Set up the rest. Other
             # wise don't do anything.
 
-            source_spec = self.meta['pagination']['list'].split('.')
-            logging.debug('pagination source is: ' + repr(source_spec))
-
-            if source_spec[0] == 'page':
-                source = self.meta
-                source_spec.pop(0)
-            elif source_spec[0] == 'site':
-                source = templ_vars['site']
-                source_spec.pop(0)
-            else:
+            source = self.pagination_list(templ_vars.get('site'))
+            if source is None:
                 logging.error('Unknown pagination source! Not paginating')
                 return
 
-            for k in source_spec:
-                source = source[k]
-
             sort_key = self.meta['pagination'].get('sort_key', None)
             sort_reverse = self.meta['pagination'].get('sort_reverse', False)
 
@@ -419,16 +497,13 @@ class Page(object):
 
             if not source:
                 return extra_pages
-            if isinstance(source[0], Page):
-                source = [p.meta for p in source]
 
             if sort_key is not None:
-                if isinstance(source[0], dict):
-                    source.sort(key=lambda x: x[sort_key],
-                            reverse=sort_reverse)
-                else:
-                    source.sort(key=lambda x: x.__getattribute__(sort_key),
-                            reverse=sort_reverse)
+                # the source might be shared, eg. site.pages
+                source = self.engine.sorted_view(source, sort_key,
+                        sort_reverse)
+            elif isinstance(source[0], Page):
+                source = [p.meta for p in source]
 
             chunks = list(util.chunk(source, self.meta['pagination']['limit']))
             if not chunks:
@@ -436,20 +511,13 @@ class Page(object):
 
             # Make a page for each chunk
             for idx, chunk in enumerate(chunks[1:], 2):
-                new_meta = copy.deepcopy(self.meta)
-                new_meta.update({
-                    'url': self.url_pattern,
-                    'pagination': {
-                        'page_items': chunk,
-                        'num_pages': len(chunks),
-                        'cur_page': idx,
-                    }
+                new_page = self.pagination_page({
+                    'page_items': chunk,
+                    'num_pages': len(chunks),
+                    'cur_page': idx,
                 })
-                new_page = self.from_meta(new_meta, self.options, self.engine,
-                    renderer=self.renderer)
                 logging.debug('page {0} is {1}'.format(idx, new_page))
-                if new_page:
-                    extra_pages.append(new_page)
+                extra_pages.append(new_page)
 
             # Set up the next/previous page links
             for idx, page in enumerate(extra_pages):
@@ -476,8 +544,46 @@ class Page(object):
 
         return extra_pages
 
-    def write(self):
-        """Write the page to a rendered file on disk."""
+    def pagination_list(self, site):
+        """Get the list to paginate from the page or the given site
+        variables, or None if the list has an unknown source."""
+        source_spec = self.meta['pagination']['list'].split('.')
+        logging.debug('pagination source is: ' + repr(source_spec))
+
+        if source_spec[0] == 'page':
+            source = self.meta
+        elif source_spec[0] == 'site':
+            source = site
+        else:
+            return None
+
+        for k in source_spec[1:]:
+            source = source[k]
+        return source
+
+    def pagination_page(self, pagination):
+        """
+        Make a page for another part of the pagination list. Its metadata
+        only holds its own pagination, URL and sub pages, and shows the
+        metadata of this page otherwise.
+        """
+        page = type(self)(self.options, self.engine)
+        page.renderer = self.renderer
+        page.template = self.template
+        page.url_pattern = self.url_pattern
+        page.includes = self.includes
+        page.meta = util.Overlay({
+            'pagination': pagination,
+            'subpages': [],
+        }, self.meta)
+        self.engine.run_hook('page.meta.pre', page)
+        page.build_url()
+        page.original_pagination = dict(pagination)
+        self.engine.run_hook('page.meta.post', page)
+        return page
+
+    def output_path(self):
+        """Get the file name of the rendered page in the output directory."""
         output_dir = self.options['output_dir']
         path = self.meta['path']
         logging.debug('Write path URL %r' % path)
@@ -486,19 +592,140 @@ class Page(object):
         if path.startswith('/'):
             path = path[1:]
         path = path.replace('/', os.sep)
-        path = os.path.join(output_dir, path)
-        logging.info('Writing to {0}'.format(path))
-        parent = os.path.dirname(path)
-        if not os.path.exists(parent):
-            os.makedirs(parent)
-        with codecs.open(path, 'w', self.meta['encoding']) as f:
-            f.write(self.rendered)
+        return os.path.join(output_dir, path)
+
+    def write(self):
+        """Write the page to a rendered file on disk. Returns the encoded
+        output."""
+        path = self.output_path()
+        data = self.rendered.encode(self.meta['encoding'])
+        writer = self.engine.output_writer
+        if writer is None:
+            writer = OutputWriter(self.engine.output_sync)
+        writer.write(path, data)
+        return data
 
     def __repr__(self):
         """Get html-ified page info."""
         return "&lt;wok.page.Page '{0}'&gt;".format(self.meta['slug'])
 
 
+class PageMeta(dict):
+    """
+    Metadata of a page loaded from a file. The `content` and `preview`
+    are rendered when they are used first, by calling `load_body` which
+    returns both. The helpers start with an underscore, so that templates
+    find the header values with the same names instead of them.
+    """
+    _body_keys = ('content', 'preview')
+
+    def __init__(self, meta, load_body):
+        """Initialize the metadata."""
+        super(PageMeta, self).__init__(meta)
+        self._load_body = load_body
+
+    def __missing__(self, key):
+        """Load the body for the content and preview."""
+        if key not in self._body_keys:
+            raise KeyError(key)
+        self._load()
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        """The content and preview are always there."""
+        return key in self._body_keys or dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        """Get a value, loading the body if needed."""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def _load(self):
+        """Load the content and preview unless they are loaded."""
+        if not self._has_body():
+            self.update(self._load_body())
+
+    def _has_body(self):
+        """Check if the content and preview are loaded."""
+        return all(dict.__contains__(self, key) for key in self._body_keys)
+
+    def _release(self):
+        """Forget the content and preview."""
+        for key in self._body_keys:
+            self.pop(key, None)
+
+    def __deepcopy__(self, memo):
+        """Copy the metadata, which loads the same body."""
+        result = PageMeta({}, self._load_body)
+        memo[id(self)] = result
+        for key, value in self.items():
+            result[key] = copy.deepcopy(value, memo)
+        return result
+
+
+class ReleaseTracker(object):
+    """
+    Releases the bodies of written pages once no pagination set which is
+    still to be written lists them. A pagination set also shows the body
+    of its paginating page on its further pages.
+    """
+
+    def __init__(self, pages, site):
+        """Count the pagination sets listing each page, by the id of its
+        metadata."""
+        # id(meta) -> number of unfinished pagination sets listing it
+        self.counts = {}
+        # id(paginating page) -> ids of the listed metadata
+        self.listed = {}
+        # id(paginating page) -> pages of its set still to be written
+        self.remaining = {}
+        # id(further pagination page) -> paginating page
+        self.owners = {}
+        # id(meta) -> written page waiting for its release
+        self.waiting = {}
+        for page in pages:
+            pagination = page.meta.get('pagination') or {}
+            if 'list' not in pagination or 'page_items' in pagination:
+                continue
+            try:
+                items = page.pagination_list(site) or []
+            except (KeyError, IndexError, TypeError):
+                # paginate reports the error
+                continue
+            ids = set(id(item.meta if isinstance(item, Page) else item)
+                      for item in items)
+            ids.add(id(page.meta))
+            self.listed[id(page)] = ids
+            for key in ids:
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def add_pages(self, page, new_pages):
+        """Add the further pages of the pagination set of a page."""
+        self.remaining[id(page)] = len(new_pages) + 1
+        for new_page in new_pages:
+            self.owners[id(new_page)] = page
+
+    def done(self, page):
+        """Release a written or skipped page, unless a pagination set
+        still lists it, and the pages only listed by a finished set."""
+        owner = self.owners.pop(id(page), page)
+        if owner is page and self.counts.get(id(page.meta)):
+            self.waiting[id(page.meta)] = page
+        else:
+            page.release()
+        remaining = self.remaining.get(id(owner), 1) - 1
+        if remaining:
+            self.remaining[id(owner)] = remaining
+            return
+        self.remaining.pop(id(owner), None)
+        for key in self.listed.pop(id(owner), ()):
+            self.counts[key] -= 1
+            if not self.counts[key] and key in self.waiting:
+                self.waiting.pop(key).release()
+
+
 class Author(object):
     """Smartly manages a author with name and email"""
     parse_author_regex = re.compile(r'^([^<>]*) *(<(.*@.*)>)?$')
@@ -0,0 +1,79 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Run CPU bound tasks in a pool of worker processes.
+
+The worker processes are forked after the task list has been set up, so
+the tasks (functions, pages, template environments, ...) are inherited
+by the workers and never have to be pickled. Only the results are sent
+back to the main process.
+"""
+import os
+import logging
+
+# The tasks of the currently running pool.
+_tasks = None
+
+
+def cpu_count():
+    """Get number of CPUs, or 1 if unknown."""
+    import multiprocessing
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def get_pool(jobs):
+    """Get a pool of forked worker processes or None if forking is not
+    supported."""
+    import multiprocessing
+    get_context = getattr(multiprocessing, 'get_context', None)
+    if get_context is None:
+        # Python 2 forks on POSIX systems
+        if os.name != 'posix':
+            return None
+        return multiprocessing.Pool(jobs)
+    try:
+        return get_context('fork').Pool(jobs)
+    except ValueError:
+        return None
+
+
+def _run_task(index):
+    """Run a task in a worker process."""
+    func, args = _tasks[index]
+    return func(*args)
+
+
+def run_tasks(tasks, jobs):
+    """
+    Run the given list of (function, arguments) tuples with the given
+    number of worker processes. Returns the list of results in the order
+    of the tasks. The tasks are run in the current process if there is
+    only one job or if worker processes cannot be started. Errors of the
+    tasks are raised.
+    """
+    global _tasks
+    if jobs > 1 and len(tasks) > 1:
+        _tasks = tasks
+        try:
+            try:
+                pool = get_pool(min(jobs, len(tasks)))
+            except (OSError, ImportError) as e:
+                logging.warning('Cannot start worker processes ({0}), '
+                        'running serially.'.format(e))
+            else:
+                if pool is None:
+                    logging.warning('Worker processes are not supported '
+                            'on this system, running serially.')
+                else:
+                    try:
+                        chunksize = len(tasks) // (jobs * 4) + 1
+                        return pool.map(_run_task, range(len(tasks)),
+                                chunksize)
+                    finally:
+                        pool.close()
+                        pool.join()
+        finally:
+            _tasks = None
+    return [func(*args) for func, args in tasks]
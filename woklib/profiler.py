@@ -0,0 +1,160 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Measure where a build spends its time.
+
+The profiler records the wall clock and CPU time of the build phases, of
+every hook function by hook name, of the renderers and of the pages. The
+times are inclusive, eg. the time of a page contains the time of its
+hooks and of its markup rendered on demand. Work done in worker
+processes (see the `jobs` option) is part of the phases, but not of the
+hooks, renderers and pages.
+"""
+import io
+import json
+import time
+
+try:
+    from time import perf_counter as wall_clock, process_time as cpu_clock
+except ImportError:
+    # Python 2
+    wall_clock = time.time
+    cpu_clock = time.clock
+
+# The kinds of measured things, in report order.
+Kinds = ('phase', 'hook', 'renderer', 'page')
+
+
+def describe(obj):
+    """Get the module and name of a hook function or renderer."""
+    name = getattr(obj, '__name__', None)
+    if not name:
+        return repr(obj)
+    return '{0}.{1}'.format(getattr(obj, '__module__', None), name)
+
+
+class Timing(object):
+    """Number of calls, wall clock and CPU time of something measured."""
+
+    def __init__(self):
+        """Start with no calls."""
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def as_dict(self):
+        """Get the timing as JSON data."""
+        return {'calls': self.calls, 'wall': self.wall, 'cpu': self.cpu}
+
+
+class Measure(object):
+    """Context manager adding the time of its block to a timing."""
+
+    def __init__(self, timing):
+        """Initialize with the timing to update."""
+        self.timing = timing
+
+    def __enter__(self):
+        """Start the clocks."""
+        self.wall = wall_clock()
+        self.cpu = cpu_clock()
+
+    def __exit__(self, *exc_info):
+        """Stop the clocks, also if the block raised an error."""
+        self.timing.calls += 1
+        self.timing.wall += wall_clock() - self.wall
+        self.timing.cpu += cpu_clock() - self.cpu
+
+
+class NoMeasure(object):
+    """Context manager measuring nothing, used when not profiling."""
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+no_measure = NoMeasure()
+
+
+class Profiler(object):
+    """Collects the timings of a build."""
+
+    def __init__(self):
+        """Start the build timer."""
+        self.timings = dict((kind, {}) for kind in Kinds)
+        # phases are reported in the order they ran
+        self.phases = []
+        self.total = Timing()
+        self.build = Measure(self.total)
+        self.build.__enter__()
+
+    def measure(self, kind, name):
+        """Get a context manager measuring the time of a block."""
+        timings = self.timings[kind]
+        timing = timings.get(name)
+        if timing is None:
+            timing = timings[name] = Timing()
+            if kind == 'phase':
+                self.phases.append(name)
+        return Measure(timing)
+
+    def stop(self):
+        """Stop the build timer."""
+        self.build.__exit__(None, None, None)
+
+    def slowest(self, kind, top):
+        """Get the names and timings of the slowest items of a kind."""
+        items = sorted(self.timings[kind].items(),
+                key=lambda item: item[1].wall, reverse=True)
+        return items[:top]
+
+    def as_dict(self):
+        """Get all timings as JSON data."""
+        data = {
+            'total': self.total.as_dict(),
+            'phases': [dict(self.timings['phase'][name].as_dict(),
+                            name=name) for name in self.phases],
+        }
+        for kind in Kinds[1:]:
+            data[kind + 's'] = dict((name, timing.as_dict())
+                for name, timing in self.timings[kind].items())
+        return data
+
+    def write_json(self, filename):
+        """Write all timings to a JSON file."""
+        text = json.dumps(self.as_dict(), indent=1, sort_keys=True)
+        with io.open(filename, 'w', encoding='utf-8') as f:
+            # Python 2 dumps byte strings
+            f.write(type(u'')(text))
+
+    def report(self, top=10):
+        """Get a text report of the phases and the slowest hooks,
+        renderers and pages."""
+        line = u'{0:<50} {1:>6} {2:>9} {3:>9}'
+        lines = [line.format(u'Build', u'calls', u'wall', u'cpu'),
+                 line.format(u'total', 1, u'{0:.3f}s'.format(self.total.wall),
+                             u'{0:.3f}s'.format(self.total.cpu))]
+        titles = {
+            'phase': u'Phases',
+            'hook': u'Slowest hooks',
+            'renderer': u'Slowest renderers',
+            'page': u'Slowest pages',
+        }
+        for kind in Kinds:
+            if kind == 'phase':
+                items = [(name, self.timings[kind][name])
+                         for name in self.phases]
+            else:
+                items = self.slowest(kind, top)
+            if not items:
+                continue
+            lines.append(u'')
+            lines.append(titles[kind])
+            for name, timing in items:
+                if len(name) > 50:
+                    name = u'...' + name[-47:]
+                lines.append(line.format(name, timing.calls,
+                    u'{0:.3f}s'.format(timing.wall),
+                    u'{0:.3f}s'.format(timing.cpu)))
+        return u'\n'.join(lines)
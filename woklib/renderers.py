@@ -1,7 +1,19 @@
 # -*- coding: iso-8859-1 -*-
+"""
+Markup renderers.
+
+The available libraries are found without importing them. A library is
+imported when the first text is rendered with it, so a site only pays for
+the libraries of the markup it uses. The Markdown and docutils objects are
+set up once per thread and reused for all texts.
+"""
 from __future__ import print_function
+import copy
 import logging
-from .util import has_module
+import importlib
+import threading
+from . import highlight
+from .util import has_module, module_version
 
 if not has_module('pygments'):
     logging.warn('Pygments not enabled.')
@@ -9,14 +21,65 @@ if not has_module('pygments'):
 # List of available renderers
 all = []
 
+# Markup processors of the current thread, by renderer name.
+_local = threading.local()
+
+
+def thread_instance(name, config, create):
+    """
+    Get the object of this thread stored under name, which is created
+    again by calling `create` if the configuration changed. Worker
+    processes get a copy of the objects of their parent.
+    """
+    instances = getattr(_local, 'instances', None)
+    if instances is None:
+        instances = _local.instances = {}
+    instance = instances.get(name)
+    if instance is None or instance[0] != config:
+        instance = instances[name] = (config, create())
+    return instance[1]
+
+
+def render_many(renderer, texts):
+    """Render a list of texts with any renderer."""
+    func = getattr(renderer, 'render_many', None)
+    if func is not None:
+        return func(texts)
+    return [renderer.render(text) for text in texts]
+
+
 class Renderer(object):
     """Base renderer class."""
     extensions = []
 
+    # modules imported by `load`
+    modules = ()
+
+    @classmethod
+    def load(cls):
+        """Import the libraries of the renderer. They are imported when
+        the first text is rendered, or before if called."""
+        for name in cls.modules:
+            importlib.import_module(name)
+
     @classmethod
     def render(cls, plain):
         """Render text."""
         return plain
+
+    @classmethod
+    def render_many(cls, texts):
+        """Render a list of texts."""
+        return [cls.render(text) for text in texts]
+
+    @classmethod
+    def cache_key(cls):
+        """
+        Get a string identifying the renderer and its configuration, used
+        to cache rendered text. The output of renderers returning None is
+        not cached.
+        """
+        return None
 all.append(Renderer)
 
 class Plain(Renderer):
@@ -31,29 +94,49 @@ all.append(Plain)
 
 # Include markdown, if it is available.
 if has_module('markdown'):
-    from markdown import markdown
     class Markdown(Renderer):
         """Markdown renderer."""
         extensions = ['markdown', 'mkd', 'md']
+        modules = ('markdown',)
 
         plugins = ['def_list', 'footnotes']
         if has_module('pygments'):
             plugins.extend(['codehilite(css_class=codehilite)', 'fenced_code'])
 
+        @classmethod
+        def markdown(cls):
+            """Get the Markdown processor of this thread."""
+            def create():
+                from markdown import Markdown
+                highlight.install_markdown()
+                return Markdown(extensions=list(cls.plugins))
+            return thread_instance('Markdown', list(cls.plugins), create)
+
         @classmethod
         def render(cls, plain):
             """Render markdown text."""
-            return markdown(plain, cls.plugins)
+            md = cls.markdown()
+            try:
+                return md.convert(plain)
+            finally:
+                # forget footnotes, references, ... of this text
+                md.reset()
+
+        @classmethod
+        def cache_key(cls):
+            """Markdown and Pygments version and plugins."""
+            return 'Markdown {0} {1} {2!r}'.format(module_version('markdown'),
+                    module_version('pygments'), cls.plugins)
 
     all.append(Markdown)
 else:
     logging.warn("markdown isn't available, trying markdown2")
     # Try Markdown2
     if has_module('markdown2'):
-        import markdown2
         class Markdown2(Renderer):
             """Markdown2 renderer."""
             extensions = ['markdown', 'mkd', 'md']
+            modules = ('markdown2',)
 
             extras = ['def_list', 'footnotes']
             if has_module('pygments'):
@@ -62,7 +145,19 @@ else:
             @classmethod
             def render(cls, plain):
                 """Render markdown text."""
-                return markdown2.markdown(plain, extras=cls.extras)
+                def create():
+                    import markdown2
+                    return markdown2.Markdown(extras=list(cls.extras))
+                # convert resets the processor for every text
+                md = thread_instance('Markdown2', list(cls.extras), create)
+                return md.convert(plain)
+
+            @classmethod
+            def cache_key(cls):
+                """Markdown2 and Pygments version and extras."""
+                return 'Markdown2 {0} {1} {2!r}'.format(
+                        module_version('markdown2'),
+                        module_version('pygments'), cls.extras)
 
         all.append(Markdown2)
     else:
@@ -71,23 +166,65 @@ else:
 
 # Include ReStructuredText Parser, if we have docutils
 if has_module('docutils'):
-    import docutils.core
-    from docutils.writers.html4css1 import Writer as rst_html_writer
-    from docutils.parsers.rst import directives
-
-    if has_module('pygments'):
-        from .rst_pygments import Pygments as RST_Pygments
-        directives.register_directive('Pygments', RST_Pygments)
-
     class ReStructuredText(Renderer):
         """reStructuredText renderer."""
         extensions = ['rst']
+        modules = ('docutils.core', 'docutils.readers.standalone',
+                   'docutils.parsers.rst', 'docutils.writers.html4css1')
+
+        # if the Pygments directive has been registered
+        loaded = False
+
+        @classmethod
+        def load(cls):
+            """Import docutils and register the Pygments directive."""
+            super(ReStructuredText, cls).load()
+            if not cls.loaded and has_module('pygments'):
+                from docutils.parsers.rst import directives
+                from .rst_pygments import Pygments as RST_Pygments
+                directives.register_directive('Pygments', RST_Pygments)
+            cls.loaded = True
+
+        @classmethod
+        def publisher(cls):
+            """Get the reader, parser, writer and settings of this thread,
+            set up like `docutils.core.publish_parts` does."""
+            def create():
+                if not cls.loaded:
+                    cls.load()
+                import docutils.core
+                from docutils.readers.standalone import Reader
+                from docutils.parsers.rst import Parser
+                from docutils.writers.html4css1 import Writer
+                pub = docutils.core.Publisher(Reader(), Parser(), Writer())
+                pub.process_programmatic_settings(None, None, None)
+                return pub.reader, pub.parser, pub.writer, pub.settings
+            return thread_instance('ReStructuredText', None, create)
 
         @classmethod
         def render(cls, plain):
             """Render reStructuredText text."""
-            w = rst_html_writer()
-            return docutils.core.publish_parts(plain, writer=w)['body']
+            import docutils.core
+            import docutils.io
+            import docutils.utils
+            reader, parser, writer, settings = cls.publisher()
+            # the settings of one document
+            settings = copy.copy(settings)
+            settings.record_dependencies = docutils.utils.DependencyList()
+            pub = docutils.core.Publisher(reader, parser, writer,
+                    source_class=docutils.io.StringInput,
+                    destination_class=docutils.io.StringOutput,
+                    settings=settings)
+            pub.set_source(plain, None)
+            pub.set_destination(None, None)
+            pub.publish(enable_exit_status=False)
+            return pub.writer.parts['body']
+
+        @classmethod
+        def cache_key(cls):
+            """Docutils and Pygments version."""
+            return 'ReStructuredText {0} {1}'.format(
+                    module_version('docutils'), module_version('pygments'))
 
     all.append(ReStructuredText)
 else:
@@ -96,16 +233,22 @@ else:
 
 # Try Textile
 if has_module('textile'):
-    import textile
     class Textile(Renderer):
         """Textile renderer."""
         extensions = ['textile']
+        modules = ('textile',)
 
         @classmethod
         def render(cls, plain):
             """Render textile text."""
+            import textile
             return textile.textile(plain)
 
+        @classmethod
+        def cache_key(cls):
+            """Textile version."""
+            return 'Textile {0}'.format(module_version('textile'))
+
     all.append(Textile)
 else:
     logging.warn('Textile not enabled.')
@@ -55,7 +55,7 @@ VARIANTS = {
 from docutils import nodes
 from docutils.parsers.rst import directives, Directive
 
-from pygments import highlight
+from .highlight import highlight
 from pygments.lexers import get_lexer_by_name, TextLexer
 
 class Pygments(Directive):
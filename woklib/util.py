@@ -5,17 +5,53 @@ import os
 from unicodedata import normalize
 from datetime import date, time, datetime
 import importlib
+import itertools
+try:
+    from importlib.util import find_spec
+except ImportError:
+    # Python 2
+    import imp
+    find_spec = None
+try:
+    from collections.abc import MutableMapping, Sequence
+except ImportError:
+    # Python 2
+    from collections import MutableMapping, Sequence
+try:
+    from types import MappingProxyType
+except ImportError:
+    # Python 2 has no read-only dictionary view
+    MappingProxyType = dict
 
 
 def has_module (name):
-    """Test if given module can be imported."""
+    """Test if given module can be imported, without importing it."""
+    if name in sys.modules:
+        return sys.modules[name] is not None
+    if find_spec is None:
+        try:
+            imp.find_module(name)
+            return True
+        except ImportError:
+            return False
     try:
-        importlib.import_module(name)
-        return True
-    except ImportError:
+        return find_spec(name) is not None
+    except (ImportError, ValueError):
         return False
 
 
+def module_version(name):
+    """Get the version string of a module, which is imported if needed."""
+    try:
+        module = importlib.import_module(name)
+    except ImportError:
+        module = None
+    version = getattr(module, '__version__', None)
+    if version is None:
+        version = getattr(module, 'version', '')
+    return str(version)
+
+
 def is_sane_outdir(dirname, site_root):
     """Check if a directory can be used as output dir."""
     if not os.path.isdir(dirname):
@@ -54,10 +90,115 @@ def slugify(text, delim=u'-'):
     return delim.join(words).strip(delim)
 
 
+class SliceView(Sequence):
+    """Read-only view of a part of a list, which is not copied."""
+
+    def __init__(self, items, start, stop):
+        """View the items from start up to stop."""
+        self.items = items
+        self.start = start
+        self.stop = min(stop, len(items))
+
+    def __len__(self):
+        """Get number of viewed items."""
+        return max(self.stop - self.start, 0)
+
+    def __getitem__(self, index):
+        """Get an item or a list of items."""
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('view index out of range')
+        return self.items[self.start + index]
+
+    def __iter__(self):
+        """Iterate over the viewed items."""
+        return itertools.islice(self.items, self.start, self.stop)
+
+    def __eq__(self, other):
+        """Compare the items with another sequence."""
+        if not isinstance(other, (list, tuple, SliceView)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        """Compare the items with another sequence."""
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        """Get representation of the items."""
+        return repr(list(self))
+
+
+class Overlay(MutableMapping):
+    """
+    Own values in front of a shared mapping, which is not copied. Lookups
+    search the own values first, changes only affect the own values.
+    Unlike a ChainMap it has no public attributes, so templates looking up
+    `var.name` find the value of the key `name`.
+    """
+
+    def __init__(self, own, shared):
+        """Show the own values in front of the shared mapping."""
+        self._own = own
+        self._shared = shared
+
+    def __getitem__(self, key):
+        """Get the own value, or the shared one."""
+        if key in self._own:
+            return self._own[key]
+        return self._shared[key]
+
+    def __contains__(self, key):
+        """Check if there is an own or shared value."""
+        return key in self._own or key in self._shared
+
+    def __len__(self):
+        """Get number of distinct keys."""
+        return sum(1 for key in self)
+
+    def __iter__(self):
+        """Iterate over the own keys, then the other shared keys."""
+        for key in self._own:
+            yield key
+        for key in self._shared:
+            if key not in self._own:
+                yield key
+
+    def __setitem__(self, key, value):
+        """Set an own value."""
+        self._own[key] = value
+
+    def __delitem__(self, key):
+        """Delete an own value."""
+        del self._own[key]
+
+    def __repr__(self):
+        """Get representation of the own and shared values."""
+        return '{0}({1!r}, {2!r})'.format(self.__class__.__name__,
+                self._own, self._shared)
+
+
 def chunk(li, n):
-    """Yield succesive n-size chunks from l."""
+    """Yield succesive n-size chunks from l, as views of l."""
     for i in range(0, len(li), n):
-        yield li[i:i+n]
+        yield SliceView(li, i, i+n)
+
+
+def sort_items(items, key, reverse=False):
+    """Get a sorted copy of a list of pages or page metadata, sorted by
+    the given key or attribute."""
+    if isinstance(items[0], dict):
+        return sorted(items, key=lambda x: x[key], reverse=reverse)
+    return sorted(items, key=lambda x: x.__getattribute__(key),
+            reverse=reverse)
 
 
 def date_and_times(meta):
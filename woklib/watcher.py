@@ -0,0 +1,284 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Watch directory trees for changes in a background thread.
+
+On Linux the kernel notifies about changes with inotify, elsewhere the
+trees are scanned periodically. Changes are debounced: a batch of changed
+paths is only reported once no further change happened for a short delay,
+so that saving many files at once results in one rebuild.
+"""
+import os
+import sys
+import errno
+import select
+import struct
+import logging
+import threading
+
+
+class Watcher(object):
+    """Base class of watchers collecting changed paths."""
+
+    def __init__(self, dirs, delay=0.1):
+        """Watch the given directories, reporting changes after
+        `delay` seconds without further changes."""
+        self.dirs = [os.path.abspath(d) for d in dirs]
+        self.delay = delay
+        self.lock = threading.Lock()
+        # changes which have settled and can be reported
+        self.changes = set()
+        # changes of the current batch
+        self.pending = set()
+        # set if there are changes to report
+        self.changed = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start watching in a background thread."""
+        self.thread = threading.Thread(target=self.run, name='wok watcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop watching."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """Collect changes until stopped."""
+        raise NotImplementedError()
+
+    def flush(self):
+        """Report the pending changes."""
+        if self.pending:
+            logging.debug('Changed: {0}'.format(sorted(self.pending)))
+            with self.lock:
+                self.changes.update(self.pending)
+                self.changed.set()
+            self.pending = set()
+
+    def get_changes(self):
+        """Get the set of changed paths since the last call. This never
+        blocks."""
+        with self.lock:
+            changes = self.changes
+            self.changes = set()
+            self.changed.clear()
+        return changes
+
+    def wait_for_changes(self, timeout=None):
+        """Wait until changes can be reported and get them. Returns an
+        empty set after the timeout."""
+        self.changed.wait(timeout)
+        return self.get_changes()
+
+
+class PollingWatcher(Watcher):
+    """Find changes by scanning the directory trees periodically."""
+
+    def __init__(self, dirs, delay=0.1, interval=1.0):
+        """Scan the directories every `interval` seconds."""
+        super(PollingWatcher, self).__init__(dirs, delay)
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        """Get the modification time and size of all files."""
+        snapshot = {}
+        for d in self.dirs:
+            for root, dirs, files in os.walk(d):
+                for f in files:
+                    path = os.path.join(root, f)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        # removed while scanning
+                        continue
+                    snapshot[path] = (st.st_mtime, st.st_size)
+        return snapshot
+
+    def run(self):
+        """Compare snapshots until stopped."""
+        while not self.stopped.wait(self.interval):
+            snapshot = self.scan()
+            # changed, added and removed files
+            changed = set(path for path, value in snapshot.items()
+                if self.snapshot.get(path) != value)
+            changed.update(set(self.snapshot) - set(snapshot))
+            self.snapshot = snapshot
+            if changed:
+                self.pending.update(changed)
+            else:
+                # one interval without changes is more than the delay
+                self.flush()
+
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WatchMask = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+    IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+# struct inotify_event without the name
+EventHeader = struct.Struct('iIII')
+
+
+def load_libc():
+    """Get the C library with the inotify functions."""
+    import ctypes
+    import ctypes.util
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+        use_errno=True)
+    # raises AttributeError if inotify is not available
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+        ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+class InotifyWatcher(Watcher):
+    """Get notified about changes by the Linux kernel."""
+
+    def __init__(self, dirs, delay=0.1):
+        """Set up the inotify watches of all directories."""
+        super(InotifyWatcher, self).__init__(dirs, delay)
+        self.libc = load_libc()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self.get_errno(), 'inotify_init1 failed')
+        # watch descriptor -> directory
+        self.watches = {}
+        try:
+            for d in self.dirs:
+                self.add_tree(d)
+        except OSError:
+            # eg. the limit of inotify watches has been reached
+            os.close(self.fd)
+            raise
+
+    def get_errno(self):
+        """Get the error number of the last failed libc call."""
+        import ctypes
+        return ctypes.get_errno()
+
+    def add_tree(self, top):
+        """Watch a directory and its subdirectories."""
+        for root, dirs, files in os.walk(top):
+            path = root
+            if not isinstance(path, bytes):
+                path = path.encode(sys.getfilesystemencoding())
+            wd = self.libc.inotify_add_watch(self.fd, path, WatchMask)
+            if wd < 0:
+                err = self.get_errno()
+                if err == errno.ENOENT:
+                    # removed in the meantime
+                    continue
+                raise OSError(err, 'cannot watch {0}'.format(root))
+            self.watches[wd] = root
+
+    def remove_tree(self, top):
+        """Stop watching a directory and its subdirectories, eg. after
+        they have been moved away."""
+        prefix = os.path.join(top, '')
+        for wd, root in list(self.watches.items()):
+            if root == top or root.startswith(prefix):
+                del self.watches[wd]
+                self.libc.inotify_rm_watch(self.fd, wd)
+
+    def run(self):
+        """Read events until stopped. Errors are logged, the watcher
+        keeps going."""
+        try:
+            while not self.stopped.is_set():
+                try:
+                    self.wait_for_events()
+                except Exception:
+                    logging.exception('Error watching for file changes')
+                    self.stopped.wait(self.delay)
+        finally:
+            os.close(self.fd)
+
+    def wait_for_events(self):
+        """Handle the events of a short while, or report the pending
+        changes if there were none."""
+        # wait for the debounce delay if changes are pending
+        timeout = self.delay if self.pending else 0.5
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            self.read_events()
+        else:
+            self.flush()
+
+    def read_events(self):
+        """Read and handle the available events."""
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+        offset = 0
+        while offset + EventHeader.size <= len(data):
+            wd, mask, cookie, length = EventHeader.unpack_from(data, offset)
+            offset += EventHeader.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            self.handle_event(wd, mask, name)
+
+    def handle_event(self, wd, mask, name):
+        """Record the path of an event."""
+        if mask & IN_Q_OVERFLOW:
+            # events have been lost, assume everything changed
+            logging.warning('Too many file changes, rebuilding everything.')
+            self.pending.update(self.dirs)
+            return
+        root = self.watches.get(wd)
+        if root is None:
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            del self.watches[wd]
+        if name:
+            name = name.decode(sys.getfilesystemencoding())
+            path = os.path.join(root, name)
+        else:
+            path = root
+        if mask & IN_ISDIR and mask & IN_MOVED_FROM:
+            # the watches would report the old paths of the moved directory
+            self.remove_tree(path)
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            # new directory, watch it and its contents
+            try:
+                self.add_tree(path)
+            except OSError as e:
+                # eg. the limit of inotify watches has been reached
+                logging.error('Cannot watch {0} for changes: {1}'
+                        .format(path, e))
+            for subroot, dirs, files in os.walk(path):
+                self.pending.update(os.path.join(subroot, f) for f in files)
+        self.pending.add(path)
+
+
+def get_watcher(dirs, delay=0.1):
+    """Get the best available watcher for the given directories, which
+    need to exist. The watcher is not started yet."""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(dirs, delay)
+        except (OSError, AttributeError) as e:
+            logging.info('Cannot use inotify, polling for changes: {0}'
+                    .format(e))
+    return PollingWatcher(dirs, delay)
@@ -1,18 +1,73 @@
 # -*- coding: iso-8859-1 -*-
 """
 YAML configuration file loading routines.
+
+The libyaml C loader is used when PyYAML has been built with it. Headers
+consisting only of simple `key: value` lines are parsed without YAML.
 """
 import yaml
 import os
+import re
 import codecs
+from yaml.nodes import ScalarNode
+from yaml.reader import Reader
+from yaml.resolver import Resolver
+from yaml.constructor import SafeConstructor
 
 # Force UTF-8 encoding for all Yaml files.
 YamlEncoding = 'utf-8'
 
-class Loader(yaml.SafeLoader):
-    """Loader with file inclusion support.
+# Included files of the current build:
+# absolute path -> (mtime, data, paths of the files it includes)
+_includes = {}
+
+def _read_only(self, *args, **kwargs):
+    """Refuse to change included data."""
+    raise TypeError('included YAML data is read-only')
+
+
+class FrozenDict(dict):
+    """Read-only dict of included data, shared by all pages."""
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        """Copy and pickle without __setitem__."""
+        return (FrozenDict, (dict(self),))
+
+
+class FrozenList(list):
+    """Read-only list of included data, shared by all pages."""
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+    clear = _read_only
+
+    def __reduce__(self):
+        """Copy and pickle without append."""
+        return (FrozenList, (list(self),))
+
+
+def freeze(value):
+    """Get a read-only copy of loaded YAML data."""
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(item) for item in value)
+    if isinstance(value, tuple):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+class IncludeMixin(object):
+    """Loader mixin with file inclusion support.
        a: !include b.yaml
     """
+    # list of the paths of all included files, if they are recorded
+    included = None
 
     def __init__(self, stream):
         """Initialize root name."""
@@ -20,20 +75,124 @@ class Loader(yaml.SafeLoader):
             self._root = os.path.split(stream.name)[0]
         else:
             self._root = ""
-        super(Loader, self).__init__(stream)
+        super(IncludeMixin, self).__init__(stream)
 
     def include(self, node):
-        """Include a file."""
-        filename = os.path.join(self._root, self.construct_scalar(node))
-        with codecs.open(filename, 'r', YamlEncoding) as f:
-            return yaml.load(f, Loader)
+        """Include a file. Each file is parsed once per build, and all
+        pages share its data, which is read-only."""
+        filename = os.path.abspath(os.path.join(self._root,
+            self.construct_scalar(node)))
+        mtime = os.path.getmtime(filename)
+        included = _includes.get(filename)
+        if included is None or included[0] != mtime:
+            nested = []
+            with codecs.open(filename, 'r', YamlEncoding) as f:
+                data = load_stream(f, type(self), nested)
+            included = (mtime, freeze(data), nested)
+            _includes[filename] = included
+        if self.included is not None:
+            self.included.append(filename)
+            self.included.extend(included[2])
+        return included[1]
+
+
+class PyLoader(IncludeMixin, yaml.SafeLoader):
+    """Pure Python loader."""
+
+PyLoader.add_constructor('!include', PyLoader.include)
+
+try:
+    class CLoader(IncludeMixin, yaml.CSafeLoader):
+        """Loader using libyaml."""
+
+    CLoader.add_constructor('!include', CLoader.include)
+    Loader = CLoader
+except AttributeError:
+    # PyYAML without libyaml
+    CLoader = None
+    Loader = PyLoader
+
+
+# A line with a key and a plain scalar value which cannot start a
+# collection, a comment, an alias, a tag, or a quoted or block scalar.
+SimpleLine = re.compile(u"""^([A-Za-z_][A-Za-z0-9_-]*):[ ]+
+    ([^\\s\\-?:,\\[\\]{}#&*!|>'"%@`][^#\\t\\r\x85\u2028\u2029]*?)[ ]*$""",
+    re.VERBOSE)
+
+StrTag = 'tag:yaml.org,2002:str'
+
+# Tags of plain scalars which are constructed without YAML.
+SimpleTags = frozenset([
+    StrTag,
+    'tag:yaml.org,2002:int',
+    'tag:yaml.org,2002:float',
+    'tag:yaml.org,2002:bool',
+    'tag:yaml.org,2002:null',
+    'tag:yaml.org,2002:timestamp',
+])
+
+_resolver = Resolver()
+_constructor = SafeConstructor()
+
+
+def _resolve(value):
+    """Get the tag of a plain scalar."""
+    return _resolver.resolve(ScalarNode, value, (True, False))
+
+
+def _construct(tag, value):
+    """Construct a plain scalar the way YAML does."""
+    node = ScalarNode(tag, value)
+    return _constructor.yaml_constructors[tag](_constructor, node)
+
+
+def clear_includes():
+    """Forget the included files at the end of a build."""
+    _includes.clear()
+
 
-Loader.add_constructor('!include', Loader.include)
+def load_simple(text):
+    """Parse a header made of `key: value` lines without YAML. Returns None
+    if the header needs the YAML parser."""
+    if Reader.NON_PRINTABLE.search(text):
+        return None
+    meta = {}
+    for line in text.split('\n'):
+        if not line.strip():
+            continue
+        match = SimpleLine.match(line)
+        if match is None:
+            return None
+        key, value = match.groups()
+        if ': ' in value or value.endswith(':'):
+            return None
+        if _resolve(key) != StrTag:
+            # eg. yes or null as key
+            return None
+        tag = _resolve(value)
+        if tag not in SimpleTags:
+            return None
+        meta[_construct(StrTag, key)] = _construct(tag, value)
+    if not meta:
+        return None
+    return meta
 
 
-def load_stream(stream):
-    """Load options from a YAML stream."""
-    return yaml.load(stream, Loader)
+def load_stream(stream, loader=None, included=None):
+    """Load options from a YAML stream or string. The paths of the files
+    it includes are added to the `included` list, if given."""
+    if loader is None:
+        if not hasattr(stream, 'read'):
+            meta = load_simple(stream)
+            if meta is not None:
+                return meta
+        loader = Loader
+    loader = loader(stream)
+    loader.included = included
+    try:
+        return loader.get_single_data()
+    finally:
+        loader.dispose()
 
 
 def load_file(filename):